@@ -3,34 +3,251 @@ api.py — FastAPI backend for Energy404
 ---------------------------------------
 Exposes REST endpoints for solar potential predictions.
 """
+import asyncio
+import gc
+import hmac
+import json
+import os
+import signal
 import sys
+import threading
+import time
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
 
 # === Ensure we can import from pipeline/ ===
 BASE_DIR = Path(__file__).resolve().parent
 sys.path.append(str(BASE_DIR / "pipeline"))
 
-from predict import predict_energy  # ✅ same as app.py
+import predict
+from predict import DATA_DIR, MODELS_DIR, predict_energy, predict_energy_batch  # ✅ same as app.py
+from cache import PredictionCache
+from compiled import COMPILED_DIRNAME
+from compress import COMPACT_DIRNAME
+from cube import CUBE_DIRNAME, CUBE_FILENAME, CubeStore
+from grid import MODEL_FILES, WEATHER_FILE
+from scheduler import InferenceScheduler, QueueFullError
+from tiers import TIERS_FILENAME, check_tier
+import arrow_io
+import batch_io
+import metrics
+import profiler
+import tilt
+
+# ===== Micro-batching settings =====
+# Concurrent /predict calls arriving within BATCH_WINDOW_MS (or until
+# MAX_BATCH are queued) are scored together in one vectorized call.
+MICROBATCH = os.environ.get("ENERGY404_MICROBATCH", "1") != "0"
+scheduler = InferenceScheduler(
+    predict_energy_batch,
+    window_ms=float(os.environ.get("ENERGY404_BATCH_WINDOW_MS", "2")),
+    max_batch=int(os.environ.get("ENERGY404_MAX_BATCH", "64")),
+    queue_depth=int(os.environ.get("ENERGY404_QUEUE_DEPTH", "1024")),
+)
+
+# ===== Prediction cache =====
+# LRU cache of single predictions keyed on (model version, city, building_type,
+# tilt rounded to CACHE_TILT_DECIMALS, tier). Dropped automatically when any
+# artifact of the active version or city_weather.csv changes on disk.
+# ENERGY404_CACHE_SIZE=0 disables it.
+def _watch_paths(models_dir: Path) -> list:
+    return ([models_dir / f for f in MODEL_FILES + [TIERS_FILENAME]]
+            + [models_dir / COMPILED_DIRNAME / "meta.json", models_dir / COMPACT_DIRNAME / "meta.json"]
+            + [DATA_DIR / WEATHER_FILE])
+
+prediction_cache = PredictionCache(
+    _watch_paths(predict.slot.current.path),
+    maxsize=int(os.environ.get("ENERGY404_CACHE_SIZE", "4096")),
+    tilt_decimals=int(os.environ.get("ENERGY404_CACHE_TILT_DECIMALS", "1")),
+)
+prediction_cache.on_invalidate(tilt.clear_cache)
+
+# A model hot-swap (see /models) watches the new version's files and
+# invalidates every cached prediction; calls still finishing on the old
+# version put() with its older generation and are dropped.
+def _on_model_swap(version) -> None:
+    prediction_cache.watch(_watch_paths(version.path))
+    prediction_cache.clear(version.generation)
+
+predict.on_swap(_on_model_swap)
+
+# ===== Profiling / tracing =====
+# Admin endpoints are only mounted-in when ENERGY404_ADMIN_TOKEN is set and
+# must be called with a matching X-Admin-Token header. `kill -USR2 <pid>`
+# starts a PROFILE_SECONDS profile without going through HTTP.
+ADMIN_TOKEN = os.environ.get("ENERGY404_ADMIN_TOKEN")
+PROFILE_SECONDS = float(os.environ.get("ENERGY404_PROFILE_SECONDS", "10"))
+TRACE_HEADER = "x-energy404-trace"
+
+# ===== Aggregate cube (see pipeline/cube.py) =====
+# Loaded on first use and reloaded when cube.npz is rebuilt.
+cube_store = CubeStore(DATA_DIR / CUBE_DIRNAME / CUBE_FILENAME)
+
+# Rows scored per vectorized call in /predict/batch (bounds memory per upload)
+BATCH_CHUNK_ROWS = int(os.environ.get("ENERGY404_BATCH_CHUNK_ROWS", "5000"))
+# Longest accepted NDJSON / CSV line; longer ones become inline row errors
+BATCH_MAX_LINE_BYTES = int(os.environ.get("ENERGY404_BATCH_MAX_LINE_BYTES", str(batch_io.MAX_LINE_BYTES)))
+# ... and per record batch for Arrow / Parquet uploads (held in memory whole)
+ARROW_CHUNK_ROWS = int(os.environ.get("ENERGY404_ARROW_CHUNK_ROWS", "65536"))
+
+# ===== Preload (multi-worker serving, see gunicorn.conf.py) =====
+# ENERGY404_PRELOAD=1 loads every model at import time. Under gunicorn's
+# preload_app the master imports this module once and forks the workers,
+# which then share the model memory copy-on-write. gc.freeze() moves the
+# loaded objects out of the collector's reach so GC passes in the workers
+# do not write to (and thereby copy) their pages.
+PRELOAD = os.environ.get("ENERGY404_PRELOAD", "0") == "1"
+if PRELOAD:
+    predict.slot.current.store.load_all()
+    gc.collect()
+    gc.freeze()
+
+# ===== Startup: load models in the background =====
+# The server accepts connections immediately; /ready flips to 200 only once
+# every model artifact is in memory. Requests arriving earlier still work,
+# they just load what they need on demand.
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    store = predict.slot.current.store
+    if not store.ready.is_set():
+        threading.Thread(target=store.load_all, name="model-loader", daemon=True).start()
+    if MICROBATCH:
+        scheduler.start()
+    if hasattr(signal, "SIGUSR2"):
+        try:
+            signal.signal(signal.SIGUSR2, lambda *_: profiler.start_in_background(PROFILE_SECONDS))
+        except ValueError:
+            pass  # not in the main thread (e.g. embedded in another server)
+    yield
+    scheduler.stop()
 
 app = FastAPI(
     title="Energy404 Solar Potential API",
     description="Predict annual rooftop solar energy potential (kWh/m²) for a given city, building type, and tilt.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+# ===== Request metrics (see pipeline/metrics.py; ENERGY404_METRICS=0 disables) =====
+# Plain ASGI middleware so streaming request/response bodies pass through untouched.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics.add("energy404_http_in_flight", 1)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Label by route template, not raw path, to keep cardinality bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.add("energy404_http_in_flight", -1)
+            metrics.observe("energy404_http_request_seconds", time.perf_counter() - t0, route=route)
+            metrics.add("energy404_http_requests_total", route=route, status=str(status))
+            if status >= 400:
+                metrics.add("energy404_http_errors_total", route=route, status=str(status))
+
+# ===== Per-request tracing =====
+# With "X-Energy404-Trace: 1" and a matching X-Admin-Token the response
+# carries a Server-Timing header (and X-Energy404-Trace as JSON) with the time
+# spent in each stage of this request. Without a valid token the header is
+# ignored. Tracing never changes how a request is scheduled: batched /predict
+# calls report their queue + batch wait as one "microbatch" stage.
+def _trace_allowed(headers) -> bool:
+    if not ADMIN_TOKEN:
+        return False
+    values = dict(headers)
+    if TRACE_HEADER.encode() not in values:
+        return False
+    token = values.get(b"x-admin-token", b"")
+    return hmac.compare_digest(token, ADMIN_TOKEN.encode())
+
+class TraceMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _trace_allowed(scope["headers"]):
+            return await self.app(scope, receive, send)
+
+        t0 = time.perf_counter()
+        with metrics.trace() as spans:
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start":
+                    stages = {}
+                    for name, seconds in spans:
+                        stages[name] = stages.get(name, 0.0) + seconds
+                    stages["total"] = time.perf_counter() - t0
+                    ms = {name: round(seconds * 1e3, 3) for name, seconds in stages.items()}
+                    timing = ", ".join(f"{name};dur={v}" for name, v in ms.items())
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", timing.encode()),
+                        (b"x-energy404-trace", json.dumps(ms).encode()),
+                    ]
+                await send(message)
+
+            await self.app(scope, receive, send_with_timing)
+
+app.add_middleware(TraceMiddleware)
+
+if metrics.ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    metrics.REGISTRY.describe("energy404_http_in_flight", "gauge", "HTTP requests currently being served")
+    metrics.REGISTRY.describe("energy404_http_request_seconds", "histogram", "HTTP request latency by route")
+    metrics.REGISTRY.describe("energy404_http_requests_total", "counter", "HTTP requests by route and status")
+    metrics.REGISTRY.describe("energy404_http_errors_total", "counter", "HTTP responses with status >= 400")
+    metrics.REGISTRY.register_callback(
+        "energy404_cache_events_total", "counter", "Prediction cache hits / misses / evictions / invalidations",
+        lambda: {k: v for k, v in prediction_cache.stats().items() if k in ("hits", "misses", "evictions", "invalidations")},
+        label="event")
+    metrics.REGISTRY.register_callback(
+        "energy404_cache_entries", "gauge", "Entries in the prediction cache",
+        lambda: prediction_cache.stats()["size"])
+    metrics.REGISTRY.register_callback(
+        "energy404_scheduler_queued", "gauge", "Single predictions waiting for a micro-batch",
+        lambda: scheduler.stats()["queued"])
+    metrics.REGISTRY.register_callback(
+        "energy404_scheduler_batches_total", "counter", "Micro-batches executed",
+        lambda: scheduler.stats()["batches"])
+
 # ===== Input Schema =====
 class PredictionRequest(BaseModel):
     city: str
     building_type: str
     tilt: float
+    tier: str = "full"  # latency tier: "fast" | "balanced" | "full"
 
 # ===== Root Endpoint =====
 @app.get("/")
 def root():
     return {"message": "☀️ Energy404 API is running! Use POST /predict to get predictions."}
 
+# ===== Readiness (models loaded) =====
+@app.get("/ready")
+def ready():
+    report = {"version": predict.slot.current.name, **predict.slot.current.store.report()}
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+# ===== Micro-batching scheduler stats =====
+@app.get("/scheduler")
+def scheduler_stats():
+    return {"enabled": MICROBATCH, **scheduler.stats()}
+
 # ===== Allow City, Builting Type and Tilt Range =====
 @app.get("/metadata")
 def get_metadata():
@@ -43,25 +260,265 @@ def get_metadata():
        'peri-urban settlement', 'public health facilities',
        'public sector', 'schools', 'single family residential',
        'small commercial'],
-        "tilt_range": [0, 60]
+        "tilt_range": [0, 60],
+        "tiers": predict.available_tiers(),
     }
 
+# ===== Prometheus metrics =====
+@app.get("/metrics")
+def get_metrics():
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled (ENERGY404_METRICS=0)")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# ===== Admin: sampling profiler =====
+def _require_admin(request: Request):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Admin endpoints are disabled (set ENERGY404_ADMIN_TOKEN)")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+@app.post("/admin/profile")
+async def admin_profile(request: Request, seconds: float = PROFILE_SECONDS, interval_ms: float = 5.0,
+                        download: bool = False):
+    """
+    Sample every thread's stack for `seconds` while traffic keeps flowing.
+    Returns the top self-time frames and the collapsed-stack file path, or
+    the collapsed stacks themselves with download=true (feed to flamegraph.pl
+    or speedscope).
+    """
+    _require_admin(request)
+    if not 0 < seconds <= 300 or not 0.5 <= interval_ms <= 1000:
+        raise HTTPException(status_code=400, detail="seconds must be in (0, 300], interval_ms in [0.5, 1000]")
+    prof = profiler.SamplingProfiler(interval_ms / 1e3)
+    try:
+        result = await run_in_threadpool(prof.run, seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if download:
+        return PlainTextResponse(prof.collapsed(), headers={
+            "Content-Disposition": f'attachment; filename="{Path(result["path"]).name}"'})
+    return result
+
+# ===== Model versions (registry + hot-swap) =====
+# POST /admin/models/activate loads a registry version in a background
+# thread, warms it and swaps it in; GET /models shows progress and timings.
+_activation = {"state": "idle"}
+_activation_lock = threading.Lock()
+
+def _run_activation(version: str):
+    try:
+        result = predict.activate(version)
+        _activation.update(state="done", result=result)
+    except Exception as e:
+        _activation.update(state="failed", error=str(e))
+
+@app.get("/models")
+def get_models():
+    slot = predict.slot
+    return {
+        "active": slot.current.info(),
+        "draining": [v.info() for v in list(slot.draining)],
+        "available": predict.registry.versions(),
+        "activation": dict(_activation),
+    }
+
+@app.post("/admin/models/activate", status_code=202)
+def activate_model(request: Request, version: str):
+    _require_admin(request)
+    try:
+        predict.registry.path(version)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    with _activation_lock:
+        if _activation["state"] == "loading":
+            raise HTTPException(status_code=409, detail=f"Version {_activation['version']} is still loading")
+        _activation.clear()
+        _activation.update(state="loading", version=version, started=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    threading.Thread(target=_run_activation, args=(version,), name="model-activate", daemon=True).start()
+    return {"state": "loading", "version": version}
+
+# ===== Prediction cache stats =====
+@app.get("/cache")
+def cache_stats():
+    return prediction_cache.stats()
+
 # ===== Prediction Endpoint =====
-@app.post("/predict")
-def get_prediction(req: PredictionRequest):
+async def _predict_cached(city: str, building_type: str, tilt: float, tier: str) -> dict:
+    """Normalize the input, answer from the cache or score it, and build the response body."""
+    check_tier(tier, predict.available_tiers())
+    key = prediction_cache.normalize(city, building_type, tilt, tier)
+    city, building_type, q_tilt, tier = key
+    # Pin the version this call is answered under before scoring (see _on_model_swap)
+    version = predict.slot.current
+    key = (version.name, *key)
+
+    with metrics.stage("cache"):
+        pred_value = prediction_cache.get(key)
+    if pred_value is None:
+        if MICROBATCH:
+            fut = scheduler.submit(city, building_type, q_tilt, tier)
+            with metrics.stage("microbatch"):
+                pred_value = await asyncio.wrap_future(fut)
+        else:
+            pred_value = await run_in_threadpool(
+                predict_energy,
+                city=city,
+                building_type=building_type,
+                tilt=q_tilt,
+                tier=tier
+            )
+        prediction_cache.put(key, pred_value, version.generation)
+
+    return {
+        "city": city,
+        "building_type": building_type,
+        "tilt": q_tilt,
+        "tier": tier,
+        "predicted_kWh_per_m2": pred_value
+    }
+
+def _not_modified(request: Request, etag: str) -> bool:
+    match = request.headers.get("if-none-match", "")
+    return match == "*" or etag in [t.strip().removeprefix("W/") for t in match.split(",")]
+
+async def _serve(request: Request, key: tuple, compute):
+    """
+    Conditional GET: the ETag is derived from the model fingerprint and the
+    normalized request, so it can be checked before computing anything.
+    """
+    etag = prediction_cache.etag(predict.slot.current.name, request.url.path, *key)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.method == "GET" and _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
     try:
-        pred_value = predict_energy(
-            city=req.city,
-            building_type=req.building_type,
-            tilt=req.tilt
-        )
-        return {
-            "city": req.city,
-            "building_type": req.building_type,
-            "tilt": req.tilt,
-            "predicted_kWh_per_m2": pred_value
-        }
+        body = await compute()
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal error: {str(e)}")
+    return JSONResponse(body, headers=headers)
+
+@app.post("/predict")
+async def get_prediction(req: PredictionRequest, request: Request):
+    key = prediction_cache.normalize(req.city, req.building_type, req.tilt, req.tier)
+    return await _serve(request, key,
+                        lambda: _predict_cached(req.city, req.building_type, req.tilt, req.tier))
+
+@app.get("/predict")
+async def get_prediction_get(request: Request, city: str, building_type: str, tilt: float, tier: str = "full"):
+    """Same as POST /predict, but cacheable by clients/proxies (ETag + If-None-Match)."""
+    key = prediction_cache.normalize(city, building_type, tilt, tier)
+    return await _serve(request, key, lambda: _predict_cached(city, building_type, tilt, tier))
+
+# ===== Streaming Batch Endpoint =====
+class UploadStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse whose body generator reads the request stream itself.
+    Starlette's default disconnect listener would consume the upload's
+    receive() messages, so it is skipped; a client that goes away surfaces
+    as ClientDisconnect from request.stream() instead.
+    """
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request, tier: str = "full"):
+    """
+    Score an NDJSON (default) or CSV (Content-Type: text/csv, header line
+    required) upload of city, building_type, tilt[, area] records. Rows are
+    parsed and scored in chunks of BATCH_CHUNK_ROWS and streamed back in the
+    same format; invalid rows come back with an "error" field.
+
+    Arrow IPC streams (application/vnd.apache.arrow.stream) and Parquet
+    (application/vnd.apache.parquet) uploads are scored column-wise, without
+    per-row Python objects, and answered in the same format (see arrow_io.py).
+    """
+    try:
+        check_tier(tier, predict.available_tiers())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    columnar = arrow_io.wire_format(request.headers.get("content-type", ""))
+    if columnar:
+        body = await request.body()
+        try:
+            content = await run_in_threadpool(arrow_io.score_body, body, columnar, predict.predict_energy_encoded,
+                                              tier, ARROW_CHUNK_ROWS)
+        except (ValueError, arrow_io.pa.ArrowException) as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return Response(content, media_type=arrow_io.media_type(columnar))
+
+    fmt = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+    lines = batch_io.iter_lines(request.stream(), BATCH_MAX_LINE_BYTES)
+    header = None
+    if fmt == "csv":
+        # Read before the response starts, so a bad header is still a 400
+        try:
+            header = await batch_io.read_header(lines)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    async def results():
+        records = batch_io.iter_records(lines, fmt, header)
+        first = True
+        async for chunk in batch_io.iter_chunks(records, BATCH_CHUNK_ROWS):
+            scored = await run_in_threadpool(batch_io.score_chunk, chunk, predict_energy_batch, tier)
+            if fmt == "csv":
+                yield batch_io.format_csv(scored, header=first)
+            else:
+                yield batch_io.format_ndjson(scored)
+            first = False
+
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return UploadStreamingResponse(results(), media_type=media_type)
+
+# ===== Tilt Curve / Optimal Tilt =====
+# One vectorized ensemble call per curve (see pipeline/tilt.py).
+# step is bounded (and finite) before any work starts: it sets the number of points per curve.
+TILT_STEP = Query(1.0, ge=tilt.STEP_MIN, le=tilt.STEP_MAX, allow_inf_nan=False)
+
+@app.get("/tilt-curve")
+async def get_tilt_curve(request: Request, city: str, building_type: str, step: float = TILT_STEP, tier: str = "full"):
+    return await _serve(request, (city, building_type, step, tier),
+                        lambda: run_in_threadpool(tilt.tilt_curve, city, building_type, step=step, tier=tier))
+
+@app.get("/optimal-tilt")
+async def get_optimal_tilt(request: Request, city: str = None, building_type: str = None, step: float = TILT_STEP,
+                           tier: str = "full"):
+    """
+    Best tilt for one city + building type, or for every combination when
+    both are omitted (computed in one pass and cached).
+    """
+    async def compute():
+        if city is None and building_type is None:
+            results = await run_in_threadpool(tilt.optimal_tilts_all, step=step, tier=tier)
+            return {"tier": tier, "coarse_step": step, "results": results}
+        if city is None or building_type is None:
+            raise ValueError("❌ Pass both city and building_type, or neither for all combinations")
+        return await run_in_threadpool(tilt.optimal_tilt, city, building_type, step=step, tier=tier)
+
+    return await _serve(request, (city, building_type, step, tier), compute)
+
+# ===== Aggregate Cube =====
+@app.get("/cube")
+def get_cube(city: str = None, building_type: str = None, tilt_min: float = None, tilt_max: float = None,
+             group_by: str = None, quantiles: str = "0.5,0.9"):
+    """
+    Totals, means and quantiles over all rooftops of a city / building type /
+    tilt range (omitted filters cover everything), from the precomputed cube.
+    group_by=city|building_type|tilt_bucket splits the answer.
+    """
+    try:
+        cube = cube_store.get()
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        qs = [float(q) for q in quantiles.split(",") if q.strip()]
+        return cube.query(city, building_type, tilt_min, tilt_max, group_by, qs)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
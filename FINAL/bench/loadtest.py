@@ -0,0 +1,269 @@
+"""
+loadtest.py — HTTP load test / latency benchmark for api.py
+-----------------------------------------------------------
+Starts the API locally with uvicorn (or targets --url), waits for /ready,
+then drives each scenario closed-loop at every concurrency level for a fixed
+duration. Inputs are drawn from /metadata: random city and building type,
+with mostly integer tilts like the dashboard slider produces.
+
+Scenarios:
+- predict     POST /predict            (single rooftop)
+- batch       POST /predict/batch      (NDJSON upload, --batch-rows rows)
+- tilt-curve  GET  /tilt-curve         (one vectorized 0–60° sweep)
+
+Reports throughput, p50/p95/p99/max latency and error rate per
+(scenario, concurrency), saves them as JSON under bench/results/, and with
+--compare flags runs whose latency/throughput regressed past --threshold
+(exit code 1). Uses only the standard library + numpy; runs offline.
+
+Run (from FINAL/):
+------------------
+$ python bench/loadtest.py --concurrency 1,8,32 --duration 10
+$ python bench/loadtest.py --compare bench/results/baseline.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+SCENARIOS = ["predict", "batch", "tilt-curve"]
+COMPARED = {"p50_ms": "higher", "p95_ms": "higher", "p99_ms": "higher", "rps": "lower", "error_rate": "higher"}
+ERROR_RATE_SLACK = 0.01  # error rate is compared in absolute terms (+1 percentage point)
+
+
+# === Server ===
+def start_server(port: int, env: dict):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        cwd=BASE_DIR, env={**os.environ, **env},
+    )
+    return proc
+
+
+def wait_ready(url: str, timeout: float) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            status, _ = request(url, "GET", "/ready")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"❌ {url}/ready did not return 200 within {timeout:.0f}s")
+
+
+# === HTTP ===
+def request(url: str, method: str, path: str, body: bytes = None, headers: dict = None, conn=None):
+    own = conn is None
+    if own:
+        parts = urlsplit(url)
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        resp = conn.getresponse()
+        return resp.status, resp.read()
+    finally:
+        if own:
+            conn.close()
+
+
+class InputMix:
+    """Deterministic stream of realistic inputs drawn from /metadata."""
+
+    def __init__(self, metadata: dict, seed: int):
+        self.cities = metadata["cities"]
+        self.types = metadata["building_types"]
+        self.tilt_min, self.tilt_max = metadata["tilt_range"]
+        self.rng = np.random.default_rng(seed)
+
+    def one(self) -> dict:
+        tilt = float(self.rng.uniform(self.tilt_min, self.tilt_max))
+        if self.rng.random() < 0.8:  # slider values are whole degrees
+            tilt = float(round(tilt))
+        return {
+            "city": str(self.rng.choice(self.cities)),
+            "building_type": str(self.rng.choice(self.types)),
+            "tilt": tilt,
+        }
+
+
+def make_call(scenario: str, mix: InputMix, batch_rows: int):
+    """Returns (method, path, body, headers) for one request of the scenario."""
+    if scenario == "predict":
+        return "POST", "/predict", json.dumps(mix.one()).encode(), {"Content-Type": "application/json"}
+    if scenario == "batch":
+        body = "".join(json.dumps(mix.one()) + "\n" for _ in range(batch_rows)).encode()
+        return "POST", "/predict/batch", body, {"Content-Type": "application/x-ndjson"}
+    if scenario == "tilt-curve":
+        r = mix.one()
+        return "GET", "/tilt-curve?" + urlencode({"city": r["city"], "building_type": r["building_type"]}), None, {}
+    raise ValueError(f"❌ Unknown scenario '{scenario}'")
+
+
+# === Load generation ===
+def run_level(url: str, scenario: str, concurrency: int, duration: float, metadata: dict,
+              batch_rows: int, seed: int) -> dict:
+    """Closed loop: `concurrency` workers, each with one keep-alive connection."""
+    parts = urlsplit(url)
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    stop_at = [0.0]
+    start = threading.Barrier(concurrency + 1, action=lambda: stop_at.__setitem__(0, time.perf_counter() + duration))
+
+    def worker(i):
+        mix = InputMix(metadata, seed + i)
+        calls = [make_call(scenario, mix, batch_rows) for _ in range(8 if scenario == "batch" else 256)]
+        conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+        start.wait()
+        k = 0
+        while time.perf_counter() < stop_at[0]:
+            method, path, body, headers = calls[k % len(calls)]
+            k += 1
+            t0 = time.perf_counter()
+            try:
+                status, _ = request(url, method, path, body, headers, conn=conn)
+                ok = status < 400
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+            latencies[i].append(time.perf_counter() - t0)
+            errors[i] += not ok
+        conn.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    lat = np.concatenate([np.asarray(l) for l in latencies]) * 1e3
+    n = len(lat)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": int(n),
+        "rows_per_request": batch_rows if scenario == "batch" else 1,
+        "rps": round(n / elapsed, 2),
+        "p50_ms": round(float(np.percentile(lat, 50)), 3) if n else None,
+        "p95_ms": round(float(np.percentile(lat, 95)), 3) if n else None,
+        "p99_ms": round(float(np.percentile(lat, 99)), 3) if n else None,
+        "max_ms": round(float(lat.max()), 3) if n else None,
+        "error_rate": round(sum(errors) / n, 4) if n else 1.0,
+    }
+
+
+# === Regression check ===
+def compare(current: list, baseline: list, threshold: float) -> list:
+    """Rows whose metric got worse than baseline by more than `threshold` (relative)."""
+    base = {(r["scenario"], r["concurrency"]): r for r in baseline}
+    regressions = []
+    for r in current:
+        b = base.get((r["scenario"], r["concurrency"]))
+        if b is None:
+            continue
+        for metric, worse in COMPARED.items():
+            old, new = b.get(metric), r.get(metric)
+            if old is None or new is None:
+                continue
+            if metric == "error_rate":
+                bad = new > old + ERROR_RATE_SLACK
+            elif worse == "higher":
+                bad = new > old * (1 + threshold)
+            else:
+                bad = new < old * (1 - threshold)
+            if bad:
+                regressions.append({"scenario": r["scenario"], "concurrency": r["concurrency"],
+                                    "metric": metric, "baseline": old, "current": new})
+    return regressions
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Load-test the Energy404 API.")
+    ap.add_argument("--url", default=None, help="Target a running server instead of starting one")
+    ap.add_argument("--port", type=int, default=8765, help="Port for the locally started server")
+    ap.add_argument("--scenarios", default="predict,batch,tilt-curve", help=f"Comma list of {SCENARIOS}")
+    ap.add_argument("--concurrency", default="1,4,16,64", help="Comma list of concurrent clients")
+    ap.add_argument("--duration", type=float, default=10.0, help="Seconds per (scenario, concurrency)")
+    ap.add_argument("--warmup", type=float, default=2.0, help="Seconds of untimed load before each scenario")
+    ap.add_argument("--batch-rows", type=int, default=1000, help="Rows per /predict/batch upload")
+    ap.add_argument("--seed", type=int, default=404)
+    ap.add_argument("--ready-timeout", type=float, default=300.0, help="Seconds to wait for /ready")
+    ap.add_argument("--env", action="append", default=[], help="KEY=VALUE for the started server (repeatable)")
+    ap.add_argument("--out", type=Path, default=None, help="Result JSON (default: bench/results/<timestamp>.json)")
+    ap.add_argument("--compare", type=Path, default=None, help="Baseline result JSON to check against")
+    ap.add_argument("--threshold", type=float, default=0.10, help="Allowed relative regression (0.10 = 10%%)")
+    args = ap.parse_args()
+
+    server_env = dict(kv.split("=", 1) for kv in args.env)
+    url = args.url or f"http://127.0.0.1:{args.port}"
+    proc = None if args.url else start_server(args.port, server_env)
+
+    try:
+        wait_ready(url, args.ready_timeout)
+        _, body = request(url, "GET", "/metadata")
+        metadata = json.loads(body)
+
+        rows = []
+        for scenario in args.scenarios.split(","):
+            if args.warmup > 0:
+                run_level(url, scenario, 1, args.warmup, metadata, args.batch_rows, args.seed)
+            for c in [int(c) for c in args.concurrency.split(",")]:
+                row = run_level(url, scenario, c, args.duration, metadata, args.batch_rows, args.seed)
+                rows.append(row)
+                print(f"- {scenario:<10} c={c:<4} {row['rps']:>9.1f} req/s  p50 {row['p50_ms']} ms  "
+                      f"p95 {row['p95_ms']} ms  p99 {row['p99_ms']} ms  errors {row['error_rate']:.2%}")
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    result = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_rev": _git_rev(),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "server_env": {k: v for k, v in {**os.environ, **server_env}.items() if k.startswith("ENERGY404_")},
+        "settings": {"duration": args.duration, "batch_rows": args.batch_rows, "seed": args.seed,
+                     "url": args.url or "local"},
+        "results": rows,
+    }
+    out = args.out or RESULTS_DIR / f"{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"✅ Results saved to {out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(rows, baseline, args.threshold)
+        for r in regressions:
+            print(f"❌ {r['scenario']} c={r['concurrency']}: {r['metric']} {r['baseline']} → {r['current']}")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.threshold:.0%} vs {args.compare}")
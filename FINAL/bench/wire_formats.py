@@ -0,0 +1,145 @@
+"""
+wire_formats.py — JSON vs Arrow vs Parquet overhead of /predict/batch
+---------------------------------------------------------------------
+Measures, per format and batch size, the time spent outside the model:
+
+- client_encode   DataFrame -> request body          (client.encode)
+- server          body -> parse -> format -> response body, with the
+                  model replaced by a constant stub so only the wire
+                  format is timed (batch_io / arrow_io, as api.py runs them)
+- client_decode   response body -> DataFrame / Table (client.decode)
+
+plus request / response sizes and, for reference, the model itself
+(predict_energy_batch on the same rows; skip with --no-model).
+With --url the full round trip through a running server is timed instead
+of the stubbed server step.
+
+Run (from FINAL/):
+------------------
+$ python bench/wire_formats.py --rows 10000,1000000
+$ python bench/wire_formats.py --rows 10000,1000000 --url http://127.0.0.1:8000
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(BASE_DIR))
+sys.path.append(str(BASE_DIR / "pipeline"))
+sys.path.append(str(Path(__file__).resolve().parent))
+
+import arrow_io  # noqa: E402
+import batch_io  # noqa: E402
+import client  # noqa: E402
+from loadtest import RESULTS_DIR  # noqa: E402
+
+FORMATS = ["ndjson", "arrow", "parquet"]
+CITIES = ["Accra", "Karachi", "Nairobi", "Manila", "Colombo", "Almaty", "Beirut", "Izmir"]
+TYPES = ["commercial", "schools", "industrial", "hotels", "single family residential", "public sector"]
+
+
+def make_rows(n: int, seed: int = 404) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "city": rng.choice(CITIES, n),
+        "building_type": rng.choice(TYPES, n),
+        "tilt": np.round(rng.uniform(0, 60, n), 1),
+        "area": np.round(rng.uniform(10, 500, n), 1),
+    })
+
+
+# === Model stubs (constant output, same signatures as predict.py) ===
+def _stub_batch(city, building_type, tilt, tier="full", return_errors=False):
+    preds = np.full(len(tilt), 300.0)
+    return (preds, [None] * len(preds)) if return_errors else preds
+
+
+def _stub_encoded(cities, city_codes, building_types, type_codes, tilts, valid=None, tier="full"):
+    return np.full(len(tilts), 300.0), np.ones(len(cities), bool), np.ones(len(building_types), bool)
+
+
+def serve_ndjson(body: bytes, chunk_rows: int) -> bytes:
+    """The NDJSON path of api.py's /predict/batch, minus HTTP."""
+    async def stream():
+        yield body
+
+    async def run():
+        out = []
+        records = batch_io.iter_records(batch_io.iter_lines(stream()), "ndjson")
+        async for chunk in batch_io.iter_chunks(records, chunk_rows):
+            out.append(batch_io.format_ndjson(batch_io.score_chunk(chunk, _stub_batch)))
+        return "".join(out).encode()
+
+    return asyncio.run(run())
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - t0
+
+
+def bench(rows: pd.DataFrame, fmt: str, url: str, chunk_rows: int, arrow_chunk_rows: int) -> dict:
+    body, t_encode = timed(client.encode, rows, fmt)
+    if url:
+        response, t_server = timed(client.post, url, "/predict/batch", body, client.CONTENT_TYPES[fmt], 3600)
+    elif fmt == "ndjson":
+        response, t_server = timed(serve_ndjson, body, chunk_rows)
+    else:
+        response, t_server = timed(arrow_io.score_body, body, fmt, _stub_encoded, "full", arrow_chunk_rows)
+    result, t_decode = timed(client.decode, response, fmt)
+    assert len(result) == len(rows), f"{fmt}: {len(result)} rows back for {len(rows)}"
+    return {
+        "format": fmt,
+        "rows": len(rows),
+        "request_mb": round(len(body) / 2**20, 2),
+        "response_mb": round(len(response) / 2**20, 2),
+        "client_encode_s": round(t_encode, 4),
+        ("round_trip_s" if url else "server_s"): round(t_server, 4),
+        "client_decode_s": round(t_decode, 4),
+        "total_s": round(t_encode + t_server + t_decode, 4),
+    }
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Compare batch wire formats (JSON vs Arrow vs Parquet).")
+    ap.add_argument("--rows", default="10000,1000000", help="Comma list of batch sizes")
+    ap.add_argument("--formats", default=",".join(FORMATS))
+    ap.add_argument("--url", default=None, help="Time full round trips against a running server")
+    ap.add_argument("--no-model", action="store_true", help="Skip the predict_energy_batch reference timing")
+    ap.add_argument("--chunk-rows", type=int, default=5000, help="NDJSON chunk size (ENERGY404_BATCH_CHUNK_ROWS)")
+    ap.add_argument("--arrow-chunk-rows", type=int, default=65536, help="ENERGY404_ARROW_CHUNK_ROWS")
+    ap.add_argument("--out", type=Path, default=None)
+    args = ap.parse_args()
+
+    predict_energy_batch = None
+    if not args.no_model and not args.url:
+        from predict import predict_energy_batch
+
+    results = []
+    for n in [int(r) for r in args.rows.split(",")]:
+        rows = make_rows(n)
+        for fmt in args.formats.split(","):
+            r = bench(rows, fmt, args.url, args.chunk_rows, args.arrow_chunk_rows)
+            results.append(r)
+            print(f"- {fmt:<8} {n:>9,} rows  {r['request_mb']:>7.2f} MB →  encode {r['client_encode_s']:.3f}s  "
+                  f"{'round trip' if args.url else 'server'} {r.get('round_trip_s', r.get('server_s')):.3f}s  "
+                  f"decode {r['client_decode_s']:.3f}s  total {r['total_s']:.3f}s")
+        if predict_energy_batch is not None:
+            predict_energy_batch(rows.head(1000))  # warm-up
+            _, t_model = timed(predict_energy_batch, rows)
+            results.append({"format": "model", "rows": n, "total_s": round(t_model, 4)})
+            print(f"- {'model':<8} {n:>9,} rows  predict_energy_batch {t_model:.3f}s")
+
+    out = args.out or RESULTS_DIR / f"wire_formats_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "url": args.url, "results": results}, f, indent=2)
+    print(f"✅ Results saved to {out}")
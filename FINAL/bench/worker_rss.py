@@ -0,0 +1,132 @@
+"""
+worker_rss.py — Per-worker memory of a multi-worker API deployment
+------------------------------------------------------------------
+Starts api.py with N workers (uvicorn --workers, or gunicorn with
+gunicorn.conf.py / preload), waits until every worker reports ready,
+warms each one with predictions, then reads /proc/<pid>/smaps_rollup of
+every worker:
+
+- rss_mb      resident memory, counting shared pages in full (what `top` shows)
+- pss_mb      proportional set size: shared pages divided among the sharers,
+              so the sum over workers is the real footprint
+- shared_mb   resident pages shared with other processes
+- private_mb  pages only this worker holds
+
+Linux only (needs /proc). Results are printed and saved as JSON.
+
+Run (from FINAL/):
+------------------
+$ python bench/worker_rss.py --server uvicorn --workers 4
+$ python bench/worker_rss.py --server gunicorn --workers 4 --env ENERGY404_BACKEND=compiled --env ENERGY404_MMAP_FORESTS=1
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.append(str(Path(__file__).resolve().parent))
+
+from loadtest import RESULTS_DIR, request  # noqa: E402
+
+
+def smaps_rollup(pid: int) -> dict:
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss_mb": round(fields.get("Rss", 0), 1),
+        "pss_mb": round(fields.get("Pss", 0), 1),
+        "shared_mb": round(fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0), 1),
+        "private_mb": round(fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0), 1),
+    }
+
+
+def start(server: str, workers: int, port: int, env: dict):
+    env = {**os.environ, **env}
+    if server == "gunicorn":
+        env["ENERGY404_BIND"] = f"127.0.0.1:{port}"
+        env["ENERGY404_WORKERS"] = str(workers)
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "api:app"]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "api:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(workers), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=BASE_DIR, env=env)
+
+
+def worker_pids(url: str, workers: int, timeout: float) -> set:
+    """Poll /ready on fresh connections until `workers` distinct ready pids were seen."""
+    pids = set()
+    deadline = time.time() + timeout
+    while len(pids) < workers and time.time() < deadline:
+        try:
+            status, body = request(url, "GET", "/ready")
+            if status == 200:
+                pids.add(json.loads(body)["pid"])
+                continue
+        except OSError:
+            pass
+        time.sleep(0.2)
+    if len(pids) < workers:
+        raise TimeoutError(f"❌ Only {len(pids)}/{workers} workers became ready within {timeout:.0f}s")
+    return pids
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Measure per-worker RSS/PSS of the API.")
+    ap.add_argument("--server", choices=["uvicorn", "gunicorn"], default="uvicorn")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--port", type=int, default=8767)
+    ap.add_argument("--warm", type=int, default=200, help="Prediction requests sent before measuring")
+    ap.add_argument("--ready-timeout", type=float, default=600.0)
+    ap.add_argument("--env", action="append", default=[], help="KEY=VALUE for the server (repeatable)")
+    ap.add_argument("--out", type=Path, default=None)
+    args = ap.parse_args()
+
+    server_env = dict(kv.split("=", 1) for kv in args.env)
+    url = f"http://127.0.0.1:{args.port}"
+    proc = start(args.server, args.workers, args.port, server_env)
+    try:
+        pids = worker_pids(url, args.workers, args.ready_timeout)
+        for i in range(args.warm):
+            body = json.dumps({"city": "Accra", "building_type": "schools", "tilt": i % 61}).encode()
+            request(url, "POST", "/predict", body, {"Content-Type": "application/json"})
+        time.sleep(1.0)
+        per_worker = {pid: smaps_rollup(pid) for pid in sorted(pids)}
+        master = smaps_rollup(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=60)
+
+    total_pss = sum(w["pss_mb"] for w in per_worker.values())
+    result = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "server": args.server,
+        "workers": args.workers,
+        "server_env": {k: v for k, v in {**os.environ, **server_env}.items() if k.startswith("ENERGY404_")},
+        "master": master,
+        "per_worker": per_worker,
+        "worker_rss_mb_avg": round(sum(w["rss_mb"] for w in per_worker.values()) / len(per_worker), 1),
+        "worker_pss_mb_avg": round(total_pss / len(per_worker), 1),
+        "total_pss_mb": round(total_pss + master["pss_mb"], 1),
+    }
+
+    print(f"\n{'pid':>8} {'RSS MB':>8} {'PSS MB':>8} {'shared':>8} {'private':>8}")
+    for pid, w in per_worker.items():
+        print(f"{pid:>8} {w['rss_mb']:>8.1f} {w['pss_mb']:>8.1f} {w['shared_mb']:>8.1f} {w['private_mb']:>8.1f}")
+    print(f"{'master':>8} {master['rss_mb']:>8.1f} {master['pss_mb']:>8.1f} {master['shared_mb']:>8.1f} "
+          f"{master['private_mb']:>8.1f}")
+    print(f"📊 Total PSS (workers + master): {result['total_pss_mb']} MB")
+
+    out = args.out or RESULTS_DIR / f"worker_rss_{args.server}_{args.workers}w_{time.strftime('%Y%m%d_%H%M%S')}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"✅ Results saved to {out}")
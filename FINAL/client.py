@@ -0,0 +1,130 @@
+"""
+client.py — Python client for the Energy404 batch endpoint
+----------------------------------------------------------
+Sends many rooftops to POST /predict/batch in one request and returns the
+scored rows. fmt="arrow" (default) and fmt="parquet" use the columnar wire
+formats (see pipeline/arrow_io.py); fmt="ndjson" uses the line-delimited
+JSON format, mainly for comparison.
+
+Usage:
+------
+>>> import pandas as pd
+>>> from client import predict_batch
+>>> rooftops = pd.DataFrame({"city": ["Accra", "Karachi"], "building_type": ["schools", "commercial"],
+...                          "tilt": [10.0, 25.0], "area": [120.0, 80.0]})
+>>> scored = predict_batch(rooftops, url="http://127.0.0.1:8000")
+>>> scored.columns.tolist()
+['row', 'city', 'building_type', 'tilt', 'area', 'predicted_kWh_per_m2', 'annual_kWh', 'error']
+"""
+
+import http.client
+import io
+import socket
+import threading
+from urllib.parse import urlencode, urlsplit
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+DEFAULT_URL = "http://127.0.0.1:8000"
+CONTENT_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def _as_table(data) -> pa.Table:
+    if isinstance(data, pa.Table):
+        return data
+    if isinstance(data, pd.DataFrame):
+        return pa.Table.from_pandas(data, preserve_index=False)
+    return pa.table(data)
+
+
+def encode(data, fmt: str = "arrow") -> bytes:
+    """Request body for a DataFrame / pyarrow Table / dict of columns."""
+    if fmt == "ndjson":
+        frame = data if isinstance(data, pd.DataFrame) else _as_table(data).to_pandas()
+        return frame.to_json(orient="records", lines=True).encode()
+    table = _as_table(data)
+    sink = pa.BufferOutputStream()
+    if fmt == "arrow":
+        with ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+    elif fmt == "parquet":
+        pq.write_table(table, sink)
+    else:
+        raise ValueError(f"❌ Unknown format '{fmt}' (use {', '.join(CONTENT_TYPES)})")
+    return sink.getvalue().to_pybytes()
+
+
+def decode(body: bytes, fmt: str = "arrow"):
+    """pyarrow Table for arrow / parquet responses, DataFrame for ndjson."""
+    if fmt == "arrow":
+        return ipc.open_stream(pa.py_buffer(body)).read_all()
+    if fmt == "parquet":
+        return pq.read_table(pa.BufferReader(body))
+    return pd.read_json(io.BytesIO(body), lines=True)
+
+
+def post(url: str, path: str, body: bytes, content_type: str, timeout: float = 600) -> bytes:
+    """
+    POST that reads the response while the body is still being sent.
+    /predict/batch streams NDJSON results back as soon as the first chunk is
+    scored, so a client that only reads after uploading everything
+    (requests, urllib) stalls once both socket buffers are full.
+    """
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=timeout)
+    upload_errors = []
+
+    def upload(sock):
+        # An early error response (e.g. 400 on a bad header) can close the
+        # socket mid-upload; keep the error for after the response is read.
+        try:
+            sock.sendall(body)
+        except OSError as e:
+            upload_errors.append(e)
+
+    try:
+        conn.putrequest("POST", (parts.path.rstrip("/") or "") + path)
+        conn.putheader("Content-Type", content_type)
+        conn.putheader("Content-Length", str(len(body)))
+        conn.endheaders()
+        sock = conn.sock
+        sender = threading.Thread(target=upload, args=(sock,), name="upload", daemon=True)
+        sender.start()
+        resp = conn.getresponse()
+        content = resp.read()
+        if resp.status >= 400 and sender.is_alive():
+            # The server has answered and stopped reading: unblock the upload
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        sender.join()
+    finally:
+        conn.close()
+    if resp.status >= 400:
+        raise RuntimeError(f"❌ HTTP {resp.status}: {content[:500].decode(errors='replace')}")
+    if upload_errors:
+        raise upload_errors[0]
+    return content
+
+
+def predict_batch(data, url: str = DEFAULT_URL, fmt: str = "arrow", tier: str = "full", timeout: float = 600,
+                  as_arrow: bool = False):
+    """
+    Score `data` (city, building_type, tilt[, area] columns) in one request.
+    Returns a DataFrame, or the pyarrow Table itself with as_arrow=True
+    (arrow / parquet only). Rows the API could not score carry an `error`.
+    """
+    body = encode(data, fmt)
+    content = post(url, "/predict/batch?" + urlencode({"tier": tier}), body, CONTENT_TYPES[fmt], timeout)
+    result = decode(content, fmt)
+    if as_arrow or isinstance(result, pd.DataFrame):
+        return result
+    return result.to_pandas()
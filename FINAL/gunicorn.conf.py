@@ -0,0 +1,22 @@
+"""
+gunicorn.conf.py — Multi-worker serving with shared model memory
+----------------------------------------------------------------
+The master process imports api.py once with every model loaded
+(ENERGY404_PRELOAD=1), then forks the uvicorn workers. Model memory is
+shared copy-on-write instead of being loaded again by each worker.
+
+Run (from FINAL/):
+------------------
+$ gunicorn -c gunicorn.conf.py api:app
+$ ENERGY404_WORKERS=4 ENERGY404_BACKEND=compiled ENERGY404_MMAP_FORESTS=1 gunicorn -c gunicorn.conf.py api:app
+"""
+
+import os
+
+os.environ.setdefault("ENERGY404_PRELOAD", "1")
+
+bind = os.environ.get("ENERGY404_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("ENERGY404_WORKERS", "2"))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+timeout = 120
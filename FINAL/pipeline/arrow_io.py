@@ -0,0 +1,162 @@
+"""
+arrow_io.py — Arrow IPC / Parquet wire format for batch scoring
+---------------------------------------------------------------
+Columnar counterpart of batch_io.py. An upload is an Arrow IPC stream
+(Content-Type: application/vnd.apache.arrow.stream) or a Parquet file
+(application/vnd.apache.parquet) with the columns
+
+    city: string   building_type: string   tilt: number   [area: number]
+
+and the response comes back in the same format with
+
+    row, city, building_type, tilt, [area,] predicted_kWh_per_m2, [annual_kWh,] error
+
+No per-row Python objects are created: the buffers of the upload are read
+in place (tilt/area become numpy views), city and building_type are
+dictionary-encoded so only their distinct values are looked up
+(predict_energy_encoded), and the input columns are passed through to the
+output unchanged. error is a dictionary column (null for scored rows).
+
+Scoring runs record batch by record batch (re-chunked to chunk_rows), so
+one vectorized call handles each chunk.
+"""
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+PARQUET = "application/vnd.apache.parquet"
+REQUIRED_COLUMNS = ("city", "building_type", "tilt")
+
+
+def wire_format(content_type: str):
+    """'arrow' / 'parquet' for a columnar Content-Type, else None."""
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    if content_type in (ARROW_STREAM, "application/vnd.apache.arrow"):
+        return "arrow"
+    if content_type in (PARQUET, "application/x-parquet", "application/parquet"):
+        return "parquet"
+    return None
+
+
+def media_type(fmt: str) -> str:
+    return ARROW_STREAM if fmt == "arrow" else PARQUET
+
+
+# === Reading ===
+def read_batches(body: bytes, fmt: str, chunk_rows: int):
+    """Record batches of at most chunk_rows rows, backed by the upload's own memory."""
+    buf = pa.py_buffer(body)
+    if fmt == "arrow":
+        table = ipc.open_stream(buf).read_all()
+        names = table.column_names
+    else:
+        names = pq.ParquetFile(pa.BufferReader(buf)).schema_arrow.names
+    missing = [c for c in REQUIRED_COLUMNS if c not in names]
+    if missing:
+        raise ValueError(f"❌ Missing column(s): {', '.join(missing)}")
+
+    # Only the columns we use are decoded / passed through
+    columns = list(REQUIRED_COLUMNS) + (["area"] if "area" in names else [])
+    if fmt == "arrow":
+        table = table.select(columns)
+    else:
+        table = pq.read_table(pa.BufferReader(buf), columns=columns)
+    return table.to_batches(max_chunksize=chunk_rows)
+
+
+def _dictionary(column: pa.Array):
+    """(distinct values, int codes with -1 for null) without materializing per-row strings."""
+    if not pa.types.is_dictionary(column.type):
+        column = pc.dictionary_encode(column)
+    codes = column.indices.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int64, copy=False)
+    return column.dictionary.to_pylist(), codes
+
+
+def _numbers(column: pa.Array) -> np.ndarray:
+    """float64 numpy array (NaN for null), zero-copy when the column already is float64 without nulls."""
+    if not pa.types.is_floating(column.type) and not pa.types.is_integer(column.type):
+        raise ValueError(f"❌ Column must be numeric, got {column.type}")
+    column = column.cast(pa.float64())
+    return column.to_numpy(zero_copy_only=False)
+
+
+def _errors(n, cities, city_codes, city_known, types, type_codes, type_known, tilts, tilt_null):
+    """Dictionary-encoded error column: one message per distinct bad value, null for good rows."""
+    # Same wording as batch_io: null -> missing, NaN / ±inf -> non-finite
+    messages = ["missing field(s): city", "missing field(s): building_type", "missing field(s): tilt",
+                "tilt must be finite, got nan", "tilt must be finite, got inf", "tilt must be finite, got -inf"]
+    n_fixed = len(messages)
+    messages += [f"❌ City '{c}' not found in city_weather.csv" for c in cities]
+    messages += [f"❌ BuildingType '{t}' not recognized" for t in types]
+    city_msg = np.concatenate([n_fixed + np.arange(len(cities)), [0]])    # code -1 -> "missing city"
+    type_msg = np.concatenate([n_fixed + len(cities) + np.arange(len(types)), [1]])
+    city_ok = np.append(city_known, False)[city_codes]
+    type_ok = np.append(type_known, False)[type_codes]
+
+    idx = np.full(n, -1, dtype=np.int32)
+    bad_type = ~type_ok
+    idx[bad_type] = type_msg[type_codes[bad_type]]
+    bad_city = ~city_ok
+    idx[bad_city] = city_msg[city_codes[bad_city]]   # the city error wins, as in predict_energy
+    # Bad input wins, as in batch_io
+    idx[np.isnan(tilts)] = 3
+    idx[tilts == np.inf] = 4
+    idx[tilts == -np.inf] = 5
+    idx[tilt_null] = 2
+    return pa.DictionaryArray.from_arrays(pa.array(idx, mask=idx < 0), pa.array(messages))
+
+
+# === Scoring ===
+def score_batch(batch: pa.RecordBatch, row_offset: int, predict_encoded, tier: str = "full") -> pa.RecordBatch:
+    n = batch.num_rows
+    cities, city_codes = _dictionary(batch.column("city"))
+    types, type_codes = _dictionary(batch.column("building_type"))
+    tilts = _numbers(batch.column("tilt"))
+    tilt_ok = np.isfinite(tilts)
+    tilt_null = batch.column("tilt").is_null().to_numpy(zero_copy_only=False)
+
+    preds, city_known, type_known = predict_encoded(
+        cities, city_codes, types, type_codes, tilts, valid=tilt_ok, tier=tier)
+
+    columns = {
+        "row": pa.array(np.arange(row_offset, row_offset + n, dtype=np.int64)),
+        "city": batch.column("city"),
+        "building_type": batch.column("building_type"),
+        "tilt": batch.column("tilt"),
+    }
+    if "area" in batch.schema.names:
+        columns["area"] = batch.column("area")
+    columns["predicted_kWh_per_m2"] = pa.array(preds, from_pandas=True)  # NaN -> null
+    if "area" in batch.schema.names:
+        columns["annual_kWh"] = pa.array(np.round(preds * _numbers(batch.column("area")), 3), from_pandas=True)
+    columns["error"] = _errors(n, cities, city_codes, city_known, types, type_codes, type_known, tilts, tilt_null)
+    return pa.RecordBatch.from_pydict(columns)
+
+
+def score_body(body: bytes, fmt: str, predict_encoded, tier: str = "full", chunk_rows: int = 65536) -> bytes:
+    """Decode an Arrow / Parquet upload, score it chunk by chunk and encode the result the same way."""
+    batches = read_batches(body, fmt, chunk_rows)
+    sink = pa.BufferOutputStream()
+    writer = None
+    row = 0
+    try:
+        for batch in batches:
+            out = score_batch(batch, row, predict_encoded, tier)
+            row += batch.num_rows
+            if writer is None:
+                writer = (ipc.new_stream(sink, out.schema) if fmt == "arrow"
+                          else pq.ParquetWriter(sink, out.schema, compression="zstd"))
+            if fmt == "arrow":
+                writer.write_batch(out)
+            else:
+                writer.write_table(pa.Table.from_batches([out]))
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError("❌ Upload contains no rows")
+    return sink.getvalue().to_pybytes()
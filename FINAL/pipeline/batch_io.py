@@ -0,0 +1,181 @@
+"""
+batch_io.py — Streaming record parsing / formatting for batch endpoints
+-----------------------------------------------------------------------
+Turns an uploaded byte stream (NDJSON or CSV with a header line) into
+bounded chunks of records, scores each chunk with one vectorized call and
+formats the results back as NDJSON or CSV lines. Only one chunk is held in
+memory at a time, so the upload size does not matter.
+
+Each input record is (city, building_type, tilt[, area]). Invalid rows
+(bad UTF-8, malformed JSON / CSV, missing or non-finite numbers, lines
+longer than max_line_bytes) are reported inline with their 0-based row
+number instead of failing the batch. A CSV header over max_line_bytes
+fails the whole upload (read_header), since no row could be parsed.
+"""
+
+import csv
+import io
+import json
+import math
+
+import numpy as np
+
+REQUIRED_FIELDS = ("city", "building_type", "tilt")
+CSV_COLUMNS = ["row", "city", "building_type", "tilt", "area", "predicted_kWh_per_m2", "annual_kWh", "error"]
+MAX_LINE_BYTES = 64 * 1024
+
+
+async def iter_lines(byte_stream, max_line_bytes: int = MAX_LINE_BYTES):
+    """
+    Split an async stream of byte chunks into raw (undecoded) lines.
+
+    Only the new chunk is searched for newlines, and at most max_line_bytes
+    of a line are buffered: a longer line is dropped up to its newline and
+    yielded as a ValueError, which iter_records reports as that row's error.
+    """
+    pending, size, overflow = [], 0, False
+    async for chunk in byte_stream:
+        start = 0
+        while True:
+            nl = chunk.find(b"\n", start)
+            end = len(chunk) if nl < 0 else nl
+            if not overflow:
+                if size + end - start > max_line_bytes:
+                    pending, size, overflow = [], 0, True
+                else:
+                    pending.append(chunk[start:end])
+                    size += end - start
+            if nl < 0:
+                break
+            yield ValueError(f"line longer than {max_line_bytes} bytes") if overflow else b"".join(pending).rstrip(b"\r")
+            pending, size, overflow = [], 0, False
+            start = nl + 1
+    if overflow:
+        yield ValueError(f"line longer than {max_line_bytes} bytes")
+    elif size:
+        yield b"".join(pending).rstrip(b"\r")
+
+
+def _number(raw, field: str) -> float:
+    value = raw[field]
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number, got {value!r}")
+    if not math.isfinite(number):
+        raise ValueError(f"{field} must be finite, got {value!r}")
+    return number
+
+
+def _validate(raw) -> dict:
+    """Coerce one raw record; raises ValueError with a readable message."""
+    if not isinstance(raw, dict):
+        raise ValueError("record must be an object")
+    missing = [f for f in REQUIRED_FIELDS if raw.get(f) in (None, "")]
+    if missing:
+        raise ValueError(f"missing field(s): {', '.join(missing)}")
+    rec = {"city": str(raw["city"]), "building_type": str(raw["building_type"]), "tilt": _number(raw, "tilt")}
+    if raw.get("area") not in (None, ""):
+        rec["area"] = _number(raw, "area")
+    return rec
+
+
+async def read_header(lines):
+    """
+    Column names from the first non-blank line of a CSV upload (None for an
+    empty upload). Raises ValueError when that line is over the line cap:
+    its columns are unknown, so the request fails instead of row 0.
+    """
+    async for line in lines:
+        if isinstance(line, ValueError):
+            raise ValueError(f"❌ CSV header {line}")
+        if line.strip():
+            return [h.strip() for h in next(csv.reader([line.decode("utf-8", errors="replace")]))]
+    return None
+
+
+async def iter_records(lines, fmt: str, header=None):
+    """
+    Yield (row, record, error) for every non-blank data line (raw bytes from
+    iter_lines). For CSV the header is read from `lines` with read_header
+    unless the caller already did and passes it in.
+    """
+    if fmt == "csv" and header is None:
+        header = await read_header(lines)
+    row = 0
+    async for line in lines:
+        if isinstance(line, ValueError):
+            yield row, None, str(line)
+            row += 1
+            continue
+        if not line.strip():
+            continue
+        try:
+            line = line.decode("utf-8")
+            if fmt == "csv":
+                values = next(csv.reader([line]))
+                raw = dict(zip(header, values))
+            else:
+                raw = json.loads(line)
+            yield row, _validate(raw), None
+        except UnicodeDecodeError as e:
+            yield row, None, f"invalid UTF-8 at byte {e.start}"
+        except (ValueError, json.JSONDecodeError) as e:
+            yield row, None, str(e)
+        row += 1
+
+
+async def iter_chunks(records, chunk_rows: int):
+    """Group (row, record, error) tuples into lists of at most chunk_rows."""
+    chunk = []
+    async for item in records:
+        chunk.append(item)
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def score_chunk(chunk, predict_batch, tier: str = "full"):
+    """Score the valid records of one chunk in a single call; returns result dicts in row order."""
+    valid = [(row, rec) for row, rec, err in chunk if err is None]
+    preds, errors = np.empty(0), []
+    if valid:
+        preds, errors = predict_batch(
+            city=[r["city"] for _, r in valid],
+            building_type=[r["building_type"] for _, r in valid],
+            tilt=[r["tilt"] for _, r in valid],
+            tier=tier,
+            return_errors=True,
+        )
+    scored = {row: (rec, pred, err) for (row, rec), pred, err in zip(valid, preds, errors)}
+
+    results = []
+    for row, rec, err in chunk:
+        if err is not None:
+            results.append({"row": row, "error": err})
+            continue
+        rec, pred, err = scored[row]
+        out = {"row": row, **rec}
+        if err is not None:
+            out["error"] = err
+        else:
+            out["predicted_kWh_per_m2"] = float(pred)
+            if "area" in rec:
+                out["annual_kWh"] = round(float(pred) * rec["area"], 3)
+        results.append(out)
+    return results
+
+
+def format_ndjson(results) -> str:
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in results)
+
+
+def format_csv(results, header: bool) -> str:
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=CSV_COLUMNS, extrasaction="ignore", lineterminator="\n")
+    if header:
+        writer.writeheader()
+    writer.writerows(results)
+    return buf.getvalue()
@@ -0,0 +1,363 @@
+"""
+bulk_score.py — Out-of-core bulk scoring of the per-city rooftop datasets
+-------------------------------------------------------------------------
+Streams the raw per-city rooftop files (original_datasets/*_rooftop_solarpotential.csv,
+~6.5M rows in total) through the deployed model in fixed-size chunks and
+writes per-roof annual energy to Hive-partitioned Parquet:
+
+    <out>/dataset=accra_rooftop_solarpotential/part-00000.parquet
+                                               part-00001.parquet ...
+                                               _progress.json
+                                               _SUCCESS
+
+Per row: City / Assumed_building_type / Estimated_tilt are mapped to model
+inputs (dataset city names and the integer building-type codes of the
+cleaning notebooks are understood), predict_energy_batch gives kWh/m²/year,
+and that is multiplied by the roof area (--area-column, default
+Potential_installable_area, the area the model's target was normalized by)
+to get kwh_per_year. Rows the model cannot score (unknown city / type,
+missing tilt or area) are kept with NaN predictions and counted.
+
+- Memory is bounded by --chunk-rows per worker (CSV via pandas chunks,
+  Parquet via pyarrow record batches); only the needed columns are read.
+- Files are scored in parallel on a process pool (--jobs); each worker
+  loads the models once. Use ENERGY404_MMAP_FORESTS=1 to share the forests.
+- Every chunk is written atomically and recorded in _progress.json, so an
+  interrupted run resumes at the first unfinished chunk. A file whose
+  source size/mtime or --chunk-rows changed is rescored from scratch.
+
+Run (from FINAL/):
+------------------
+$ python pipeline/bulk_score.py --out bulk_scores --jobs 4
+$ python pipeline/bulk_score.py ../original_datasets/accra_rooftop_solarpotential.csv --out bulk_scores
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import Manager
+from pathlib import Path
+from queue import Empty
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from codes import BUILDING_TYPE_CODES
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_GLOB = str(BASE_DIR.parent / "original_datasets" / "*_rooftop_solarpotential.csv")
+
+PROGRESS_FILENAME = "_progress.json"
+SUCCESS_FILENAME = "_SUCCESS"
+
+# Columns read from the source files (after strip + whitespace -> "_", as in clean_og_solar_v2)
+INPUT_COLUMNS = [
+    "City",
+    "Surface_area",
+    "Potential_installable_area",
+    "Peak_installable_capacity",
+    "Energy_potential_per_year",
+    "Assumed_building_type",
+    "Estimated_tilt",
+]
+AREA_COLUMNS = ["Potential_installable_area", "Surface_area"]
+
+# File-name / dataset city names -> city_weather.csv names the model knows
+CITY_ALIASES = {
+    "dhaka": "GreatDhakaRegion",
+    "johannesburg": "SouthAfrica",
+    "sanpedrosula": "Honduras",
+    "panama8cities": "Panama",
+    "panamacity": "Panama",
+}
+
+
+def _norm_column(name: str) -> str:
+    return re.sub(r"\s+", "_", str(name).strip())
+
+
+def _city_key(name) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+
+def dataset_city(path: Path) -> str:
+    return re.sub(r"_rooftop_?solar_?potential$", "", path.stem)
+
+
+# === Input mapping ===
+class InputMapper:
+    """Maps raw City / Assumed_building_type values to the model's city and building-type names."""
+
+    def __init__(self, cities):
+        self.cities = {_city_key(c): c for c in cities}
+        self.cities.update({k: v for k, v in CITY_ALIASES.items() if v in cities})
+
+    def city(self, values: pd.Series, default: str) -> np.ndarray:
+        keys = values.astype("string").fillna(default)
+        uniques = keys.unique()
+        lookup = {u: self.cities.get(_city_key(u), u) for u in uniques}
+        return keys.map(lookup).to_numpy(dtype=object)
+
+    def building_type(self, values: pd.Series) -> np.ndarray:
+        codes = pd.to_numeric(values, errors="coerce")
+        text = values.astype("string").str.strip().str.lower().str.replace(r"\s+", " ", regex=True)
+        decoded = codes.map(BUILDING_TYPE_CODES)
+        return decoded.where(codes.notna(), text).fillna("").to_numpy(dtype=object)
+
+
+# === Chunked readers ===
+def _iter_csv(path: Path, chunk_rows: int, skip_rows: int):
+    reader = pd.read_csv(
+        path,
+        usecols=lambda c: _norm_column(c) in INPUT_COLUMNS,
+        chunksize=chunk_rows,
+        skiprows=range(1, skip_rows + 1) if skip_rows else None,
+        low_memory=False,
+    )
+    for chunk in reader:
+        yield chunk.rename(columns=_norm_column)
+
+
+def _iter_parquet(path: Path, chunk_rows: int, skip_rows: int):
+    pf = pq.ParquetFile(path)
+    columns = [c for c in pf.schema_arrow.names if _norm_column(c) in INPUT_COLUMNS]
+    skipped = 0
+    for batch in pf.iter_batches(batch_size=chunk_rows, columns=columns):
+        if skipped < skip_rows:  # resume: already-written chunks are decoded but not scored
+            skipped += batch.num_rows
+            continue
+        yield batch.to_pandas().rename(columns=_norm_column)
+
+
+def iter_chunks(path: Path, chunk_rows: int, skip_rows: int = 0):
+    """DataFrames of at most chunk_rows rows (INPUT_COLUMNS that exist), starting after skip_rows."""
+    if path.suffix.lower() == ".parquet":
+        return _iter_parquet(path, chunk_rows, skip_rows)
+    return _iter_csv(path, chunk_rows, skip_rows)
+
+
+def count_rows(path: Path) -> int:
+    """Row count: Parquet footer metadata, or a raw newline count for CSV (for progress / ETA only)."""
+    if path.suffix.lower() == ".parquet":
+        return pq.ParquetFile(path).metadata.num_rows
+    lines = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 24), b""):
+            lines += block.count(b"\n")
+    return max(lines - 1, 0)
+
+
+# === Scoring ===
+def score_chunk(chunk: pd.DataFrame, mapper: InputMapper, predict_batch, default_city: str,
+                area_column: str, tier: str, row_offset: int) -> pd.DataFrame:
+    missing = [c for c in ("Assumed_building_type", "Estimated_tilt", area_column) if c not in chunk]
+    if missing:
+        raise ValueError(f"❌ Missing column(s): {', '.join(missing)}")
+
+    n = len(chunk)
+    # Files without a City column (or rows without a city) take the city from the file name
+    raw_city = chunk["City"] if "City" in chunk else pd.Series([None] * n, dtype="string")
+    cities = mapper.city(raw_city, default_city)
+    types = mapper.building_type(chunk["Assumed_building_type"])
+    tilts = pd.to_numeric(chunk["Estimated_tilt"], errors="coerce").to_numpy(dtype=np.float64)
+    area = pd.to_numeric(chunk[area_column], errors="coerce").to_numpy(dtype=np.float64)
+
+    kwh_per_m2 = np.full(n, np.nan)
+    ok = np.isfinite(tilts)
+    if ok.any():
+        kwh_per_m2[ok] = predict_batch(city=cities[ok], building_type=types[ok], tilt=tilts[ok], tier=tier)
+
+    out = pd.DataFrame({
+        "row": np.arange(row_offset, row_offset + n, dtype=np.int64),
+        "city": cities.astype(str),
+        "building_type": types.astype(str),
+        "tilt": tilts,
+        area_column: area,
+        "kwh_per_m2": kwh_per_m2,
+        "kwh_per_year": kwh_per_m2 * area,
+    })
+    if "Energy_potential_per_year" in chunk:
+        out["reference_kwh_per_year"] = pd.to_numeric(chunk["Energy_potential_per_year"], errors="coerce")
+    return out
+
+
+def _fingerprint(path: Path, chunk_rows: int, area_column: str, tier: str) -> dict:
+    st = path.stat()
+    return {"source": str(path.resolve()), "bytes": st.st_size, "mtime": st.st_mtime,
+            "chunk_rows": chunk_rows, "area_column": area_column, "tier": tier}
+
+
+def _write_json(path: Path, obj: dict) -> None:
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(obj, indent=2), encoding="utf-8")
+    os.replace(tmp, path)
+
+
+def _load_progress(part_dir: Path, fingerprint: dict, overwrite: bool) -> dict:
+    """Progress to resume from; the partition is wiped when it belongs to a different source/config."""
+    progress_path = part_dir / PROGRESS_FILENAME
+    if not overwrite and progress_path.exists():
+        progress = json.loads(progress_path.read_text(encoding="utf-8"))
+        if progress.get("fingerprint") == fingerprint:
+            return progress
+    shutil.rmtree(part_dir, ignore_errors=True)
+    part_dir.mkdir(parents=True)
+    return {"fingerprint": fingerprint, "chunks_done": 0, "rows_done": 0, "rows_scored": 0,
+            "seconds": 0.0, "done": False}
+
+
+def _rows_done(out_dir: Path, path: Path, chunk_rows: int, area_column: str, tier: str, overwrite: bool) -> int:
+    """Rows a resumed run will skip (read-only peek at the partition's progress)."""
+    progress_path = out_dir / f"dataset={path.stem}" / PROGRESS_FILENAME
+    if overwrite or not progress_path.exists():
+        return 0
+    progress = json.loads(progress_path.read_text(encoding="utf-8"))
+    if progress.get("fingerprint") != _fingerprint(path, chunk_rows, area_column, tier):
+        return 0
+    return progress["rows_done"]
+
+
+# Per-process model handle (loaded once per pool worker)
+_predict_batch = None
+_mapper = None
+
+
+def _init_worker(threads: int) -> None:
+    if threads:
+        for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+            os.environ[var] = str(threads)
+
+
+def _model():
+    global _predict_batch, _mapper
+    if _predict_batch is None:
+        import predict
+        _predict_batch = predict.predict_energy_batch
+        _mapper = InputMapper(predict.slot.current.features.cities)
+    return _predict_batch, _mapper
+
+
+def score_file(path: Path, out_dir: Path, chunk_rows: int, area_column: str, tier: str,
+               overwrite: bool = False, progress_queue=None) -> dict:
+    """Score one source file into out_dir/dataset=<stem>/, resuming from its _progress.json."""
+    path = Path(path)
+    part_dir = Path(out_dir) / f"dataset={path.stem}"
+    fingerprint = _fingerprint(path, chunk_rows, area_column, tier)
+    progress = _load_progress(part_dir, fingerprint, overwrite)
+    if progress["done"] and (part_dir / SUCCESS_FILENAME).exists():
+        return {"dataset": path.stem, "skipped": True, **progress}
+
+    predict_batch, mapper = _model()
+    default_city = dataset_city(path)
+    resumed_at = progress["rows_done"]
+
+    for chunk in iter_chunks(path, chunk_rows, skip_rows=progress["rows_done"]):
+        t0 = time.perf_counter()
+        scored = score_chunk(chunk, mapper, predict_batch, default_city, area_column, tier, progress["rows_done"])
+
+        part = part_dir / f"part-{progress['chunks_done']:05d}.parquet"
+        tmp = part.with_suffix(".tmp")
+        pq.write_table(pa.Table.from_pandas(scored, preserve_index=False), tmp, compression="zstd")
+        os.replace(tmp, part)
+
+        progress["chunks_done"] += 1
+        progress["rows_done"] += len(scored)
+        progress["rows_scored"] += int(np.isfinite(scored["kwh_per_year"]).sum())
+        progress["seconds"] = round(progress["seconds"] + time.perf_counter() - t0, 3)
+        _write_json(part_dir / PROGRESS_FILENAME, progress)
+        if progress_queue is not None:
+            progress_queue.put((path.stem, len(scored)))
+
+    progress["done"] = True
+    _write_json(part_dir / PROGRESS_FILENAME, progress)
+    (part_dir / SUCCESS_FILENAME).touch()
+    return {"dataset": path.stem, "skipped": False, "resumed_at": resumed_at, **progress}
+
+
+# === Driver ===
+def _report(queue, futures, todo_rows: int, started: float, every: float) -> None:
+    """Drain worker progress events and print one status line every `every` seconds."""
+    done_rows = 0
+    last = 0.0
+    pending = set(futures)
+    while pending:
+        try:
+            while True:
+                _, rows = queue.get(timeout=0.2)
+                done_rows += rows
+        except Empty:
+            pass
+        pending = {f for f in pending if not f.done()}
+        now = time.perf_counter()
+        if now - last >= every or not pending:
+            last = now
+            rate = done_rows / max(now - started, 1e-9)
+            eta = (todo_rows - done_rows) / rate if rate else float("nan")
+            print(f"🔹 {done_rows:,}/{todo_rows:,} rows ({done_rows / max(todo_rows, 1):.1%}) · {rate:,.0f} rows/s · "
+                  f"ETA {max(eta, 0):.0f}s · {len(futures) - len(pending)}/{len(futures)} files done", flush=True)
+
+
+def run(files, out_dir: Path, chunk_rows: int, jobs: int, area_column: str, tier: str,
+        overwrite: bool, threads: int, report_every: float) -> list:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    todo_rows = sum(count_rows(f) - _rows_done(out_dir, f, chunk_rows, area_column, tier, overwrite) for f in files)
+    started = time.perf_counter()
+    results = []
+
+    with Manager() as manager, ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                                   initargs=(threads,)) as pool:
+        queue = manager.Queue()
+        futures = {pool.submit(score_file, f, out_dir, chunk_rows, area_column, tier, overwrite, queue): f
+                   for f in files}
+        _report(queue, futures, todo_rows, started, report_every)
+        for fut in as_completed(futures):
+            try:
+                r = fut.result()
+            except Exception as e:  # one bad file must not take the rest down
+                print(f"❌ {futures[fut].name}: {e}")
+                results.append({"dataset": futures[fut].stem, "error": str(e)})
+                continue
+            results.append(r)
+            status = "already complete" if r["skipped"] else f"resumed at row {r['resumed_at']:,}" if r["resumed_at"] else "done"
+            print(f"✅ {r['dataset']}: {r['rows_done']:,} rows, {r['rows_scored']:,} scored ({status})")
+
+    elapsed = time.perf_counter() - started
+    print(f"📊 {sum(r.get('rows_done', 0) for r in results):,} rows in {elapsed:.1f}s → {out_dir}")
+    return results
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Score the per-city rooftop datasets in bulk.")
+    ap.add_argument("inputs", nargs="*", help=f"CSV / Parquet files (default: {DEFAULT_GLOB})")
+    ap.add_argument("--out", type=Path, default=BASE_DIR / "bulk_scores")
+    ap.add_argument("--chunk-rows", type=int, default=250_000)
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Files scored in parallel")
+    ap.add_argument("--threads", type=int, default=1, help="OpenMP threads per worker (0 = library default)")
+    ap.add_argument("--area-column", choices=AREA_COLUMNS, default="Potential_installable_area")
+    ap.add_argument("--tier", default="full", help="Accuracy tier (see tiers.py)")
+    ap.add_argument("--overwrite", action="store_true", help="Ignore existing progress and rescore")
+    ap.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    args = ap.parse_args()
+
+    if args.inputs:
+        files = [Path(p) for p in args.inputs]
+    else:
+        files = sorted(Path(DEFAULT_GLOB).parent.glob(Path(DEFAULT_GLOB).name))
+    missing = [str(f) for f in files if not f.is_file()]
+    if missing or not files:
+        sys.exit(f"❌ No input files found: {missing or DEFAULT_GLOB}")
+
+    # Largest files first, so the pool is not left waiting on one big city at the end
+    files.sort(key=lambda f: f.stat().st_size, reverse=True)
+    print(f"🔹 Scoring {len(files)} file(s) with {args.jobs} worker(s), {args.chunk_rows:,} rows per chunk")
+    results = run(files, args.out, args.chunk_rows, args.jobs, args.area_column, args.tier,
+                  args.overwrite, args.threads, args.report_every)
+    if any("error" in r for r in results):
+        sys.exit(1)
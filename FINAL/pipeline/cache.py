@@ -0,0 +1,144 @@
+"""
+cache.py — In-process LRU prediction cache
+------------------------------------------
+Serving traffic is highly repetitive (same city, building type and a few
+integer tilts), so single predictions are memoized on a normalized key:
+
+    (city, building_type, tilt rounded to `tilt_decimals`, tier)
+
+The prediction is made for the rounded tilt, so every request sharing an
+entry gets the same answer. City and building type are used verbatim (no
+trimming), so a cache hit never accepts an input that scoring would reject.
+With maxsize=0 (cache disabled) the tilt is not rounded at all.
+
+The cache is bounded (`maxsize` entries, least recently used evicted first)
+and tagged with a fingerprint of the model artifacts and city_weather.csv
+(path, size, mtime). When any of them changes, the whole cache is dropped
+on the next access (checked at most every `check_interval` seconds).
+
+Model hot-swaps bump a generation counter (clear(generation)). A value is
+put() with the generation it was computed under, and values from an older
+generation are dropped, so a request still running on the previous model
+version cannot refill the cache after the swap cleared it. watch() points
+the fingerprint at the new version's files.
+
+The fingerprint + key also give a stable ETag, so HTTP clients and proxies
+can revalidate with If-None-Match instead of downloading the payload again.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+def files_fingerprint(paths) -> str:
+    """Cheap change detector: hash of (name, size, mtime_ns) for each path."""
+    h = hashlib.sha256()
+    for path in sorted(Path(p) for p in paths):
+        h.update(str(path).encode())
+        try:
+            st = path.stat()
+            h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+        except FileNotFoundError:
+            h.update(b"missing")
+    return h.hexdigest()[:16]
+
+
+class PredictionCache:
+    def __init__(self, watch_paths, maxsize: int = 4096, tilt_decimals: int = 1, check_interval: float = 1.0):
+        self.watch_paths = [Path(p) for p in watch_paths]
+        self.maxsize = int(maxsize)
+        self.tilt_decimals = int(tilt_decimals)
+        self.check_interval = float(check_interval)
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "stale_puts": 0}
+        self.generation = 0
+        self.fingerprint = files_fingerprint(self.watch_paths)
+        self._checked_at = time.monotonic()
+
+    # --- Keys ---
+    def normalize(self, city: str, building_type: str, tilt: float, tier: str = "full") -> tuple:
+        tilt = float(tilt) if self.maxsize <= 0 else round(float(tilt), self.tilt_decimals)
+        return (city, building_type, tilt, tier)
+
+    def etag(self, *parts) -> str:
+        """Strong ETag for a response derived from `parts` under the current model fingerprint."""
+        self._check_fingerprint()
+        digest = hashlib.sha1(repr((self.fingerprint,) + parts).encode()).hexdigest()[:20]
+        return f'"{digest}"'
+
+    # --- Invalidation ---
+    def on_invalidate(self, fn) -> None:
+        """Register a callback run whenever the cache is dropped (e.g. other memoized results)."""
+        self._listeners.append(fn)
+
+    def clear(self, generation: int = None) -> None:
+        """Drop every entry; with `generation`, also refuse later puts from older generations."""
+        with self._lock:
+            if generation is not None:
+                self.generation = max(self.generation, int(generation))
+            self._data.clear()
+            self._stats["invalidations"] += 1
+        for fn in self._listeners:
+            fn()
+
+    def watch(self, watch_paths) -> None:
+        """Fingerprint a different set of files (e.g. the newly active model version's)."""
+        self.watch_paths = [Path(p) for p in watch_paths]
+        self.fingerprint = files_fingerprint(self.watch_paths)
+        self._checked_at = time.monotonic()
+
+    def _check_fingerprint(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        fingerprint = files_fingerprint(self.watch_paths)
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            self.clear()
+
+    # --- Lookup ---
+    def get(self, key):
+        """Cached value for a normalized key, or None."""
+        self._check_fingerprint()
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self._stats["hits"] += 1
+                return self._data[key]
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, value, generation: int = None) -> None:
+        """Store a value computed under `generation` (dropped if a newer one has been cleared in since)."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation < self.generation:
+                self._stats["stale_puts"] += 1
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+            s["size"] = len(self._data)
+        lookups = s["hits"] + s["misses"]
+        s["hit_rate"] = round(s["hits"] / lookups, 4) if lookups else 0.0
+        s.update({
+            "maxsize": self.maxsize,
+            "tilt_decimals": self.tilt_decimals,
+            "generation": self.generation,
+            "fingerprint": self.fingerprint,
+        })
+        return s
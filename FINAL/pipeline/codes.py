@@ -0,0 +1,28 @@
+"""
+codes.py — Building-type code table
+-----------------------------------
+The cleaned rooftop datasets (combine.ipynb) store Assumed_building_type as
+an integer code. bulk_score.py decodes it for the model, rooftops.py /
+schema.py encode names back to codes, and cube.py lays its type axis out
+in name order; they all share the table below.
+"""
+
+BUILDING_TYPE_CODES = {
+    0: "single family residential",
+    1: "multifamily residential",
+    2: "commercial",
+    3: "small commercial",
+    4: "industrial",
+    5: "public sector",
+    6: "peri-urban settlement",
+    7: "schools",
+    8: "public health facilities",
+    9: "hotels",
+}
+
+# Lower-cased names (plus the "public" spelling of some source files) -> code
+TYPE_NAME_CODES = {name: code for code, name in BUILDING_TYPE_CODES.items()}
+TYPE_NAME_CODES["public"] = 5
+
+# Model-facing names in sorted order (the cube's type axis)
+BUILDING_TYPES = sorted(BUILDING_TYPE_CODES.values())
@@ -0,0 +1,446 @@
+"""
+compiled.py — Flat array-based evaluator for the tree ensemble
+--------------------------------------------------------------
+Exports every tree in lgb_models / xgb_models / rf_models / et_models into
+contiguous numpy node arrays (feature, threshold, left/right child, value,
+missing-value routing and a categorical bitmask for BuildingType splits),
+plus the Ridge meta-model coefficients. The evaluator walks all trees of a
+model level by level for a whole batch at once, using numpy only — no
+lightgbm / xgboost / sklearn import and none of their per-call overhead.
+
+Input layout is the numeric feature matrix NUM + CAT from feature_config,
+with BuildingType given as its integer category code.
+
+Decision rules reproduced per library:
+- sklearn : x (float32) <= threshold
+- XGBoost : x (float32) <  split_condition, NaN -> `missing` child,
+            output = base_score + Σ leaves
+- LightGBM: x <= threshold (double), categorical splits go left when the
+            code is in the split's category set, "Zero"/"NaN" missing types
+            follow default_left, output = Σ leaves
+
+Export / check:
+---------------
+$ python pipeline/compiled.py --check 5000
+"""
+
+import argparse
+import json
+from collections import deque
+from pathlib import Path
+
+import numpy as np
+
+COMPILED_DIRNAME = "compiled_ensemble"
+COMPILED_FORMAT_VERSION = 1
+MEMBERS = ["lgb", "xgb", "rf", "et"]
+
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+_LGB_MISSING = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+_LGB_ZERO_THRESHOLD = 1e-35
+_MAX_CAT = 64  # categorical splits are stored as one uint64 bitmask per node
+
+FIELDS = ["feature", "threshold", "left", "right", "value", "default_left", "missing_type", "cat_mask", "roots"]
+
+
+class CompiledForest:
+    """
+    One fitted model (a list of trees) as flat node arrays.
+    Leaves have feature == -1 and point to themselves. sklearn forests may
+    carry empty default_left / missing_type / cat_mask arrays (unused there),
+    and `value` may be float32 (see compress.py).
+    """
+
+    def __init__(self, kind: str, arrays: dict, bias: float = 0.0, combine: str = "sum"):
+        self.kind = kind          # "sklearn" | "xgboost" | "lightgbm"
+        self.bias = float(bias)
+        self.combine = combine    # "sum" (boosting) | "mean" (bagging)
+        for name in FIELDS:
+            setattr(self, name, arrays[name])
+        self.max_depth = int(arrays["max_depth"]) if "max_depth" in arrays else _max_depth(self)
+        self.has_cat = bool(np.any(self.cat_mask))
+        self.n_nodes = len(self.feature)
+
+    @property
+    def n_trees(self) -> int:
+        return len(self.roots)
+
+    def arrays(self) -> dict:
+        return {name: getattr(self, name) for name in FIELDS}
+
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in self.arrays().values())
+
+    def predict(self, X: np.ndarray, max_cells: int = 1 << 20) -> np.ndarray:
+        """Raw model output (log-space target) for each row of X."""
+        if self.kind in ("sklearn", "xgboost"):
+            X = X.astype(np.float32).astype(np.float64)
+        out = np.empty(len(X))
+        step = max(1, max_cells // max(self.n_trees, 1))
+        for start in range(0, len(X), step):
+            leaves = self._apply(X[start:start + step])
+            vals = self.value[leaves]
+            if self.combine == "mean":
+                out[start:start + step] = vals.mean(axis=1, dtype=np.float64)
+            else:
+                out[start:start + step] = vals.sum(axis=1, dtype=np.float64)
+        return out + self.bias
+
+    def _apply(self, X: np.ndarray) -> np.ndarray:
+        """Leaf index reached by every (row, tree) pair."""
+        n_rows = len(X)
+        node = np.tile(self.roots, n_rows)                          # flat (row, tree) pairs
+        row = np.repeat(np.arange(n_rows), self.n_trees)
+        active = np.flatnonzero(self.feature[node] >= 0)
+
+        # Only pairs still sitting on an internal node are advanced each level
+        while len(active):
+            cur = node[active]
+            x = X[row[active], self.feature[cur]]
+
+            if self.kind == "lightgbm":
+                go_left = self._lgb_decision(x, cur)
+            elif self.kind == "xgboost":
+                go_left = (x < self.threshold[cur]) | (np.isnan(x) & self.default_left[cur])
+            else:
+                go_left = x <= self.threshold[cur]
+
+            nxt = np.where(go_left, self.left[cur], self.right[cur])
+            node[active] = nxt
+            active = active[self.feature[nxt] >= 0]
+        return node.reshape(n_rows, self.n_trees)
+
+    def _lgb_decision(self, x: np.ndarray, cur: np.ndarray) -> np.ndarray:
+        missing_type = self.missing_type[cur]
+        nan = np.isnan(x)
+        if nan.any():
+            x = np.where(nan & (missing_type != MISSING_NAN), 0.0, x)
+        go_left = x <= self.threshold[cur]
+
+        is_missing = (missing_type == MISSING_ZERO) & (np.abs(x) <= _LGB_ZERO_THRESHOLD)
+        if nan.any():
+            is_missing |= (missing_type == MISSING_NAN) & nan
+
+        if self.has_cat:
+            mask = self.cat_mask[cur]
+            is_cat = mask != 0
+            if is_cat.any():
+                code = np.where(np.isnan(x), -1, x).astype(np.int64)
+                in_range = (code >= 0) & (code < _MAX_CAT)
+                bit = (mask >> np.where(in_range, code, 0).astype(np.uint64)) & np.uint64(1)
+                go_left = np.where(is_cat, in_range & (bit == 1), go_left)
+                is_missing &= ~is_cat
+
+        return np.where(is_missing, self.default_left[cur], go_left)
+
+
+class CompiledEnsemble:
+    """All four members plus the Ridge meta-model, evaluated with numpy only."""
+
+    def __init__(self, members: dict, meta_coef, meta_intercept: float, feature_names, building_categories):
+        self.members = members  # name -> [CompiledForest, ...]
+        self.meta_coef = np.asarray(meta_coef, dtype=np.float64)
+        self.meta_intercept = float(meta_intercept)
+        self.feature_names = list(feature_names)
+        self.building_categories = list(building_categories)
+
+    def predict_member(self, name: str, X: np.ndarray) -> np.ndarray:
+        """One member's prediction in kWh/m² (mean over its bagged models)."""
+        return np.mean([np.expm1(m.predict(X)) for m in self.members[name]], axis=0)
+
+    def predict_members(self, X: np.ndarray) -> np.ndarray:
+        """(n_rows, 4) matrix of member predictions in kWh/m² (meta-model input)."""
+        return np.column_stack([self.predict_member(name, X) for name in MEMBERS])
+
+    def predict_meta(self, meta_X: np.ndarray) -> np.ndarray:
+        return meta_X @ self.meta_coef + self.meta_intercept
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.predict_meta(self.predict_members(X))
+
+    def nbytes(self) -> int:
+        return sum(m.nbytes() for models in self.members.values() for m in models)
+
+    # --- Persistence: a directory of .npy files (mmap-able) + meta.json ---
+    def save(self, out_dir: Path) -> None:
+        out_dir = Path(out_dir)
+        out_dir.mkdir(parents=True, exist_ok=True)
+        meta = {
+            "format_version": COMPILED_FORMAT_VERSION,
+            "feature_names": self.feature_names,
+            "building_categories": self.building_categories,
+            "meta_coef": self.meta_coef.tolist(),
+            "meta_intercept": self.meta_intercept,
+            "members": {},
+        }
+        for name, models in self.members.items():
+            meta["members"][name] = []
+            for i, m in enumerate(models):
+                for field, arr in m.arrays().items():
+                    np.save(out_dir / f"{name}_{i}_{field}.npy", arr)
+                meta["members"][name].append({
+                    "kind": m.kind, "bias": m.bias, "combine": m.combine,
+                    "max_depth": m.max_depth, "n_trees": m.n_trees, "n_nodes": m.n_nodes,
+                })
+        with open(out_dir / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, path: Path, mmap_mode: str = None) -> "CompiledEnsemble":
+        path = Path(path)
+        with open(path / "meta.json", encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != COMPILED_FORMAT_VERSION:
+            raise ValueError(f"❌ Unsupported compiled ensemble format: {meta.get('format_version')}")
+
+        members = {}
+        for name, infos in meta["members"].items():
+            members[name] = []
+            for i, info in enumerate(infos):
+                arrays = {field: np.load(path / f"{name}_{i}_{field}.npy", mmap_mode=mmap_mode) for field in FIELDS}
+                arrays["max_depth"] = info["max_depth"]
+                members[name].append(CompiledForest(info["kind"], arrays, info["bias"], info["combine"]))
+        return cls(members, meta["meta_coef"], meta["meta_intercept"],
+                   meta["feature_names"], meta["building_categories"])
+
+
+# === Export from the fitted library models ===
+def _max_depth(forest) -> int:
+    """Longest root-to-leaf path (in edges), found by walking all trees level by level."""
+    frontier = np.unique(forest.roots)
+    depth = 0
+    while True:
+        frontier = frontier[forest.feature[frontier] >= 0]
+        if len(frontier) == 0:
+            return depth
+        frontier = np.unique(np.concatenate([forest.left[frontier], forest.right[frontier]]))
+        depth += 1
+
+
+def _finish(nodes: dict, roots: list) -> dict:
+    return {
+        "feature": np.asarray(nodes["feature"], dtype=np.int32),
+        "threshold": np.asarray(nodes["threshold"], dtype=np.float64),
+        "left": np.asarray(nodes["left"], dtype=np.int32),
+        "right": np.asarray(nodes["right"], dtype=np.int32),
+        "value": np.asarray(nodes["value"], dtype=np.float64),
+        "default_left": np.asarray(nodes["default_left"], dtype=bool),
+        "missing_type": np.asarray(nodes["missing_type"], dtype=np.int8),
+        "cat_mask": np.asarray(nodes["cat_mask"], dtype=np.uint64),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+
+
+def _empty_nodes() -> dict:
+    return {k: [] for k in ["feature", "threshold", "left", "right", "value", "default_left", "missing_type", "cat_mask"]}
+
+
+def _append_node(nodes, feature=-1, threshold=0.0, left=-1, right=-1, value=0.0,
+                 default_left=False, missing_type=MISSING_NONE, cat_mask=0) -> int:
+    idx = len(nodes["feature"])
+    nodes["feature"].append(feature)
+    nodes["threshold"].append(threshold)
+    nodes["left"].append(idx if left < 0 else left)
+    nodes["right"].append(idx if right < 0 else right)
+    nodes["value"].append(value)
+    nodes["default_left"].append(default_left)
+    nodes["missing_type"].append(missing_type)
+    nodes["cat_mask"].append(cat_mask)
+    return idx
+
+
+def export_sklearn_forest(model, feature_names) -> CompiledForest:
+    """RandomForestRegressor / ExtraTreesRegressor -> mean of trees."""
+    fitted = list(getattr(model, "feature_names_in_", feature_names))
+    col = np.array([feature_names.index(f) for f in fitted], dtype=np.int32)
+
+    parts, roots, offset = [], [], 0
+    for est in model.estimators_:
+        t = est.tree_
+        leaf = t.children_left < 0
+        idx = np.arange(t.node_count) + offset
+        parts.append((
+            np.where(leaf, -1, col[np.maximum(t.feature, 0)]),
+            np.where(leaf, 0.0, t.threshold),
+            np.where(leaf, idx, t.children_left + offset),
+            np.where(leaf, idx, t.children_right + offset),
+            t.value[:, 0, 0],
+        ))
+        roots.append(offset)
+        offset += t.node_count
+
+    feature, threshold, left, right, value = (np.concatenate(cols) for cols in zip(*parts))
+    arrays = {
+        "feature": feature.astype(np.int32),
+        "threshold": threshold.astype(np.float64),
+        "left": left.astype(np.int32),
+        "right": right.astype(np.int32),
+        "value": value.astype(np.float64),
+        "default_left": np.zeros(offset, dtype=bool),
+        "missing_type": np.zeros(offset, dtype=np.int8),
+        "cat_mask": np.zeros(offset, dtype=np.uint64),
+        "roots": np.asarray(roots, dtype=np.int32),
+    }
+    return CompiledForest("sklearn", arrays, bias=0.0, combine="mean")
+
+
+def export_xgboost(model, feature_names) -> CompiledForest:
+    """XGBRegressor (gbtree, numeric inputs) -> base_score + Σ trees."""
+    booster = model.get_booster()
+    dumps = booster.get_dump(dump_format="json")
+    try:
+        best = model.best_iteration
+    except AttributeError:
+        best = None
+    if best is not None:
+        dumps = dumps[: best + 1]
+
+    config = json.loads(booster.save_config())
+    base_score = float(str(config["learner"]["learner_model_param"]["base_score"]).strip("[]"))
+
+    names = booster.feature_names or [f"f{i}" for i in range(len(feature_names))]
+
+    def feat_index(split: str) -> int:
+        name = split if split in names else names[int(split[1:])]
+        return feature_names.index(name)
+
+    nodes, roots = _empty_nodes(), []
+    for dump in dumps:
+        tree = json.loads(dump)
+        by_id = {}
+        stack = [tree]
+        while stack:
+            n = stack.pop()
+            by_id[n["nodeid"]] = n
+            stack.extend(n.get("children", []))
+
+        # Flat indices in BFS order
+        order, queue = [], deque([tree["nodeid"]])
+        while queue:
+            nid = queue.popleft()
+            order.append(nid)
+            if "leaf" not in by_id[nid]:
+                queue.extend([by_id[nid]["yes"], by_id[nid]["no"]])
+        base = len(nodes["feature"])
+        flat = {nid: base + i for i, nid in enumerate(order)}
+
+        for nid in order:
+            n = by_id[nid]
+            if "leaf" in n:
+                _append_node(nodes, value=float(n["leaf"]))
+            else:
+                _append_node(
+                    nodes,
+                    feature=feat_index(n["split"]),
+                    threshold=float(np.float32(n["split_condition"])),
+                    left=flat[n["yes"]],
+                    right=flat[n["no"]],
+                    default_left=n["missing"] == n["yes"],
+                    missing_type=MISSING_NAN,
+                )
+        roots.append(base)
+
+    return CompiledForest("xgboost", _finish(nodes, roots), bias=base_score, combine="sum")
+
+
+def export_lightgbm(model, feature_names) -> CompiledForest:
+    """LGBMRegressor (pandas categorical BuildingType) -> Σ trees."""
+    booster = model.booster_
+    best = getattr(model, "best_iteration_", None) or None
+    dump = booster.dump_model(num_iteration=best)
+    names = dump["feature_names"]
+
+    nodes, roots = _empty_nodes(), []
+    for info in dump["tree_info"]:
+        root = info["tree_structure"]
+        order, queue = [], deque([root])
+        while queue:
+            n = queue.popleft()
+            order.append(n)
+            if "leaf_value" not in n:
+                queue.extend([n["left_child"], n["right_child"]])
+        base = len(nodes["feature"])
+        flat = {id(n): base + i for i, n in enumerate(order)}
+
+        for n in order:
+            if "leaf_value" in n:
+                _append_node(nodes, value=float(n["leaf_value"]))
+                continue
+
+            feature = feature_names.index(names[n["split_feature"]])
+            cat_mask = 0
+            threshold = 0.0
+            if n["decision_type"] == "==":
+                for c in str(n["threshold"]).split("||"):
+                    if int(c) >= _MAX_CAT:
+                        raise ValueError(f"❌ Categorical code {c} does not fit the {_MAX_CAT}-bit mask")
+                    cat_mask |= 1 << int(c)
+            else:
+                threshold = float(n["threshold"])
+
+            _append_node(
+                nodes,
+                feature=feature,
+                threshold=threshold,
+                left=flat[id(n["left_child"])],
+                right=flat[id(n["right_child"])],
+                value=float(n.get("internal_value", 0.0)),
+                default_left=bool(n.get("default_left", False)),
+                missing_type=_LGB_MISSING.get(n.get("missing_type", "None"), MISSING_NONE),
+                cat_mask=cat_mask,
+            )
+        roots.append(base)
+
+    return CompiledForest("lightgbm", _finish(nodes, roots), bias=0.0, combine="sum")
+
+
+def export_ensemble(lgb_models, xgb_models, rf_models, et_models, meta_model, config) -> CompiledEnsemble:
+    feature_names = list(config["NUM"]) + list(config["CAT"])
+    members = {
+        "lgb": [export_lightgbm(m, feature_names) for m in lgb_models],
+        "xgb": [export_xgboost(m, feature_names) for m in xgb_models],
+        "rf": [export_sklearn_forest(m, feature_names) for m in rf_models[:1]],
+        "et": [export_sklearn_forest(m, feature_names) for m in et_models[:1]],
+    }
+    return CompiledEnsemble(members, meta_model.coef_, meta_model.intercept_,
+                            feature_names, config["BuildingType_categories"])
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Export the ensemble to flat numpy arrays and verify it.")
+    ap.add_argument("--out", type=Path, default=None, help="Output directory (default: MODELS_DIR/compiled_ensemble)")
+    ap.add_argument("--check", type=int, default=2000, help="Random inputs to compare against the native ensemble")
+    args = ap.parse_args()
+
+    import time
+    import predict
+
+    version = predict.slot.current
+    s = version.store
+    compiled = export_ensemble(s.get("lgb_models"), s.get("xgb_models"), s.get("rf_models"),
+                               s.get("et_models"), s.get("meta_model"), s.get("feature_config"))
+    out = args.out or predict.MODELS_DIR / COMPILED_DIRNAME
+    compiled.save(out)
+    print(f"✅ Compiled ensemble saved to {out} ({compiled.nbytes() / 2**20:.1f} MiB of node arrays)")
+    for name, models in compiled.members.items():
+        print(f"- {name}: {sum(m.n_trees for m in models)} trees, {sum(m.n_nodes for m in models):,} nodes")
+
+    # --- Verify against the library models ---
+    rng = np.random.default_rng(404)
+    n = args.check
+    city_idx = rng.integers(0, len(version.features.cities), n)
+    type_code = rng.integers(0, len(version.config["BuildingType_categories"]), n)
+    tilts = rng.uniform(0, 60, n)
+    tilts[: n // 10] = np.round(tilts[: n // 10])  # include exact integer tilts (incl. 0)
+    X = version.features.build(city_idx, type_code, tilts)
+
+    t0 = time.perf_counter()
+    native = predict._ensemble_predict(version, X, backend="native")
+    t_native = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    fast = compiled.predict(X)
+    t_fast = time.perf_counter() - t0
+
+    diff = np.abs(native - fast)
+    print(f"🔍 Max |native - compiled| over {n:,} rows: {diff.max():.2e} kWh/m² (mean {diff.mean():.2e})")
+    print(f"⏱️ native {t_native * 1e3:.1f} ms, compiled {t_fast * 1e3:.1f} ms for {n:,} rows")
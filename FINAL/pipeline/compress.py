@@ -0,0 +1,255 @@
+"""
+compress.py — Compact deployment variant of the RF / ExtraTrees members
+-----------------------------------------------------------------------
+The 400-tree, unlimited-depth forests from model.ipynb dominate model size,
+load time and per-prediction time. This stage takes their flat-array export
+(compiled.py) and shrinks it with:
+
+- tree subsampling   keep the first N trees of each forest
+- depth capping      internal nodes at depth D become leaves
+                     (sklearn stores the node mean on every node)
+- float32 leaves     leaf values rounded to float32
+- subtree merging    identical subtrees (after rounding) share one copy
+
+and reports MAE delta against the full ensemble together with size and
+latency. The result is written as a compiled-format directory holding the
+rf / et members; predict.py uses it when ENERGY404_FOREST_VARIANT=compact.
+
+Build + report:
+---------------
+$ python pipeline/compress.py --trees 100 --max-depth 18 --data dataset/dataset.parquet
+$ python pipeline/compress.py --sweep --data dataset/dataset.parquet   # tradeoff table only
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+
+from compiled import CompiledEnsemble, CompiledForest, export_sklearn_forest
+
+COMPACT_DIRNAME = "forests_compact"
+FOREST_MEMBERS = ["rf", "et"]
+
+
+# === Node-array transforms ===
+def _reachable(forest: CompiledForest) -> np.ndarray:
+    seen = np.zeros(forest.n_nodes, dtype=bool)
+    frontier = np.unique(forest.roots)
+    while len(frontier):
+        seen[frontier] = True
+        internal = frontier[forest.feature[frontier] >= 0]
+        frontier = np.unique(np.concatenate([forest.left[internal], forest.right[internal]]))
+        frontier = frontier[~seen[frontier]]
+    return seen
+
+
+def _rebuild(forest: CompiledForest, feature, threshold, left, right, value, roots) -> CompiledForest:
+    """New sklearn-kind forest keeping only nodes reachable from roots."""
+    tmp = CompiledForest(forest.kind, {
+        "feature": feature, "threshold": threshold, "left": left, "right": right, "value": value,
+        "default_left": np.empty(0, dtype=bool), "missing_type": np.empty(0, dtype=np.int8),
+        "cat_mask": np.empty(0, dtype=np.uint64), "roots": roots, "max_depth": 0,
+    }, forest.bias, forest.combine)
+    keep = _reachable(tmp)
+    new_index = np.cumsum(keep, dtype=np.int64) - 1
+    arrays = {
+        "feature": feature[keep].astype(np.int32),
+        "threshold": threshold[keep],
+        "left": new_index[left[keep]].astype(np.int32),
+        "right": new_index[right[keep]].astype(np.int32),
+        "value": value[keep],
+        "default_left": np.empty(0, dtype=bool),
+        "missing_type": np.empty(0, dtype=np.int8),
+        "cat_mask": np.empty(0, dtype=np.uint64),
+        "roots": new_index[roots].astype(np.int32),
+    }
+    return CompiledForest(forest.kind, arrays, forest.bias, forest.combine)
+
+
+def subsample_trees(forest: CompiledForest, n_trees: int) -> CompiledForest:
+    return _rebuild(forest, forest.feature, forest.threshold, forest.left, forest.right,
+                    forest.value, np.asarray(forest.roots[:n_trees]))
+
+
+def cap_depth(forest: CompiledForest, max_depth: int) -> CompiledForest:
+    """Turn every internal node at depth == max_depth into a leaf."""
+    if forest.kind != "sklearn":
+        raise ValueError("❌ Depth capping needs per-node values (sklearn forests only)")
+    feature = np.array(forest.feature)
+    left = np.array(forest.left)
+    right = np.array(forest.right)
+
+    frontier = np.asarray(forest.roots)
+    for _ in range(max_depth):
+        internal = frontier[feature[frontier] >= 0]
+        frontier = np.concatenate([left[internal], right[internal]])
+    cut = frontier[feature[frontier] >= 0]
+    feature[cut] = -1
+    left[cut] = cut
+    right[cut] = cut
+    return _rebuild(forest, feature, np.asarray(forest.threshold), left, right,
+                    np.asarray(forest.value), np.asarray(forest.roots))
+
+
+def round_leaves(forest: CompiledForest) -> CompiledForest:
+    return _rebuild(forest, np.asarray(forest.feature), np.asarray(forest.threshold), np.asarray(forest.left),
+                    np.asarray(forest.right), np.asarray(forest.value).astype(np.float32), np.asarray(forest.roots))
+
+
+def merge_duplicate_subtrees(forest: CompiledForest) -> CompiledForest:
+    """
+    Hash-cons identical subtrees bottom-up (by height), turning the forest
+    into a DAG. Leaves match on value; internal nodes on
+    (feature, threshold, canonical left, canonical right).
+    """
+    feature = np.asarray(forest.feature)
+    threshold = np.asarray(forest.threshold)
+    left = np.asarray(forest.left)
+    right = np.asarray(forest.right)
+    value = np.asarray(forest.value)
+    internal = feature >= 0
+
+    # Height above the deepest leaf below each node
+    height = np.zeros(forest.n_nodes, dtype=np.int32)
+    while True:
+        h = np.where(internal, np.maximum(height[left], height[right]) + 1, 0)
+        if np.array_equal(h, height):
+            break
+        height = h
+
+    canon = np.arange(forest.n_nodes, dtype=np.int64)
+    value_bits = value.astype(np.float64).view(np.int64)
+    threshold_bits = threshold.astype(np.float64).view(np.int64)
+    for level in range(int(height.max()) + 1):
+        nodes = np.flatnonzero(height == level)
+        if level == 0:
+            keys = value_bits[nodes][:, None]
+        else:
+            keys = np.column_stack([feature[nodes], threshold_bits[nodes], canon[left[nodes]], canon[right[nodes]]])
+        _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+        canon[nodes] = nodes[first][inverse.ravel()]
+
+    new_left = np.where(internal, canon[left], np.arange(forest.n_nodes))
+    new_right = np.where(internal, canon[right], np.arange(forest.n_nodes))
+    return _rebuild(forest, feature, threshold, new_left, new_right, value, canon[np.asarray(forest.roots)])
+
+
+def compress_forest(forest: CompiledForest, n_trees=None, max_depth=None, float32=True, dedup=True) -> CompiledForest:
+    if n_trees:
+        forest = subsample_trees(forest, n_trees)
+    if max_depth:
+        forest = cap_depth(forest, max_depth)
+    if float32:
+        forest = round_leaves(forest)
+    if dedup:
+        forest = merge_duplicate_subtrees(forest)
+    return forest
+
+
+# === Evaluation ===
+def _latency_ms(fn, X: np.ndarray, repeats: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn(X)
+    return 1e3 * (time.perf_counter() - t0) / repeats
+
+
+def evaluate(full: dict, compact: dict, X: np.ndarray, y: np.ndarray, member_preds: dict, meta) -> dict:
+    """
+    MAE of the ensemble with the compact rf/et swapped in vs the full one,
+    plus size and latency of the forests alone.
+    """
+    def ensemble(forests):
+        cols = [member_preds["lgb"], member_preds["xgb"]]
+        cols += [np.expm1(forests[name].predict(X)) for name in FOREST_MEMBERS]
+        return meta.predict(np.column_stack(cols))
+
+    mae_full = float(np.mean(np.abs(ensemble(full) - y)))
+    mae_compact = float(np.mean(np.abs(ensemble(compact) - y)))
+
+    report = {"mae_full": round(mae_full, 4), "mae_compact": round(mae_compact, 4),
+              "mae_delta": round(mae_compact - mae_full, 4), "members": {}}
+    X1, Xb = X[:1], X[:10_000]
+    for name in FOREST_MEMBERS:
+        f, c = full[name], compact[name]
+        report["members"][name] = {
+            "trees": [f.n_trees, c.n_trees],
+            "nodes": [f.n_nodes, c.n_nodes],
+            "mib": [round(f.nbytes() / 2**20, 2), round(c.nbytes() / 2**20, 2)],
+            "ms_1_row": [round(_latency_ms(f.predict, X1, 20), 3), round(_latency_ms(c.predict, X1, 20), 3)],
+            f"ms_{len(Xb)}_rows": [round(_latency_ms(f.predict, Xb, 1), 1), round(_latency_ms(c.predict, Xb, 1), 1)],
+        }
+    return report
+
+
+def _print_report(label: str, report: dict) -> None:
+    print(f"\n=== {label} ===")
+    print(f"MAE full {report['mae_full']:.3f} → compact {report['mae_compact']:.3f} (Δ {report['mae_delta']:+.3f} kWh/m²)")
+    for name, r in report["members"].items():
+        rows_key = [k for k in r if k.startswith("ms_") and k != "ms_1_row"][0]
+        print(f"- {name}: trees {r['trees'][0]}→{r['trees'][1]}, nodes {r['nodes'][0]:,}→{r['nodes'][1]:,}, "
+              f"{r['mib'][0]}→{r['mib'][1]} MiB, 1 row {r['ms_1_row'][0]}→{r['ms_1_row'][1]} ms, "
+              f"{rows_key[3:]} {r[rows_key][0]}→{r[rows_key][1]} ms")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Build and evaluate compact RF/ET forests.")
+    ap.add_argument("--data", type=Path, required=True, help="Parquet file or partitioned dir (rooftops.py) with NUM + BuildingType + kWh_per_m2")
+    ap.add_argument("--sample", type=int, default=50_000, help="Rows used for MAE / latency")
+    ap.add_argument("--trees", type=int, default=100, help="Trees kept per forest")
+    ap.add_argument("--max-depth", type=int, default=18, help="Depth cap (0 = no cap)")
+    ap.add_argument("--no-float32", action="store_true", help="Keep float64 leaf values")
+    ap.add_argument("--no-dedup", action="store_true", help="Skip duplicate-subtree merging")
+    ap.add_argument("--sweep", action="store_true", help="Only print a tradeoff table over preset settings")
+    ap.add_argument("--out", type=Path, default=None, help="Output directory (default: MODELS_DIR/forests_compact)")
+    args = ap.parse_args()
+
+    import pandas as pd
+    import predict
+    import rooftops
+
+    # --- Evaluation data (note: in-sample if this is the training parquet) ---
+    df = rooftops.read(args.data, columns=predict.NUM + ["BuildingType", "kWh_per_m2"])
+    if len(df) > args.sample:
+        df = df.sample(args.sample, random_state=404)
+    X = df[predict.NUM].to_numpy(dtype=np.float64)
+    codes = pd.Categorical(df["BuildingType"], categories=predict.building_categories).codes
+    X = np.column_stack([X, codes.astype(np.float64)])
+    y = df["kWh_per_m2"].to_numpy(dtype=np.float64)
+
+    version = predict.slot.current
+    s = version.store
+    X_lgb = version.features.lgb_frame(X)
+    member_preds = {
+        "lgb": np.mean([np.expm1(m.predict(X_lgb)) for m in s.get("lgb_models")], axis=0),
+        "xgb": np.mean([np.expm1(m.predict(X)) for m in s.get("xgb_models")], axis=0),
+    }
+    names = predict.NUM + predict.CAT
+    full = {
+        "rf": export_sklearn_forest(s.get("rf_models")[0], names),
+        "et": export_sklearn_forest(s.get("et_models")[0], names),
+    }
+
+    settings = [dict(n_trees=args.trees, max_depth=args.max_depth or None,
+                     float32=not args.no_float32, dedup=not args.no_dedup)]
+    if args.sweep:
+        settings = [dict(n_trees=t, max_depth=d, float32=True, dedup=True)
+                    for t in (50, 100, 200) for d in (12, 16, 20, None)]
+
+    for cfg in settings:
+        compact = {name: compress_forest(full[name], **cfg) for name in FOREST_MEMBERS}
+        report = evaluate(full, compact, X, y, member_preds, s.get("meta_model"))
+        report["settings"] = cfg
+        _print_report(", ".join(f"{k}={v}" for k, v in cfg.items()), report)
+
+    if not args.sweep:
+        out = args.out or predict.MODELS_DIR / COMPACT_DIRNAME
+        meta = s.get("meta_model")
+        CompiledEnsemble({name: [compact[name]] for name in FOREST_MEMBERS}, meta.coef_, meta.intercept_,
+                         names, predict.building_categories).save(out)
+        with open(out / "report.json", "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✅ Compact forests saved to {out}")
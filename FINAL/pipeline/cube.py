@@ -0,0 +1,358 @@
+"""
+cube.py — City × building type × tilt-bucket aggregate cube
+-----------------------------------------------------------
+One pass over the cleaned per-city rooftop datasets builds a small dense
+cube of aggregates, so questions like "total installable area of schools in
+Nairobi" are answered from a few array slices instead of rescanning millions
+of rows:
+
+- count      rooftops per cell
+- sums       Surface_area, Potential_installable_area,
+             Peak_installable_capacity, Energy_potential_per_year
+- sketches   quantile sketches of energy per roof (kWh/year) and yield
+             (kWh/m² of installable area): log-spaced buckets with a fixed
+             relative error (SKETCH_ALPHA), merged by adding counts
+
+Cells are (city, building type, tilt bucket of --bucket-width degrees; the
+last bucket is open-ended). Every array is additive, so cubes merge exactly.
+That makes updates incremental: each source file gets its own partial cube
+under <out>/parts/, tagged with the file's size/mtime, and `build` only
+recomputes the parts whose file changed (or is new) before re-merging them
+into <out>/cube.npz. Merging is a handful of array additions.
+
+api.py serves slices from cube.npz via GET /cube.
+
+Build / query (from FINAL/):
+----------------------------
+$ python pipeline/cube.py build --src ../OG_approach_failed/cleaned_datasets/parquet
+$ python pipeline/cube.py query --city Nairobi --building-type schools
+"""
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from bulk_score import InputMapper, dataset_city, iter_chunks
+from cache import files_fingerprint
+from codes import BUILDING_TYPES
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+CUBE_DIRNAME = "cube"
+CUBE_FILENAME = "cube.npz"
+SOURCES_FILENAME = "_sources.json"
+CUBE_FORMAT_VERSION = 1
+
+SUM_COLUMNS = ["Surface_area", "Potential_installable_area", "Peak_installable_capacity", "Energy_potential_per_year"]
+SKETCHES = ["energy_kwh", "yield_kwh_per_m2"]
+
+# === Quantile sketch (log-spaced buckets, relative error SKETCH_ALPHA) ===
+# Bucket k holds values in (gamma^(k-1), gamma^k]; any value in a bucket is
+# within SKETCH_ALPHA of the bucket's representative value. Values below
+# SKETCH_MIN (including 0) share bucket 0, values above SKETCH_MAX the last.
+SKETCH_ALPHA = 0.02
+SKETCH_MIN = 0.1
+SKETCH_MAX = 1e7
+_GAMMA = (1 + SKETCH_ALPHA) / (1 - SKETCH_ALPHA)
+_LOG_GAMMA = math.log(_GAMMA)
+_K_OFFSET = math.ceil(math.log(SKETCH_MIN) / _LOG_GAMMA)
+SKETCH_BINS = math.ceil(math.log(SKETCH_MAX) / _LOG_GAMMA) - _K_OFFSET + 1
+
+
+def sketch_bins(values: np.ndarray) -> np.ndarray:
+    v = np.maximum(values, SKETCH_MIN)
+    k = np.ceil(np.log(v) / _LOG_GAMMA).astype(np.int64) - _K_OFFSET
+    return np.clip(k, 0, SKETCH_BINS - 1)
+
+
+def sketch_quantiles(counts: np.ndarray, quantiles) -> list:
+    total = counts.sum()
+    if total == 0:
+        return [None] * len(quantiles)
+    cum = np.cumsum(counts)
+    out = []
+    for q in quantiles:
+        k = int(np.searchsorted(cum, q * (total - 1), side="right"))
+        value = 2 * _GAMMA ** (k + _K_OFFSET) / (_GAMMA + 1)
+        out.append(round(float(value), 3))
+    return out
+
+
+# === Cube ===
+class Cube:
+    def __init__(self, cities, bucket_width: float, n_buckets: int, count=None, sums=None, sketches=None):
+        self.cities = list(cities)
+        self.types = list(BUILDING_TYPES)
+        self.bucket_width = float(bucket_width)
+        self.n_buckets = int(n_buckets)
+        shape = (len(self.cities), len(self.types), self.n_buckets)
+        self.count = np.zeros(shape, np.int64) if count is None else count
+        self.sums = np.zeros(shape + (len(SUM_COLUMNS),)) if sums is None else sums
+        self.sketches = np.zeros(shape + (len(SKETCHES), SKETCH_BINS), np.uint32) if sketches is None else sketches
+        self.city_index = {c: i for i, c in enumerate(self.cities)}
+        self.type_index = {t: i for i, t in enumerate(self.types)}
+
+    # --- Building ---
+    def add(self, cities: np.ndarray, types: np.ndarray, tilts: np.ndarray, values: dict) -> int:
+        """Accumulate rows (unknown types / missing tilts are skipped); returns rows added."""
+        for c in pd.unique(cities):
+            if c not in self.city_index:
+                self._grow(c)
+        c_idx = np.array([self.city_index[c] for c in cities], dtype=np.int64)
+        t_idx = pd.Series(types).map(self.type_index).to_numpy(dtype=np.float64)
+        ok = np.isfinite(t_idx) & np.isfinite(tilts)
+        if not ok.any():
+            return 0
+
+        b_idx = np.clip(np.floor(tilts[ok] / self.bucket_width), 0, self.n_buckets - 1).astype(np.int64)
+        cell = (c_idx[ok] * len(self.types) + t_idx[ok].astype(np.int64)) * self.n_buckets + b_idx
+        n_cells = self.count.size
+
+        self.count += np.bincount(cell, minlength=n_cells).reshape(self.count.shape)
+        for m, col in enumerate(SUM_COLUMNS):
+            w = np.nan_to_num(values[col][ok])
+            self.sums[..., m] += np.bincount(cell, weights=w, minlength=n_cells).reshape(self.count.shape)
+
+        energy = values["Energy_potential_per_year"][ok]
+        area = values["Potential_installable_area"][ok]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            yield_m2 = np.where(area > 0, energy / area, np.nan)
+        for s, v in enumerate([energy, yield_m2]):
+            has = np.isfinite(v)
+            flat = cell[has] * SKETCH_BINS + sketch_bins(v[has])
+            self.sketches[..., s, :] += np.bincount(flat, minlength=n_cells * SKETCH_BINS).reshape(
+                self.count.shape + (SKETCH_BINS,)).astype(np.uint32)
+        return int(ok.sum())
+
+    def _grow(self, city: str) -> None:
+        self.city_index[city] = len(self.cities)
+        self.cities.append(city)
+        self.count = np.concatenate([self.count, np.zeros((1,) + self.count.shape[1:], self.count.dtype)])
+        self.sums = np.concatenate([self.sums, np.zeros((1,) + self.sums.shape[1:])])
+        self.sketches = np.concatenate([self.sketches, np.zeros((1,) + self.sketches.shape[1:], np.uint32)])
+
+    def merge(self, other: "Cube") -> None:
+        if (other.bucket_width, other.n_buckets) != (self.bucket_width, self.n_buckets):
+            raise ValueError("❌ Cannot merge cubes with different tilt buckets")
+        for j, c in enumerate(other.cities):
+            if c not in self.city_index:
+                self._grow(c)
+            i = self.city_index[c]
+            self.count[i] += other.count[j]
+            self.sums[i] += other.sums[j]
+            self.sketches[i] += other.sketches[j]
+
+    # --- Persistence ---
+    def save(self, path: Path) -> None:
+        tmp = path.with_suffix(".tmp.npz")
+        np.savez_compressed(
+            tmp, count=self.count, sums=self.sums, sketches=self.sketches,
+            meta=np.array(json.dumps({
+                "format_version": CUBE_FORMAT_VERSION, "cities": self.cities, "types": self.types,
+                "bucket_width": self.bucket_width, "n_buckets": self.n_buckets,
+                "sum_columns": SUM_COLUMNS, "sketches": SKETCHES,
+                "sketch": {"alpha": SKETCH_ALPHA, "min": SKETCH_MIN, "max": SKETCH_MAX},
+            })),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "Cube":
+        with np.load(path) as z:
+            meta = json.loads(str(z["meta"]))
+            if (meta["format_version"] != CUBE_FORMAT_VERSION or meta["types"] != BUILDING_TYPES
+                    or meta["sketch"] != {"alpha": SKETCH_ALPHA, "min": SKETCH_MIN, "max": SKETCH_MAX}):
+                raise ValueError(f"❌ {path} was built with a different cube layout; rebuild it")
+            return cls(meta["cities"], meta["bucket_width"], meta["n_buckets"],
+                       z["count"], z["sums"], z["sketches"])
+
+    # --- Queries ---
+    def bucket_label(self, b: int) -> str:
+        lo = b * self.bucket_width
+        if b == self.n_buckets - 1:
+            return f"{lo:g}+"
+        return f"{lo:g}-{lo + self.bucket_width:g}"
+
+    def _summary(self, count, sums, sketches, quantiles) -> dict:
+        n = int(count.sum())
+        totals = sums.reshape(-1, len(SUM_COLUMNS)).sum(axis=0)
+        sk = sketches.reshape(-1, len(SKETCHES), SKETCH_BINS).sum(axis=0)
+        area = totals[SUM_COLUMNS.index("Potential_installable_area")]
+        energy = totals[SUM_COLUMNS.index("Energy_potential_per_year")]
+        return {
+            "rooftops": n,
+            "totals": {col: round(float(v), 3) for col, v in zip(SUM_COLUMNS, totals)},
+            "mean_energy_kwh": round(float(energy / n), 3) if n else None,
+            "yield_kwh_per_m2": round(float(energy / area), 3) if area > 0 else None,
+            "quantiles": {name: dict(zip([str(q) for q in quantiles], sketch_quantiles(sk[s], quantiles)))
+                          for s, name in enumerate(SKETCHES)},
+        }
+
+    def query(self, city: str = None, building_type: str = None, tilt_min: float = None, tilt_max: float = None,
+              group_by: str = None, quantiles=(0.5, 0.9)) -> dict:
+        """
+        Aggregate over the selected slice (omitted dimensions cover everything).
+        Tilt bounds select whole buckets overlapping [tilt_min, tilt_max].
+        group_by="city" | "building_type" | "tilt_bucket" splits the result.
+        """
+        if city is not None and city not in self.city_index:
+            raise ValueError(f"❌ City '{city}' not in the cube")
+        if building_type is not None and building_type not in self.type_index:
+            raise ValueError(f"❌ BuildingType '{building_type}' not recognized")
+        if group_by not in (None, "city", "building_type", "tilt_bucket"):
+            raise ValueError("❌ group_by must be city, building_type or tilt_bucket")
+        if any(not 0 <= q <= 1 for q in quantiles):
+            raise ValueError("❌ quantiles must be within [0, 1]")
+
+        ci = slice(None) if city is None else slice(self.city_index[city], self.city_index[city] + 1)
+        ti = slice(None) if building_type is None else slice(self.type_index[building_type],
+                                                               self.type_index[building_type] + 1)
+        b0 = 0 if tilt_min is None else int(np.clip(tilt_min // self.bucket_width, 0, self.n_buckets - 1))
+        b1 = self.n_buckets - 1 if tilt_max is None else int(np.clip(tilt_max // self.bucket_width, 0,
+                                                                        self.n_buckets - 1))
+        if b1 < b0:
+            raise ValueError("❌ tilt_max must be >= tilt_min")
+        bi = slice(b0, b1 + 1)
+
+        count, sums, sketches = self.count[ci, ti, bi], self.sums[ci, ti, bi], self.sketches[ci, ti, bi]
+        result = {
+            "city": city,
+            "building_type": building_type,
+            "tilt_buckets": [self.bucket_label(b) for b in range(b0, b1 + 1)],
+            **self._summary(count, sums, sketches, quantiles),
+        }
+        if group_by:
+            axis = {"city": 0, "building_type": 1, "tilt_bucket": 2}[group_by]
+            labels = {
+                0: self.cities[ci],
+                1: self.types[ti],
+                2: [self.bucket_label(b) for b in range(b0, b1 + 1)],
+            }[axis]
+            groups = []
+            for j, label in enumerate(labels):
+                take = lambda a: np.take(a, [j], axis=axis)
+                if take(count).sum():
+                    groups.append({group_by: label, **self._summary(take(count), take(sums), take(sketches),
+                                                                    quantiles)})
+            result["groups"] = groups
+        return result
+
+
+# === Incremental build ===
+def build_part(path: Path, mapper: InputMapper, bucket_width: float, n_buckets: int, chunk_rows: int) -> Cube:
+    part = Cube([], bucket_width, n_buckets)
+    default_city = dataset_city(path)
+    for chunk in iter_chunks(path, chunk_rows):
+        raw_city = chunk["City"] if "City" in chunk else pd.Series([None] * len(chunk), dtype="string")
+        values = {col: pd.to_numeric(chunk[col], errors="coerce").to_numpy(dtype=np.float64)
+                  if col in chunk else np.full(len(chunk), np.nan) for col in SUM_COLUMNS}
+        part.add(mapper.city(raw_city, default_city), mapper.building_type(chunk["Assumed_building_type"]),
+                 pd.to_numeric(chunk["Estimated_tilt"], errors="coerce").to_numpy(dtype=np.float64), values)
+    return part
+
+
+def build(files, out_dir: Path, bucket_width: float = 5.0, max_tilt: float = 60.0, chunk_rows: int = 500_000,
+          force: bool = False) -> Cube:
+    """Rebuild the parts of new / changed files, drop parts of removed files, re-merge into cube.npz."""
+    out_dir = Path(out_dir)
+    parts_dir = out_dir / "parts"
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    sources_path = out_dir / SOURCES_FILENAME
+    n_buckets = int(math.ceil(max_tilt / bucket_width)) + 1
+    layout = {"bucket_width": bucket_width, "n_buckets": n_buckets, "format_version": CUBE_FORMAT_VERSION,
+              "sketch_alpha": SKETCH_ALPHA}
+
+    sources = json.loads(sources_path.read_text(encoding="utf-8")) if sources_path.exists() else {}
+    if force or sources.get("layout") != layout:
+        sources = {"layout": layout, "files": {}}
+
+    weather = pd.read_csv(BASE_DIR / "data" / "city_weather.csv")
+    mapper = InputMapper(weather["City"].drop_duplicates().tolist())
+
+    current = {f.stem: f for f in files}
+    for stale in set(sources["files"]) - set(current):
+        (parts_dir / f"{stale}.npz").unlink(missing_ok=True)
+        del sources["files"][stale]
+        print(f"🔹 Removed {stale} (source gone)")
+
+    for name, path in sorted(current.items()):
+        fp = files_fingerprint([path])
+        if sources["files"].get(name) == fp and (parts_dir / f"{name}.npz").exists():
+            continue
+        part = build_part(path, mapper, bucket_width, n_buckets, chunk_rows)
+        part.save(parts_dir / f"{name}.npz")
+        sources["files"][name] = fp
+        print(f"✅ {name}: {int(part.count.sum()):,} rooftops")
+        sources_path.write_text(json.dumps(sources, indent=2), encoding="utf-8")
+
+    sources_path.write_text(json.dumps(sources, indent=2), encoding="utf-8")
+    cube = Cube([], bucket_width, n_buckets)
+    for name in sorted(sources["files"]):
+        cube.merge(Cube.load(parts_dir / f"{name}.npz"))
+    cube.save(out_dir / CUBE_FILENAME)
+    return cube
+
+
+# === Serving-side handle ===
+class CubeStore:
+    """Lazily loaded cube.npz, reloaded when the file changes (checked at most every check_interval s)."""
+
+    def __init__(self, path: Path, check_interval: float = 5.0):
+        self.path = Path(path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._cube = None
+        self._fingerprint = None
+        self._checked_at = -math.inf
+
+    def get(self) -> Cube:
+        now = time.monotonic()
+        if self._cube is not None and now - self._checked_at < self.check_interval:
+            return self._cube
+        with self._lock:
+            self._checked_at = now
+            fp = files_fingerprint([self.path])
+            if fp != self._fingerprint:
+                if not self.path.exists():
+                    raise FileNotFoundError(f"❌ No cube at {self.path} (run pipeline/cube.py build)")
+                self._cube = Cube.load(self.path)
+                self._fingerprint = fp
+            return self._cube
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Build or query the city × building type × tilt aggregate cube.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("build", help="Build / incrementally update the cube")
+    p.add_argument("--src", type=Path, default=BASE_DIR.parent / "OG_approach_failed" / "cleaned_datasets" / "parquet",
+                   help="Directory of per-city CSV / Parquet files")
+    p.add_argument("--out", type=Path, default=BASE_DIR / "data" / CUBE_DIRNAME)
+    p.add_argument("--bucket-width", type=float, default=5.0, help="Tilt bucket width in degrees")
+    p.add_argument("--max-tilt", type=float, default=60.0, help="Tilts above this share one open-ended bucket")
+    p.add_argument("--chunk-rows", type=int, default=500_000)
+    p.add_argument("--force", action="store_true", help="Rebuild every part")
+    p = sub.add_parser("query", help="Print one slice")
+    p.add_argument("--cube", type=Path, default=BASE_DIR / "data" / CUBE_DIRNAME / CUBE_FILENAME)
+    p.add_argument("--city")
+    p.add_argument("--building-type")
+    p.add_argument("--tilt-min", type=float)
+    p.add_argument("--tilt-max", type=float)
+    p.add_argument("--group-by", choices=["city", "building_type", "tilt_bucket"])
+    args = ap.parse_args()
+
+    if args.cmd == "build":
+        files = sorted(f for f in args.src.iterdir()
+                       if f.suffix.lower() in (".csv", ".parquet") and not f.name.startswith(("_", "all_cities")))
+        cube = build(files, args.out, args.bucket_width, args.max_tilt, args.chunk_rows, args.force)
+        print(f"📊 Cube: {len(cube.cities)} cities × {len(cube.types)} types × {cube.n_buckets} tilt buckets, "
+              f"{int(cube.count.sum()):,} rooftops → {args.out / CUBE_FILENAME}")
+    else:
+        cube = Cube.load(args.cube)
+        print(json.dumps(cube.query(args.city, args.building_type, args.tilt_min, args.tilt_max, args.group_by),
+                         indent=2))
@@ -0,0 +1,135 @@
+"""
+features.py — Dense numpy feature builder for inference
+-------------------------------------------------------
+Turns (city, building_type, tilt) into the model's feature matrix without
+going through pandas. Per-city weather (and the city-only interaction
+terms) is held in one dense block indexed by a city -> int map, building
+types are mapped to their category codes, and the tilt / interaction
+columns are computed straight into a preallocated float64 array in the
+column order of config["NUM"] + config["CAT"].
+
+The same builder serves the single-row and batch paths. pandas is only
+needed at the LightGBM boundary (lgb_frame), where BuildingType must be a
+Categorical.
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+
+# city_weather.csv column -> model feature name
+WEATHER_COLUMNS = {
+    "avg_GHI_kWhm2_day": "GHI_kWh_per_m2_day",
+    "avg_temp_C": "AvgTemp_C",
+    "clearness_index": "ClearnessIndex",
+    "precip_mm_day": "Precip_mm_per_day",
+}
+
+# Features that depend on the city only; precomputed once per city
+_CITY_FEATURES = list(WEATHER_COLUMNS.values()) + ["temp_sq", "precip_x_clear"]
+
+# Features that depend on tilt, computed per row
+_TILT_FEATURES = ["tilt", "tilt2", "tilt_sin", "tilt_cos", "tilt_x_GHI", "clear_x_tiltcos"]
+
+
+class FeatureBuilder:
+    """
+    Feature matrix factory for one weather table + feature config.
+
+    Rows use -1 for unknown cities / building types in encode(); callers
+    must filter those out before build().
+    """
+
+    def __init__(self, weather_df: pd.DataFrame, num, cat, building_categories):
+        self.num = list(num)
+        self.cat = list(cat)
+        self.columns = self.num + self.cat
+        self.building_categories = list(building_categories)
+
+        unknown = set(self.num) - set(_CITY_FEATURES) - set(_TILT_FEATURES)
+        if unknown or self.cat != ["BuildingType"]:
+            raise ValueError(f"❌ Feature builder does not know how to compute: {sorted(unknown) or self.cat}")
+
+        # --- Per-city block (first row per city, as predict.py always did) ---
+        weather = weather_df.drop_duplicates("City")
+        self.cities = weather["City"].tolist()
+        self.city_index = {c: i for i, c in enumerate(self.cities)}
+        self.type_index = {t: i for i, t in enumerate(self.building_categories)}
+
+        w = {feat: weather[col].to_numpy(dtype=np.float64) for col, feat in WEATHER_COLUMNS.items()}
+        w["temp_sq"] = w["AvgTemp_C"] ** 2
+        w["precip_x_clear"] = w["Precip_mm_per_day"] * (1.0 - w["ClearnessIndex"])
+        self.city_block = np.column_stack([w[f] for f in _CITY_FEATURES])  # (n_cities, 6)
+
+        self._col = {name: j for j, name in enumerate(self.columns)}
+        self._local = threading.local()
+
+    @property
+    def n_features(self) -> int:
+        return len(self.columns)
+
+    # --- Input encoding ---
+    def encode(self, cities, building_types):
+        """Map city names / building types to int positions (-1 when unknown)."""
+        city_idx = np.fromiter((self.city_index.get(c, -1) for c in cities), dtype=np.int64, count=len(cities))
+        type_code = np.fromiter((self.type_index.get(t, -1) for t in building_types), dtype=np.int64,
+                                count=len(building_types))
+        return city_idx, type_code
+
+    # --- Matrix construction ---
+    def empty(self, n: int) -> np.ndarray:
+        """Column-major buffer so every feature column is contiguous."""
+        return np.empty((n, self.n_features), dtype=np.float64, order="F")
+
+    def build(self, city_idx: np.ndarray, type_code: np.ndarray, tilt: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """Fill (and return) an (n, n_features) matrix for known cities/types."""
+        n = len(tilt)
+        if out is None:
+            out = self.empty(n)
+        col = self._col
+
+        # City-only columns: one gather per column from the dense block
+        for k, name in enumerate(_CITY_FEATURES):
+            if name in col:
+                np.take(self.city_block[:, k], city_idx, out=out[:, col[name]])
+
+        # Tilt columns (tilt_cos is computed via tilt_sin's slot holding radians)
+        t, t2, s, c = (out[:, col[name]] for name in ("tilt", "tilt2", "tilt_sin", "tilt_cos"))
+        t[:] = tilt
+        np.multiply(t, t, out=t2)
+        np.radians(t, out=s)
+        np.cos(s, out=c)
+        np.sin(s, out=s)
+
+        # Tilt × weather interactions
+        np.multiply(t, out[:, col["GHI_kWh_per_m2_day"]], out=out[:, col["tilt_x_GHI"]])
+        np.multiply(out[:, col["ClearnessIndex"]], c, out=out[:, col["clear_x_tiltcos"]])
+
+        out[:, col["BuildingType"]] = type_code
+        return out
+
+    def build_one(self, city: str, building_type: str, tilt: float) -> np.ndarray:
+        """
+        Single-row path reusing a per-thread (1, n_features) buffer.
+        The returned array is overwritten by the next call on the same thread.
+        """
+        buf = getattr(self._local, "row", None)
+        if buf is None:
+            buf = self._local.row = self.empty(1)
+            self._local.idx = np.empty(1, dtype=np.int64)
+            self._local.code = np.empty(1, dtype=np.int64)
+            self._local.tilt = np.empty(1, dtype=np.float64)
+        self._local.idx[0] = self.city_index[city]
+        self._local.code[0] = self.type_index[building_type]
+        self._local.tilt[0] = tilt
+        return self.build(self._local.idx, self._local.code, self._local.tilt, out=buf)
+
+    # --- LightGBM boundary ---
+    def lgb_frame(self, X: np.ndarray) -> pd.DataFrame:
+        """DataFrame view of X with BuildingType as a Categorical (LightGBM input)."""
+        frame = pd.DataFrame(X, columns=self.columns, copy=False)
+        frame["BuildingType"] = pd.Categorical.from_codes(
+            X[:, self._col["BuildingType"]].astype(np.int64), categories=self.building_categories
+        )
+        return frame
@@ -0,0 +1,270 @@
+"""
+grid.py — Precomputed prediction grid (serving fast path)
+---------------------------------------------------------
+The deployed model only ever sees ~20 cities × 10 building types × a tilt
+in [0, 60]. This module scores the full ensemble once over that grid at a
+fine tilt step and stores the result as a small versioned .npz artifact.
+At serving time predict.py answers from the grid by linear interpolation
+on tilt and only falls back to the ensemble for inputs outside the grid.
+
+The artifact records the backend / forest variant it was scored with and
+the size, mtime and SHA-256 of every file those load (model_files(): the
+pickles, or the compiled_ensemble/ and forests_compact/ exports) and of
+city_weather.csv, so a grid built against other models/weather, or for
+another backend or variant, is rejected at load time. Build it with the
+same ENERGY404_BACKEND / ENERGY404_FOREST_VARIANT as the server. The grid
+only answers full-tier requests, so meta_tiers.pkl is not part of it. Checking it is cheap: a file
+matches when the registry manifest lists the same SHA-256 for it, or else
+when its size and mtime are unchanged. Nothing is hashed at serving time.
+
+Build:
+------
+$ python pipeline/grid.py --step 0.1
+$ ENERGY404_FOREST_VARIANT=compact python pipeline/grid.py --step 0.1
+"""
+
+import argparse
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+
+from compiled import COMPILED_DIRNAME
+from compress import COMPACT_DIRNAME
+
+GRID_FORMAT_VERSION = 3
+GRID_FILENAME = "prediction_grid.npz"
+
+# Model pickles of a models directory (relative to MODELS_DIR / DATA_DIR)
+MODEL_FILES = [
+    "lgb_models.pkl",
+    "xgb_models.pkl",
+    "rf_models.pkl",
+    "et_models.pkl",
+    "meta_model.pkl",
+    "feature_config.pkl",
+]
+WEATHER_FILE = "city_weather.csv"
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def model_files(backend: str = "native", forest_variant: str = "full") -> list:
+    """Model artifacts (files or export directories) full-tier predictions are made from."""
+    if backend == "compiled":
+        # The compiled export also holds the RF/ET members unless the compact forests replace them
+        files = ["feature_config.pkl", COMPILED_DIRNAME]
+    else:
+        files = ["lgb_models.pkl", "xgb_models.pkl", "meta_model.pkl", "feature_config.pkl"]
+        if forest_variant != "compact":
+            files += ["rf_models.pkl", "et_models.pkl"]
+    if forest_variant == "compact":
+        files.append(COMPACT_DIRNAME)
+    return files
+
+
+def _source_paths(models_dir: Path, data_dir: Path, backend: str, forest_variant: str) -> dict:
+    """
+    name -> path of every existing file the grid depends on. Export directories
+    are expanded to their files, named as in a registry manifest
+    ("compiled_ensemble/meta.json"); missing files and directories are left out.
+    """
+    models_dir = Path(models_dir)
+    paths = {}
+    for name in model_files(backend, forest_variant):
+        path = models_dir / name
+        if path.is_dir():
+            paths.update({p.relative_to(models_dir).as_posix(): p for p in sorted(path.rglob("*")) if p.is_file()})
+        elif path.is_file():
+            paths[name] = path
+    weather = Path(data_dir) / WEATHER_FILE
+    if weather.is_file():
+        paths[WEATHER_FILE] = weather
+    return paths
+
+
+def source_identity(models_dir: Path, data_dir: Path, backend: str = "native", forest_variant: str = "full") -> dict:
+    """Size, mtime and SHA-256 of each source file (reads every file: build time only)."""
+    sources = {}
+    for name, path in _source_paths(models_dir, data_dir, backend, forest_variant).items():
+        st = path.stat()
+        sources[name] = {"bytes": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": _sha256(path)}
+    return sources
+
+
+def stale_sources(sources: dict, models_dir: Path, data_dir: Path, manifest: dict = None,
+                  backend: str = "native", forest_variant: str = "full") -> list:
+    """
+    Names of the files that no longer match `sources` (as recorded in a grid),
+    including files added or removed since. A file listed in the registry
+    manifest is compared by its SHA-256 there, any other one by size + mtime;
+    neither reads the file.
+    """
+    listed = (manifest or {}).get("files", {})
+    paths = _source_paths(models_dir, data_dir, backend, forest_variant)
+    stale = sorted(set(sources) ^ set(paths))
+    for name in sorted(set(sources) & set(paths)):
+        recorded = sources[name]
+        try:
+            st = paths[name].stat()
+        except FileNotFoundError:
+            stale.append(name)
+            continue
+        if st.st_size != recorded["bytes"]:
+            stale.append(name)
+        elif name in listed:
+            if listed[name]["sha256"] != recorded["sha256"]:
+                stale.append(name)
+        elif st.st_mtime_ns != recorded["mtime_ns"]:
+            stale.append(name)
+    return stale
+
+
+class PredictionGrid:
+    """
+    Dense (city, building_type, tilt) lookup table.
+    values[c, t, k] is the ensemble prediction at tilts[k].
+    """
+
+    def __init__(self, cities, building_types, tilts, values, sources: dict, backend: str = "native",
+                 forest_variant: str = "full"):
+        self.cities = list(cities)
+        self.building_types = list(building_types)
+        self.tilts = np.asarray(tilts, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.sources = sources
+        self.backend = backend
+        self.forest_variant = forest_variant
+
+        self.city_index = {c: i for i, c in enumerate(self.cities)}
+        self.type_index = {t: i for i, t in enumerate(self.building_types)}
+        self.tilt_min = float(self.tilts[0])
+        self.tilt_max = float(self.tilts[-1])
+        self.step = float(self.tilts[1] - self.tilts[0])
+
+    def covers(self, city: str, building_type: str, tilt: float) -> bool:
+        return (
+            city in self.city_index
+            and building_type in self.type_index
+            and self.tilt_min <= tilt <= self.tilt_max
+        )
+
+    def lookup(self, city: str, building_type: str, tilt: float) -> float:
+        """Interpolated prediction for one input. Caller checks covers() first."""
+        curve = self.values[self.city_index[city], self.type_index[building_type]]
+        pos = (tilt - self.tilt_min) / self.step
+        k = min(int(pos), len(self.tilts) - 2)
+        frac = pos - k
+        return float(curve[k] + frac * (curve[k + 1] - curve[k]))
+
+    def lookup_batch(self, city_idx: np.ndarray, type_idx: np.ndarray, tilt: np.ndarray) -> np.ndarray:
+        """Vectorized lookup on integer city/type positions (all rows must be covered)."""
+        pos = (tilt - self.tilt_min) / self.step
+        k = np.minimum(pos.astype(np.int64), len(self.tilts) - 2)
+        frac = pos - k
+        lo = self.values[city_idx, type_idx, k]
+        hi = self.values[city_idx, type_idx, k + 1]
+        return lo + frac * (hi - lo)
+
+    def save(self, path: Path) -> None:
+        meta = {
+            "format_version": GRID_FORMAT_VERSION,
+            "backend": self.backend,
+            "forest_variant": self.forest_variant,
+            "sources": self.sources,
+            "cities": self.cities,
+            "building_types": self.building_types,
+        }
+        np.savez_compressed(
+            path,
+            meta=np.array(json.dumps(meta)),
+            tilts=self.tilts,
+            values=self.values,
+        )
+
+
+def load_grid(path: Path, models_dir: Path, data_dir: Path, manifest: dict = None, backend: str = "native",
+              forest_variant: str = "full"):
+    """
+    Load a grid artifact. Returns None (with a warning) if the file is missing,
+    was written by another format version or for another backend / forest
+    variant, or is stale w.r.t. the current model files / weather file
+    (see stale_sources).
+    """
+    if not path.exists():
+        return None
+
+    with np.load(path, allow_pickle=False) as npz:
+        meta = json.loads(str(npz["meta"]))
+        tilts = npz["tilts"]
+        values = npz["values"]
+
+    if meta.get("format_version") != GRID_FORMAT_VERSION:
+        print(f"⚠️ Ignoring {path.name}: format version {meta.get('format_version')} != {GRID_FORMAT_VERSION}")
+        return None
+    built_for = (meta.get("backend"), meta.get("forest_variant"))
+    if built_for != (backend, forest_variant):
+        print(f"⚠️ Ignoring {path.name}: built for backend={built_for[0]} / forest variant={built_for[1]}, "
+              f"serving backend={backend} / forest variant={forest_variant}")
+        return None
+    stale = stale_sources(meta["sources"], models_dir, data_dir, manifest, backend, forest_variant)
+    if stale:
+        print(f"⚠️ Ignoring stale {path.name}: {', '.join(stale)} changed since it was built")
+        return None
+
+    return PredictionGrid(meta["cities"], meta["building_types"], tilts, values, meta["sources"], backend,
+                          forest_variant)
+
+
+def build_grid(step: float = 0.1, tilt_min: float = 0.0, tilt_max: float = 60.0) -> PredictionGrid:
+    """
+    Score the full ensemble of the active version, with the backend and
+    forest variant the server uses, over every city × building type × tilt.
+    """
+    import predict
+
+    n_steps = int(round((tilt_max - tilt_min) / step))
+    tilts = np.linspace(tilt_min, tilt_max, n_steps + 1)
+
+    with predict.slot.acquire() as version:
+        cities = list(version.features.cities)
+        types = list(version.config["BuildingType_categories"])
+
+        c, t, k = np.meshgrid(np.arange(len(cities)), np.arange(len(types)), np.arange(len(tilts)), indexing="ij")
+        preds = predict.predict_energy_batch(
+            city=np.asarray(cities, dtype=object)[c.ravel()],
+            building_type=np.asarray(types, dtype=object)[t.ravel()],
+            tilt=tilts[k.ravel()],
+            use_grid=False,
+            version=version,
+        )
+        sources = source_identity(version.path, predict.DATA_DIR, predict.BACKEND, predict.FOREST_VARIANT)
+    values = preds.reshape(len(cities), len(types), len(tilts))
+
+    return PredictionGrid(cities, types, tilts, values, sources, predict.BACKEND, predict.FOREST_VARIANT)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Build the precomputed prediction grid.")
+    ap.add_argument("--step", type=float, default=0.1, help="Tilt resolution in degrees")
+    ap.add_argument("--out", type=Path, default=None, help="Output .npz (default: prediction_grid.npz in the active models directory)")
+    args = ap.parse_args()
+
+    import predict
+
+    out = args.out or predict.slot.current.path / GRID_FILENAME
+    grid = build_grid(step=args.step)
+    grid.save(out)
+
+    print(f"✅ Grid saved to {out}")
+    print(f"- Shape: {grid.values.shape} (cities × types × tilts)")
+    print(f"- Size: {out.stat().st_size / 1024:.1f} KiB")
+    print(f"- Backend: {grid.backend} / forest variant: {grid.forest_variant}")
+    print(f"- Sources: {len(grid.sources)} files ({', '.join(sorted({n.split('/')[0] for n in grid.sources}))})")
@@ -0,0 +1,164 @@
+"""
+loader.py — Lazy / concurrent model artifact loading
+----------------------------------------------------
+Keeps the model pickles off the import path. Each artifact is loaded the
+first time it is asked for (ModelStore.get) or all at once in a thread pool
+(ModelStore.load_all), and the per-artifact load time and resident-memory
+growth are recorded for startup reporting.
+
+The sklearn forests can be opened with joblib's mmap_mode so their node
+arrays live in the page cache and are shared between worker processes
+instead of being copied into each one (requires uncompressed joblib dumps,
+which is what model.ipynb writes). The same flag memory-maps the .npy node
+arrays of the compiled / compact exports (compiled.py, compress.py).
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import joblib
+
+# name -> file under MODELS_DIR
+ARTIFACTS = {
+    "feature_config": "feature_config.pkl",
+    "meta_model": "meta_model.pkl",
+    "lgb_models": "lgb_models.pkl",
+    "xgb_models": "xgb_models.pkl",
+    "rf_models": "rf_models.pkl",
+    "et_models": "et_models.pkl",
+}
+
+# Large sklearn forests: candidates for mmap_mode
+FOREST_ARTIFACTS = ("rf_models", "et_models")
+# Everything opened read-only memory-mapped when mmap_forests is on
+MMAP_ARTIFACTS = FOREST_ARTIFACTS + ("compiled", "forests_compact")
+
+
+def rss_bytes():
+    """Current resident set size of this process (Linux /proc; None elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _disk_bytes(path: Path) -> int:
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.iterdir() if p.is_file())
+    return path.stat().st_size
+
+
+class ModelStore:
+    """
+    Thread-safe, lazily populated container for the ensemble artifacts.
+
+    `ready` is set once every artifact has been loaded, whichever way that
+    happened (load_all or individual get calls). After release() the store
+    is retired for good: get() raises instead of loading the models again.
+    """
+
+    def __init__(self, models_dir: Path, mmap_forests: bool = False):
+        self.models_dir = Path(models_dir)
+        self.mmap_forests = mmap_forests
+        self.timings = {}
+        self.ready = threading.Event()
+        self.files = dict(ARTIFACTS)
+        self.required = set(ARTIFACTS)
+        self._loaders = {}
+        self._objects = {}
+        self._locks = {name: threading.Lock() for name in ARTIFACTS}
+        self.released = False
+
+    def register(self, name: str, filename: str, load_fn, required: bool = True) -> None:
+        """Add a non-joblib artifact, loaded with load_fn(path, mmap_mode)."""
+        self.files[name] = filename
+        self._loaders[name] = load_fn
+        self._locks[name] = threading.Lock()
+        if required:
+            self.required.add(name)
+
+    def require(self, names) -> None:
+        """Restrict readiness (and load_all) to the given artifacts."""
+        self.required = set(names)
+        if self.required.issubset(self._objects):
+            self.ready.set()
+
+    def get(self, name: str):
+        """Return an artifact, loading it on first use."""
+        obj = self._objects.get(name)
+        if obj is not None:
+            return obj
+        with self._locks[name]:
+            if self.released:
+                raise RuntimeError(f"❌ Model store for {self.models_dir} was released; "
+                                   f"'{name}' must come from the active model version")
+            if name not in self._objects:
+                self._objects[name] = self._load(name)
+                if self.required.issubset(self._objects):
+                    self.ready.set()
+        return self._objects[name]
+
+    def load_all(self, parallel: bool = True, max_workers: int = None) -> dict:
+        """
+        Load every artifact not yet in memory. With parallel=True the files are
+        read concurrently (joblib releases the GIL while reading array buffers).
+        Returns the timing report.
+        """
+        t0 = time.perf_counter()
+        pending = [n for n in self.files if n in self.required and n not in self._objects]
+        if parallel and len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers or len(pending), thread_name_prefix="model-load") as ex:
+                list(ex.map(self.get, pending))
+        else:
+            for name in pending:
+                self.get(name)
+        self.timings["_total"] = {"seconds": round(time.perf_counter() - t0, 3)}
+        return self.report()
+
+    def release(self) -> None:
+        """Drop every loaded artifact (a retired model version); memory is freed once nothing else refers to it."""
+        for lock in self._locks.values():
+            lock.acquire()
+        try:
+            self.released = True
+            self._objects.clear()
+        finally:
+            for lock in self._locks.values():
+                lock.release()
+        self.ready.clear()
+
+    def report(self) -> dict:
+        rss = rss_bytes()
+        return {
+            "ready": self.ready.is_set(),
+            "released": self.released,
+            "pid": os.getpid(),
+            "rss_mb": None if rss is None else round(rss / 2**20, 1),
+            "mmap_forests": self.mmap_forests,
+            "artifacts": dict(self.timings),
+        }
+
+    def _load(self, name: str):
+        path = self.models_dir / self.files[name]
+        mmap_mode = "r" if self.mmap_forests and name in MMAP_ARTIFACTS else None
+        load_fn = self._loaders.get(name, joblib.load)
+
+        rss_before = rss_bytes()
+        t0 = time.perf_counter()
+        obj = load_fn(path, mmap_mode=mmap_mode)
+        seconds = time.perf_counter() - t0
+        rss_after = rss_bytes()
+
+        # RSS deltas overlap when artifacts load concurrently; treat them as indicative
+        self.timings[name] = {
+            "seconds": round(seconds, 3),
+            "file_mb": round(_disk_bytes(path) / 2**20, 1),
+            "rss_delta_mb": None if rss_before is None else round((rss_after - rss_before) / 2**20, 1),
+            "mmap": mmap_mode is not None,
+        }
+        print(f"🔹 Loaded {name} in {seconds:.2f}s{' (mmap)' if mmap_mode else ''}")
+        return obj
@@ -0,0 +1,210 @@
+"""
+metrics.py — Hot-path latency instrumentation (Prometheus text format)
+----------------------------------------------------------------------
+A tiny in-process metrics registry (no client library needed):
+
+- histograms   per-stage latency of predict_energy / predict_energy_batch
+               (validate, features, grid, lgb_frame, lgb, xgb, rf, et, meta)
+               and per-route HTTP latency in api.py
+- counters     requests, errors, predicted rows
+- gauges       in-flight requests, plus values read at scrape time
+               (cache / scheduler stats) via register_callback()
+
+Per-request tracing: inside `with metrics.trace() as spans:` every stage
+entered in the same context (including run_in_threadpool calls, which copy
+the context) is also appended to `spans` as (stage, seconds). This works
+even when ENERGY404_METRICS=0.
+
+Hot-path cost is two perf_counter() calls, a bisect and a lock per stage
+(a few µs; ~1% of a single compiled-backend prediction).
+ENERGY404_METRICS=0 turns every hook into a no-op.
+
+Usage:
+------
+>>> import metrics
+>>> with metrics.stage("lgb"):
+...     model.predict(X)
+>>> print(metrics.render())
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+ENABLED = os.environ.get("ENERGY404_METRICS", "1") != "0"
+
+# Latency buckets in seconds (100 µs … 10 s)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+           0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_METRIC = "energy404_stage_seconds"
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in sorted(labels.items())) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}        # name -> (kind, help)
+        self._histograms = {}  # (name, labels) -> [bucket counts..., +Inf], sum
+        self._values = {}      # (name, labels) -> float (counters and gauges)
+        self._callbacks = []   # (name, kind, help, fn, label)
+
+    def describe(self, name: str, kind: str, help_text: str) -> None:
+        self._meta[name] = (kind, help_text)
+
+    # --- Recording ---
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        self.observe_key((name, _labels(labels)), seconds)
+
+    def observe_key(self, key: tuple, seconds: float) -> None:
+        """observe() with a pre-built (name, labels) key (hot path)."""
+        i = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                h = self._histograms[key] = [[0] * (len(BUCKETS) + 1), 0.0]
+            h[0][i] += 1
+            h[1] += seconds
+
+    def add(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _labels(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def register_callback(self, name: str, kind: str, help_text: str, fn, label: str = None) -> None:
+        """Value read at scrape time: fn() -> number, or {label value: number} when `label` is given."""
+        self._callbacks.append((name, kind, help_text, fn, label))
+
+    # --- Exposition ---
+    def render(self) -> str:
+        with self._lock:
+            histograms = {k: (list(v[0]), v[1]) for k, v in self._histograms.items()}
+            values = dict(self._values)
+
+        lines = []
+        seen = set()
+
+        def header(name):
+            if name not in seen and name in self._meta:
+                kind, help_text = self._meta[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+            seen.add(name)
+
+        for (name, labels), (counts, total) in sorted(histograms.items()):
+            header(name)
+            inner = labels[1:-1] + "," if labels else ""
+            cumulative = 0
+            for bound, c in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += c
+                lines.append(f'{name}_bucket{{{inner}le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{labels} {total:.9f}")
+            lines.append(f"{name}_count{labels} {cumulative}")
+
+        for (name, labels), value in sorted(values.items()):
+            header(name)
+            lines.append(f"{name}{labels} {value:g}")
+
+        for name, kind, help_text, fn, label in self._callbacks:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            value = fn()
+            if label:
+                for k, v in value.items():
+                    lines.append(f"{name}{_labels({label: k})} {v:g}")
+            else:
+                lines.append(f"{name} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+REGISTRY.describe(STAGE_METRIC, "histogram", "Latency of inference stages and ensemble members")
+REGISTRY.describe("energy404_predict_seconds", "histogram", "End-to-end latency of predict_energy / predict_energy_batch")
+REGISTRY.describe("energy404_predicted_rows_total", "counter", "Rows scored, by source (grid or ensemble)")
+
+
+# === Hot-path hooks ===
+_perf_counter = time.perf_counter
+_stage_keys = {}
+_trace = ContextVar("energy404_trace", default=None)
+
+
+class _Stage:
+    __slots__ = ("key", "name", "spans", "t0")
+
+    def __init__(self, key: tuple, name: str, spans):
+        self.key = key
+        self.name = name
+        self.spans = spans
+
+    def __enter__(self):
+        self.t0 = _perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = _perf_counter() - self.t0
+        if ENABLED:
+            REGISTRY.observe_key(self.key, seconds)
+        if self.spans is not None:
+            self.spans.append((self.name, seconds))
+        return False
+
+
+class _NoopStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopStage()
+
+
+def stage(name: str, metric: str = STAGE_METRIC):
+    """Context manager timing one stage into `metric{stage=name}` (and the active trace, if any)."""
+    spans = _trace.get()
+    if not ENABLED and spans is None:
+        return _NOOP
+    key = _stage_keys.get((metric, name))
+    if key is None:
+        key = _stage_keys[(metric, name)] = (metric, _labels({"stage": name}))
+    return _Stage(key, name, spans)
+
+
+@contextmanager
+def trace():
+    """Collect (stage, seconds) spans for everything run in this context."""
+    spans = []
+    token = _trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _trace.reset(token)
+
+
+def tracing() -> bool:
+    return _trace.get() is not None
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    if ENABLED:
+        REGISTRY.observe(name, seconds, **labels)
+
+
+def add(name: str, value: float = 1, **labels) -> None:
+    if ENABLED:
+        REGISTRY.add(name, value, **labels)
+
+
+def render() -> str:
+    return REGISTRY.render()
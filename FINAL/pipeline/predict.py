@@ -10,96 +10,404 @@ Usage example:
 >>> from predict import predict_energy
 >>> predict_energy(city="Accra", building_type="commercial", tilt=25)
 268.4  # predicted kWh/m² per year
+
+>>> from predict import predict_energy_batch
+>>> predict_energy_batch(city=["Accra", "Karachi"], building_type=["commercial", "schools"], tilt=[25, 10])
+array([268.4, 251.9])
 """
 
+import os
+import threading
+import time
+import warnings
+from contextlib import nullcontext
 import numpy as np
 import pandas as pd
 import joblib
 from pathlib import Path
 
+import metrics
+from compiled import COMPILED_DIRNAME, CompiledEnsemble
+from compress import COMPACT_DIRNAME
+from features import FeatureBuilder
+from grid import GRID_FILENAME, load_grid
+from loader import ARTIFACTS, ModelStore
+from registry import REGISTRY_DIRNAME, LoadedVersion, ModelRegistry, VersionSlot
+from tiers import DEFAULT_TIER, TIERS, TIERS_FILENAME, check_tier
+
 # === Paths ===
 BASE_DIR = Path(__file__).resolve().parent.parent
 MODELS_DIR = BASE_DIR / "models_local_backup"
 DATA_DIR = BASE_DIR / "data"
 
-# === Load model artifacts ===
-print("🔹 Loading trained model components...")
-lgb_models = joblib.load(MODELS_DIR / "lgb_models.pkl")
-xgb_models = joblib.load(MODELS_DIR / "xgb_models.pkl")
-rf_models  = joblib.load(MODELS_DIR / "rf_models.pkl")
-et_models  = joblib.load(MODELS_DIR / "et_models.pkl")
-meta_model = joblib.load(MODELS_DIR / "meta_model.pkl")
-config     = joblib.load(MODELS_DIR / "feature_config.pkl")
+# === Model artifacts (loaded lazily, see loader.py) ===
+# Nothing heavy happens at import: each model family is unpickled on first
+# use, or all together via store.load_all() (api.py does this at startup).
+# ENERGY404_MMAP_FORESTS=1 memory-maps the RF/ET pickles (and compiled .npy arrays).
+MMAP_FORESTS = os.environ.get("ENERGY404_MMAP_FORESTS", "0") == "1"
+
+# ENERGY404_BACKEND=compiled serves from the flat-array export (compiled.py)
+# and never unpickles the library models.
+BACKEND = os.environ.get("ENERGY404_BACKEND", "native")
 
-NUM = config["NUM"]
-CAT = config["CAT"]
-building_categories = config["BuildingType_categories"]
+# ENERGY404_FOREST_VARIANT=compact swaps the RF/ET members for the smaller
+# forests written by compress.py (either backend).
+FOREST_VARIANT = os.environ.get("ENERGY404_FOREST_VARIANT", "full")
+
+# Set ENERGY404_USE_GRID=0 to always run the full ensemble.
+USE_GRID = os.environ.get("ENERGY404_USE_GRID", "1") != "0"
 
 # === Load city-level weather data ===
 weather_path = DATA_DIR / "city_weather.csv"
 weather_df = pd.read_csv(weather_path)
 
+# Ignore sklearn's "X does not have valid feature names" warning: the forests
+# are fed the same NUM + CAT matrix they were fitted on, just as numpy.
+warnings.filterwarnings("ignore", message="X does not have valid feature names")
+
+
+def open_version(models_dir: Path, name: str = "local", manifest: dict = None) -> LoadedVersion:
+    """
+    Artifact store, feature builder and prediction grid for one models
+    directory (the flat MODELS_DIR or a registry version).
+    Only feature_config is read here; the models load lazily and the grid
+    is checked against file stats / the manifest, never by hashing the models.
+    """
+    store = ModelStore(models_dir, mmap_forests=MMAP_FORESTS)
+    store.register("compiled", COMPILED_DIRNAME, CompiledEnsemble.load, required=False)
+    if BACKEND == "compiled":
+        store.require(["feature_config", "compiled"])
+    store.register("forests_compact", COMPACT_DIRNAME, CompiledEnsemble.load, required=False)
+    if FOREST_VARIANT == "compact":
+        store.require((store.required - {"rf_models", "et_models"}) | {"forests_compact"})
+    # Reduced meta-learners for the "fast" / "balanced" tiers (see tiers.py)
+    store.register("meta_tiers", TIERS_FILENAME, joblib.load, required=False)
+
+    config = store.get("feature_config")
+
+    # Dense per-city weather block + categorical codes (see features.py)
+    features = FeatureBuilder(weather_df, config["NUM"], config["CAT"], config["BuildingType_categories"])
+
+    # Precomputed prediction grid (fast path, see grid.py)
+    grid = None
+    if USE_GRID and (models_dir / GRID_FILENAME).exists():
+        grid = load_grid(models_dir / GRID_FILENAME, models_dir, DATA_DIR, manifest, BACKEND, FOREST_VARIANT)
+        if grid is not None:
+            print(f"🔹 Serving from prediction grid ({grid.step:g}° tilt step)")
+
+    return LoadedVersion(name, models_dir, manifest, store, features, grid, config)
+
+
+# === Active model version (hot-swappable, see registry.py) ===
+# With a registry, the version named by ENERGY404_MODEL_VERSION or
+# registry/ACTIVE is served; otherwise the flat MODELS_DIR ("local").
+# Every prediction pins the active version for its whole duration, so
+# activate() can swap versions under live traffic.
+registry = ModelRegistry(MODELS_DIR / REGISTRY_DIRNAME)
+_boot_version = os.environ.get("ENERGY404_MODEL_VERSION") or registry.active()
+if _boot_version:
+    slot = VersionSlot(open_version(registry.path(_boot_version), _boot_version, registry.manifest(_boot_version)))
+else:
+    slot = VersionSlot(open_version(MODELS_DIR))
+
+_activate_lock = threading.Lock()
+_swap_listeners = []
+
+
+def _publish(version: LoadedVersion) -> None:
+    # The feature config names predict.py has always exported. Models, features
+    # and the grid are not published: take them from a pinned version
+    # (`with slot.acquire() as version:`) so one call never mixes two versions.
+    global config, NUM, CAT, building_categories
+    config = version.config
+    NUM = config["NUM"]
+    CAT = config["CAT"]
+    building_categories = config["BuildingType_categories"]
+
+
+_publish(slot.current)
+
+
+def __getattr__(name):
+    # Keep `predict.lgb_models`, `predict.meta_model`, ... working for callers
+    if name in ARTIFACTS:
+        return slot.current.store.get(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def available_tiers(version: LoadedVersion = None) -> list:
+    """Tiers `version` (default: the active one) can serve; fast / balanced need meta_tiers.pkl."""
+    version = version or slot.current
+    has_meta_tiers = (version.path / TIERS_FILENAME).is_file()
+    return [t for t in TIERS if t == DEFAULT_TIER or has_meta_tiers]
+
+
+def on_swap(fn) -> None:
+    """Register fn(new_version), called after every successful activate()."""
+    _swap_listeners.append(fn)
+
+
+def activate(version: str, warm_rows: int = 256, persist: bool = True) -> dict:
+    """
+    Hot-swap to a registry version: verify it against its manifest, load
+    every artifact, warm it with synthetic predictions, then atomically make
+    it the active version. The previous version finishes its in-flight calls
+    and is released afterwards. Runs in the calling thread; one at a time.
+    """
+    with _activate_lock:
+        t0 = time.perf_counter()
+        manifest = registry.verify(version)
+        t_verify = time.perf_counter()
+
+        new = open_version(registry.path(version), version, manifest)
+        new.store.load_all()
+        t_load = time.perf_counter()
+
+        # --- Warm-up: run every member once before taking traffic ---
+        rng = np.random.default_rng(404)
+        cities = rng.choice(new.features.cities, warm_rows)
+        types = rng.choice(new.config["BuildingType_categories"], warm_rows)
+        tilts = rng.uniform(0, 60, warm_rows)
+        _predict_batch(new, cities, types, tilts, use_grid=False, tier=DEFAULT_TIER)
+        for i in range(3):
+            _predict_one(new, cities[i], types[i], tilts[i], use_grid=False, tier=DEFAULT_TIER)
+        t_warm = time.perf_counter()
+
+        new.timings = {
+            "verify_s": round(t_verify - t0, 3),
+            "load_s": round(t_load - t_verify, 3),
+            "warm_s": round(t_warm - t_load, 3),
+            "artifacts": new.store.report()["artifacts"],
+            "activated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        old = slot.swap(new)
+        _publish(new)
+        if persist:
+            registry.set_active(version)
+        for fn in _swap_listeners:
+            fn(new)
+
+    print(f"✅ Activated model version {version} (previous: {old.name})")
+    return {"version": version, "previous": old.name, **new.timings}
+
+
 # === Core prediction function ===
-def predict_energy(city: str, building_type: str, tilt: float) -> float:
+def predict_energy(city: str, building_type: str, tilt: float, use_grid: bool = True,
+                   tier: str = DEFAULT_TIER) -> float:
     """
     Predict rooftop solar potential (kWh/m²/year)
     for the given city, building type, and roof tilt.
+
+    Answers from the precomputed grid when one is loaded and covers the
+    input; otherwise (or with use_grid=False) runs the full ensemble.
+    tier="fast" / "balanced" evaluates only a subset of the members.
     """
+    check_tier(tier)
+    with slot.acquire() as version:
+        check_tier(tier, available_tiers(version))
+        return _predict_one(version, city, building_type, tilt, use_grid, tier)
+
+
+def _predict_one(version: LoadedVersion, city: str, building_type: str, tilt: float, use_grid: bool,
+                 tier: str) -> float:
+    grid, features = version.grid, version.features
+    with metrics.stage("predict_energy", "energy404_predict_seconds"):
+        if use_grid and tier == "full" and grid is not None and grid.covers(city, building_type, tilt):
+            with metrics.stage("grid"):
+                pred = round(grid.lookup(city, building_type, tilt), 3)
+            metrics.add("energy404_predicted_rows_total", source="grid")
+            return pred
+
+        # --- Validate inputs ---
+        with metrics.stage("validate"):
+            if city not in features.city_index:
+                raise ValueError(f"❌ City '{city}' not found in city_weather.csv")
+            if building_type not in features.type_index:
+                raise ValueError(f"❌ BuildingType '{building_type}' not recognized")
 
-    # --- Validate inputs ---
-    if city not in weather_df["City"].values:
-        raise ValueError(f"❌ City '{city}' not found in city_weather.csv")
-    if building_type not in building_categories:
-        raise ValueError(f"❌ BuildingType '{building_type}' not recognized")
-
-    # --- Lookup city weather ---
-    row = weather_df.loc[weather_df["City"] == city].iloc[0]
-    GHI = row["avg_GHI_kWhm2_day"]
-    Temp = row["avg_temp_C"]
-    Clear = row["clearness_index"]
-    Precip = row["precip_mm_day"]
-
-    # --- Compute tilt features ---
-    tilt2 = tilt ** 2
-    tilt_sin = np.sin(np.radians(tilt))
-    tilt_cos = np.cos(np.radians(tilt))
-
-    # --- Create full feature dict ---
-    feats = {
-        "tilt": tilt,
-        "tilt2": tilt2,
-        "tilt_sin": tilt_sin,
-        "tilt_cos": tilt_cos,
-        "GHI_kWh_per_m2_day": GHI,
-        "AvgTemp_C": Temp,
-        "ClearnessIndex": Clear,
-        "Precip_mm_per_day": Precip,
-        # interactions (same as training)
-        "tilt_x_GHI": tilt * GHI,
-        "temp_sq": Temp ** 2,
-        "clear_x_tiltcos": Clear * tilt_cos,
-        "precip_x_clear": Precip * (1.0 - Clear),
-        "BuildingType": building_type,
-    }
-
-    X = pd.DataFrame([feats])
-    X["BuildingType"] = pd.Categorical(X["BuildingType"], categories=building_categories)
-
-    # Encoded version for models that need numeric cat
-    X_enc = X.copy()
-    X_enc["BuildingType"] = X_enc["BuildingType"].cat.codes
+        # --- Feature row (weather lookup + tilt/interaction terms) ---
+        with metrics.stage("features"):
+            X = features.build_one(city, building_type, tilt)
+
+        pred_final = _ensemble_predict(version, X, tier=tier)[0]
+        metrics.add("energy404_predicted_rows_total", source="ensemble")
+
+    return round(float(pred_final), 3)
+
+
+# === Shared ensemble scoring ===
+def _ensemble_predict(version: LoadedVersion, X: np.ndarray, backend: str = None,
+                      tier: str = DEFAULT_TIER) -> np.ndarray:
+    """
+    Run the tier's ensemble members of `version` once over a feature matrix
+    (NUM + CAT columns, BuildingType as its category code) and combine them
+    with the matching Ridge meta-model.
+    """
+    store, features = version.store, version.features
+    backend = backend or BACKEND
+    compiled = store.get("compiled") if backend == "compiled" else None
+    forests = store.get("forests_compact") if FOREST_VARIANT == "compact" else compiled
+    members = TIERS[tier]
 
     # --- Generate predictions from each model ---
-    pred_lgb = np.mean([np.expm1(m.predict(X)) for m in lgb_models], axis=0)
-    pred_xgb = np.mean([np.expm1(m.predict(X_enc)) for m in xgb_models], axis=0)
-    pred_rf  = np.expm1(rf_models[0].predict(X_enc))
-    pred_et  = np.expm1(et_models[0].predict(X_enc))
+    preds = []
+    if "lgb" in members:
+        if compiled is not None:
+            with metrics.stage("lgb"):
+                preds.append(compiled.predict_member("lgb", X))
+        else:
+            with metrics.stage("lgb_frame"):
+                X_lgb = features.lgb_frame(X)  # LightGBM needs BuildingType as a pandas Categorical
+            with metrics.stage("lgb"):
+                preds.append(np.mean([np.expm1(m.predict(X_lgb)) for m in store.get("lgb_models")], axis=0))
+    if "xgb" in members:
+        with metrics.stage("xgb"):
+            if compiled is not None:
+                preds.append(compiled.predict_member("xgb", X))
+            else:
+                preds.append(np.mean([np.expm1(m.predict(X)) for m in store.get("xgb_models")], axis=0))
+    for name in ("rf", "et"):
+        if name in members:
+            with metrics.stage(name):
+                if forests is not None:
+                    preds.append(forests.predict_member(name, X))
+                else:
+                    preds.append(np.expm1(store.get(f"{name}_models")[0].predict(X)))
 
     # --- Meta prediction (Ridge ensemble) ---
-    meta_X = np.column_stack([pred_lgb, pred_xgb, pred_rf, pred_et])
-    pred_final = meta_model.predict(meta_X)[0]
+    with metrics.stage("meta"):
+        meta_X = np.column_stack(preds)
+        if tier != "full":
+            return store.get("meta_tiers")[tier]["meta"].predict(meta_X)
+        if compiled is not None:
+            return compiled.predict_meta(meta_X)
+        return store.get("meta_model").predict(meta_X)
 
-    return round(float(pred_final), 3)
+
+# === Batch prediction ===
+def predict_energy_batch(data=None, city=None, building_type=None, tilt=None,
+                         return_errors: bool = False, use_grid: bool = True, tier: str = DEFAULT_TIER,
+                         version: LoadedVersion = None):
+    """
+    Vectorized predict_energy for many rooftops at once.
+
+    Pass either a DataFrame with `city`, `building_type` and `tilt` columns,
+    or three equal-length arrays via the keyword arguments. The feature matrix
+    is built once and every ensemble member is called once for the whole batch.
+
+    Rows with an unknown city or building type do not raise: their prediction
+    is NaN. With return_errors=True a `(preds, errors)` tuple is returned,
+    where errors[i] is the message predict_energy would have raised for row i
+    (or None when the row was scored).
+
+    Rows covered by the prediction grid are interpolated from it; only the
+    rest go through the ensemble (use_grid=False forces the ensemble).
+    The grid holds full-tier predictions, so other tiers always use the models.
+
+    Scores with the active version, or with `version` when the caller already
+    holds one from slot.acquire() (multi-call jobs such as grid.py, tilt.py).
+    """
+    check_tier(tier)
+    if data is not None:
+        city, building_type, tilt = data["city"], data["building_type"], data["tilt"]
+
+    cities = np.asarray(city, dtype=object).ravel()
+    types = np.asarray(building_type, dtype=object).ravel()
+    tilts = np.asarray(tilt, dtype=float).ravel()
+    n = len(cities)
+    if len(types) != n or len(tilts) != n:
+        raise ValueError("❌ city, building_type and tilt must have the same length")
+
+    with slot.acquire() if version is None else nullcontext(version) as version:
+        check_tier(tier, available_tiers(version))
+        return _predict_batch(version, cities, types, tilts, return_errors, use_grid, tier)
+
+
+def _predict_batch(version: LoadedVersion, cities: np.ndarray, types: np.ndarray, tilts: np.ndarray,
+                   return_errors: bool = False, use_grid: bool = True, tier: str = DEFAULT_TIER):
+    features = version.features
+    n = len(cities)
+
+    with metrics.stage("predict_energy_batch", "energy404_predict_seconds"):
+        # --- Validate inputs (per row) ---
+        with metrics.stage("validate"):
+            city_pos, type_codes = features.encode(cities, types)
+            valid = (city_pos >= 0) & (type_codes >= 0)
+
+            errors = [None] * n
+            for i in np.flatnonzero(~valid):
+                if city_pos[i] < 0:
+                    errors[i] = f"❌ City '{cities[i]}' not found in city_weather.csv"
+                else:
+                    errors[i] = f"❌ BuildingType '{types[i]}' not recognized"
+
+        preds = _score_encoded(version, city_pos, type_codes, tilts, valid, use_grid, tier)
+
+    if return_errors:
+        return preds, errors
+    return preds
+
+
+def predict_energy_encoded(cities, city_codes: np.ndarray, building_types, type_codes: np.ndarray,
+                           tilts: np.ndarray, valid: np.ndarray = None, use_grid: bool = True,
+                           tier: str = DEFAULT_TIER):
+    """
+    predict_energy_batch for dictionary-encoded input (the Arrow / Parquet
+    path): `cities` / `building_types` hold the distinct values and the
+    integer code arrays index into them (-1 = null). Only the distinct values
+    are looked up, so no per-row Python objects are created.
+    Rows with valid=False are skipped.
+
+    Returns (preds, city_known, type_known): NaN where the row was not
+    scored, and per-distinct-value masks of recognized cities / types.
+    """
+    check_tier(tier)
+    tilts = np.asarray(tilts, dtype=np.float64)
+    with slot.acquire() as version:
+        check_tier(tier, available_tiers(version))
+        features = version.features
+        with metrics.stage("predict_energy_batch", "energy404_predict_seconds"):
+            with metrics.stage("validate"):
+                # One extra -1 entry so that code -1 (null) maps to "unknown"
+                city_lut = np.array([features.city_index.get(c, -1) for c in cities] + [-1], dtype=np.int64)
+                type_lut = np.array([features.type_index.get(t, -1) for t in building_types] + [-1],
+                                    dtype=np.int64)
+                city_pos = city_lut[city_codes]
+                type_pos = type_lut[type_codes]
+                ok = (city_pos >= 0) & (type_pos >= 0)
+                if valid is not None:
+                    ok &= valid
+            preds = _score_encoded(version, city_pos, type_pos, tilts, ok, use_grid, tier)
+    return preds, city_lut[:-1] >= 0, type_lut[:-1] >= 0
+
+
+def _score_encoded(version: LoadedVersion, city_pos: np.ndarray, type_codes: np.ndarray, tilts: np.ndarray,
+                   valid: np.ndarray, use_grid: bool, tier: str) -> np.ndarray:
+    """Grid lookup / ensemble for rows already mapped to city positions and type codes."""
+    grid, features = version.grid, version.features
+    building_categories = version.config["BuildingType_categories"]
+
+    preds = np.full(len(tilts), np.nan)
+    todo = valid.copy()
+
+    if use_grid and tier == "full" and grid is not None and todo.any():
+        with metrics.stage("grid"):
+            # Map weather/config positions to grid positions (-1 if the grid lacks them)
+            g_city = np.array([grid.city_index.get(c, -1) for c in features.cities])[city_pos]
+            g_type = np.array([grid.type_index.get(t, -1) for t in building_categories])[type_codes]
+            hit = todo & (g_city >= 0) & (g_type >= 0) & (tilts >= grid.tilt_min) & (tilts <= grid.tilt_max)
+            if hit.any():
+                preds[hit] = np.round(grid.lookup_batch(g_city[hit], g_type[hit], tilts[hit]), 3)
+                todo &= ~hit
+        metrics.add("energy404_predicted_rows_total", int(hit.sum()), source="grid")
+
+    if todo.any():
+        with metrics.stage("features"):
+            X = features.build(city_pos[todo], type_codes[todo], tilts[todo])
+        preds[todo] = np.round(_ensemble_predict(version, X, tier=tier), 3)
+        metrics.add("energy404_predicted_rows_total", int(todo.sum()), source="ensemble")
+
+    return preds
 
 
 # === Optional: quick test when run standalone ===
@@ -110,3 +418,25 @@ if __name__ == "__main__":
 
     pred = predict_energy(test_city, test_type, test_tilt)
     print(f"\n☀️ Predicted Solar Potential for {test_city} ({test_type}, tilt={test_tilt}°): {pred} kWh/m²/year\n")
+
+    # --- Single-row vs batch throughput ---
+    n_batch = 10_000
+    rng = np.random.default_rng(404)
+    batch = pd.DataFrame({
+        "city": rng.choice(features.cities, n_batch),
+        "building_type": rng.choice(building_categories, n_batch),
+        "tilt": rng.uniform(0, 60, n_batch),
+    })
+
+    t0 = time.perf_counter()
+    for r in batch.head(200).itertuples(index=False):
+        predict_energy(r.city, r.building_type, r.tilt)
+    per_row_single = (time.perf_counter() - t0) / 200
+
+    t0 = time.perf_counter()
+    predict_energy_batch(batch)
+    per_row_batch = (time.perf_counter() - t0) / n_batch
+
+    print(f"⏱️ predict_energy:       {per_row_single * 1e3:.3f} ms/row")
+    print(f"⏱️ predict_energy_batch: {per_row_batch * 1e3:.4f} ms/row (batch={n_batch:,})")
+    print(f"🚀 Speedup: {per_row_single / per_row_batch:.0f}x")
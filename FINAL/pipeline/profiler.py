@@ -0,0 +1,102 @@
+"""
+profiler.py — On-demand sampling profiler for the serving process
+-----------------------------------------------------------------
+Samples the Python stack of every thread (sys._current_frames) at a fixed
+interval for N seconds, from a background thread, while the process keeps
+serving. The result is written in collapsed-stack format, one line per
+unique stack:
+
+    api.py:get_prediction;predict.py:predict_energy;predict.py:_ensemble_predict 42
+
+which flamegraph.pl, speedscope and inferno read directly. Time spent inside
+C extensions (LightGBM / XGBoost / sklearn predict) shows up under the
+Python frame that called them.
+
+Triggered from api.py (POST /admin/profile or SIGUSR2), or standalone:
+------
+>>> from profiler import SamplingProfiler
+>>> SamplingProfiler(interval=0.005).run(10, out_dir=Path("/tmp"))
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+PROFILE_DIR = Path(os.environ.get("ENERGY404_PROFILE_DIR", "/tmp/energy404_profiles"))
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{Path(code.co_filename).name}:{code.co_name}"
+
+
+class SamplingProfiler:
+    # One profile at a time per process
+    _running = threading.Lock()
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = float(interval)
+        self.stacks = Counter()
+        self.samples = 0
+
+    def _sample(self, skip_thread: int) -> None:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == skip_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(f"thread:{names.get(ident, ident)}")
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self, seconds: float, out_dir: Path = None) -> dict:
+        """Sample for `seconds` (blocking the calling thread only) and write the collapsed stacks."""
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            me = threading.get_ident()
+            started = time.time()
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                self._sample(me)
+                time.sleep(self.interval)
+        finally:
+            self._running.release()
+
+        out_dir = out_dir or PROFILE_DIR
+        out_dir.mkdir(parents=True, exist_ok=True)
+        path = out_dir / f"profile_{time.strftime('%Y%m%d_%H%M%S', time.localtime(started))}_{os.getpid()}.collapsed"
+        path.write_text(self.collapsed(), encoding="utf-8")
+        return {"path": str(path), "seconds": seconds, "samples": self.samples,
+                "interval_ms": self.interval * 1e3, "top": self.top()}
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def top(self, n: int = 15) -> list:
+        """Self-time leaders: innermost frame of each sampled stack (includes idle threads)."""
+        leaf = Counter()
+        for stack, count in self.stacks.items():
+            leaf[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaf.values()) or 1
+        return [{"frame": f, "samples": c, "share": round(c / total, 4)} for f, c in leaf.most_common(n)]
+
+
+def start_in_background(seconds: float, interval: float = 0.005) -> threading.Thread:
+    """Fire-and-forget profile (used by the SIGUSR2 handler)."""
+    def target():
+        try:
+            result = SamplingProfiler(interval).run(seconds)
+            print(f"✅ Profile written to {result['path']} ({result['samples']} samples)")
+        except RuntimeError as e:
+            print(f"⚠️ {e}")
+
+    thread = threading.Thread(target=target, name="sampling-profiler", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,251 @@
+"""
+registry.py — Versioned model registry + hot-swap bookkeeping
+-------------------------------------------------------------
+Layout (under MODELS_DIR/registry/):
+
+    registry/
+    ├── ACTIVE                    name of the version to serve on startup
+    ├── 2025-11-20_a/
+    │   ├── manifest.json         version, created, notes, sha256 + size per file
+    │   ├── lgb_models.pkl  xgb_models.pkl  rf_models.pkl  et_models.pkl
+    │   ├── meta_model.pkl  feature_config.pkl
+    │   └── (optional) meta_tiers.pkl, prediction_grid.npz,
+    │                  compiled_ensemble/, forests_compact/
+    └── 2025-12-02_b/ ...
+
+predict.py loads a version into a LoadedVersion and serves it through a
+VersionSlot: every prediction pins the active version for its duration, a
+swap replaces the reference atomically, and the previous version's models
+are released only after its last in-flight call finishes.
+
+Publish the current flat MODELS_DIR as a new version:
+-----------------------------------------------------
+$ python pipeline/registry.py publish --version 2025-11-20_a --notes "retrained on Nov data"
+$ python pipeline/registry.py list
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from compiled import COMPILED_DIRNAME
+from compress import COMPACT_DIRNAME
+from grid import GRID_FILENAME, MODEL_FILES
+from tiers import TIERS_FILENAME
+
+REGISTRY_DIRNAME = "registry"
+MANIFEST_FILENAME = "manifest.json"
+ACTIVE_FILENAME = "ACTIVE"
+OPTIONAL_FILES = [TIERS_FILENAME, GRID_FILENAME, COMPILED_DIRNAME, COMPACT_DIRNAME]
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _files(path: Path):
+    """Every regular file under path (or path itself), relative names in a fixed order."""
+    if path.is_dir():
+        return sorted(p for p in path.rglob("*") if p.is_file())
+    return [path]
+
+
+class ModelRegistry:
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def versions(self) -> list:
+        if not self.root.is_dir():
+            return []
+        return sorted(p.name for p in self.root.iterdir() if (p / MANIFEST_FILENAME).is_file())
+
+    def path(self, version: str) -> Path:
+        if not version or "/" in version or "\\" in version or version.startswith("."):
+            raise ValueError(f"❌ Invalid model version name '{version}'")
+        path = self.root / version
+        if not (path / MANIFEST_FILENAME).is_file():
+            raise ValueError(f"❌ Model version '{version}' not found in {self.root}")
+        return path
+
+    def manifest(self, version: str) -> dict:
+        with open(self.path(version) / MANIFEST_FILENAME, encoding="utf-8") as f:
+            return json.load(f)
+
+    def verify(self, version: str) -> dict:
+        """Check every file listed in the manifest against its size and sha256."""
+        path = self.path(version)
+        manifest = self.manifest(version)
+        for rel, info in manifest["files"].items():
+            f = path / rel
+            if not f.is_file() or f.stat().st_size != info["bytes"] or _sha256(f) != info["sha256"]:
+                raise ValueError(f"❌ Model version '{version}': {rel} is missing or does not match the manifest")
+        return manifest
+
+    # --- Active pointer (survives restarts) ---
+    def active(self):
+        try:
+            return (self.root / ACTIVE_FILENAME).read_text(encoding="utf-8").strip() or None
+        except FileNotFoundError:
+            return None
+
+    def set_active(self, version: str) -> None:
+        self.path(version)
+        tmp = self.root / f".{ACTIVE_FILENAME}.tmp"
+        tmp.write_text(version + "\n", encoding="utf-8")
+        os.replace(tmp, self.root / ACTIVE_FILENAME)
+
+    # --- Publishing ---
+    def publish(self, src_dir: Path, version: str, notes: str = "") -> Path:
+        """Copy the model files of a flat models directory into a new version + manifest."""
+        src_dir = Path(src_dir)
+        dest = self.root / version
+        if dest.exists():
+            raise ValueError(f"❌ Model version '{version}' already exists")
+        missing = [f for f in MODEL_FILES if not (src_dir / f).is_file()]
+        if missing:
+            raise ValueError(f"❌ {src_dir} is missing {', '.join(missing)}")
+
+        # Copy into a temp dir and rename, so a half-written version is never listed
+        tmp = self.root / f".{version}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        for name in MODEL_FILES + [f for f in OPTIONAL_FILES if (src_dir / f).exists()]:
+            src = src_dir / name
+            if src.is_dir():
+                shutil.copytree(src, tmp / name)
+            else:
+                shutil.copy2(src, tmp / name)
+
+        manifest = {
+            "version": version,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "source": str(src_dir),
+            "notes": notes,
+            "files": {
+                f.relative_to(tmp).as_posix(): {"bytes": f.stat().st_size, "sha256": _sha256(f)}
+                for f in _files(tmp)
+            },
+        }
+        with open(tmp / MANIFEST_FILENAME, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, dest)
+        return dest
+
+
+# === Serving side ===
+class LoadedVersion:
+    """One fully loaded model version plus its in-flight call counter."""
+
+    def __init__(self, name: str, path: Path, manifest, store, features, grid, config):
+        self.name = name
+        self.path = Path(path)
+        self.manifest = manifest
+        self.store = store
+        self.features = features
+        self.grid = grid
+        self.config = config
+        self.timings = {}
+        self.generation = 0       # bumped by VersionSlot.swap
+        self.inflight = 0
+        self.retired = False
+        self.released = threading.Event()
+
+    def release(self) -> None:
+        self.store.release()
+        self.grid = None
+        self.released.set()
+
+    def info(self) -> dict:
+        return {
+            "version": self.name,
+            "path": str(self.path),
+            "created": (self.manifest or {}).get("created"),
+            "notes": (self.manifest or {}).get("notes"),
+            "generation": self.generation,
+            "inflight": self.inflight,
+            "grid": self.grid is not None,
+            "timings": self.timings,
+        }
+
+
+class VersionSlot:
+    """Holds the active LoadedVersion; acquire() pins it for the duration of a call."""
+
+    def __init__(self, initial: LoadedVersion):
+        self.current = initial
+        self._lock = threading.Lock()
+        self.draining = []
+
+    @contextmanager
+    def acquire(self):
+        with self._lock:
+            version = self.current
+            version.inflight += 1
+        try:
+            yield version
+        finally:
+            with self._lock:
+                version.inflight -= 1
+                drained = version.retired and version.inflight == 0
+            if drained:
+                self._retire(version)
+
+    def swap(self, new: LoadedVersion) -> LoadedVersion:
+        """Make `new` active; the old version is released once its in-flight calls finish."""
+        with self._lock:
+            old, self.current = self.current, new
+            new.generation = old.generation + 1
+            old.retired = True
+            drained = old.inflight == 0
+            if not drained:
+                self.draining.append(old)
+        if drained:
+            old.release()
+        return old
+
+    def _retire(self, version: LoadedVersion) -> None:
+        with self._lock:
+            if version in self.draining:
+                self.draining.remove(version)
+        version.release()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Manage the versioned model registry.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("publish", help="Copy the flat models directory into a new version")
+    p.add_argument("--version", required=True)
+    p.add_argument("--notes", default="")
+    p.add_argument("--src", type=Path, default=None, help="Source directory (default: MODELS_DIR)")
+    p.add_argument("--activate", action="store_true", help="Also make it the startup version")
+    sub.add_parser("list", help="List versions")
+    p = sub.add_parser("verify", help="Check a version's files against its manifest")
+    p.add_argument("version")
+    args = ap.parse_args()
+
+    models_dir = Path(__file__).resolve().parent.parent / "models_local_backup"
+    registry = ModelRegistry(models_dir / REGISTRY_DIRNAME)
+
+    if args.cmd == "publish":
+        dest = registry.publish(args.src or models_dir, args.version, args.notes)
+        if args.activate:
+            registry.set_active(args.version)
+        print(f"✅ Published {args.version} to {dest}{' (active)' if args.activate else ''}")
+    elif args.cmd == "list":
+        active = registry.active()
+        for v in registry.versions():
+            m = registry.manifest(v)
+            print(f"{'*' if v == active else ' '} {v:<24} {m['created']}  {len(m['files'])} files  {m.get('notes', '')}")
+    elif args.cmd == "verify":
+        registry.verify(args.version)
+        print(f"✅ {args.version} matches its manifest")
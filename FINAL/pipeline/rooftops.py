@@ -0,0 +1,332 @@
+"""
+rooftops.py — Hive-partitioned rooftop dataset with predicate pushdown
+----------------------------------------------------------------------
+The canonical rooftop data is stored as a Parquet dataset partitioned by
+City and building type, one directory level per key:
+
+    <root>/City=Accra/Assumed_building_type=2/part-accra_rooftop_solarpotential.parquet
+           City=Accra/Assumed_building_type=7/...
+           City=Almaty/...
+
+Rows inside each file are sorted by tilt and written in row groups with
+min/max statistics, so a tilt range only touches the row groups it overlaps.
+
+load() hands column projection and City / type filters to pyarrow:
+directories that cannot match are never opened and only the requested
+columns are decoded, so one city or one building type costs a fraction of
+reading the monolithic all_cities_clean.parquet / dataset.parquet.
+
+The same layout is used for the training dataset (City / BuildingType):
+
+    $ python pipeline/rooftops.py partition dataset/dataset.parquet --out dataset/rooftops \\
+          --by City BuildingType --sort tilt
+
+Usage:
+------
+>>> import rooftops
+>>> df = rooftops.load(cities=["Accra"], types=["schools"], columns=["Estimated_tilt", "Surface_area"])
+>>> rooftops.partitions()["City"][:3]
+['Accra', 'Almaty', 'Antigua']
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+from urllib.parse import unquote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from codes import TYPE_NAME_CODES
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+DEFAULT_ROOT = BASE_DIR.parent / "OG_approach_failed" / "cleaned_datasets" / "rooftops"
+
+PARTITION_COLUMNS = ["City", "Assumed_building_type"]
+SORT_COLUMN = "Estimated_tilt"
+ROW_GROUP_ROWS = 64_000
+COMMON_METADATA = "_common_metadata"
+
+
+# === Writing ===
+def write_partitioned(table: pa.Table, root: Path, by=PARTITION_COLUMNS, sort_by: str = SORT_COLUMN,
+                      basename: str = "part", row_group_rows: int = ROW_GROUP_ROWS, compression: str = "zstd") -> dict:
+    """
+    Write `table` under root/<key>=<value>/.../<basename>.parquet, one file per
+    partition, rows sorted by sort_by. Existing files with the same basename are
+    replaced, so several sources (e.g. one per city file) can share a root.
+    Returns {partition dir: rows}.
+    """
+    root = Path(root)
+    keys = [table.column(c) for c in by]
+    order = pc.sort_indices(table, sort_keys=[(c, "ascending") for c in by]
+                            + ([(sort_by, "ascending")] if sort_by in table.column_names else []))
+    table = table.take(order)
+    values = [k.take(order) for k in keys]
+
+    # Boundaries of runs of equal partition keys in the sorted table
+    change = np.zeros(len(table), dtype=bool)
+    if len(table):
+        change[0] = True
+    for v in values:
+        v = v.to_numpy(zero_copy_only=False)
+        change[1:] |= v[1:] != v[:-1]
+    starts = np.flatnonzero(change).tolist() + [len(table)]
+
+    data = table.drop_columns(list(by))
+    write_schema(root, table.schema)
+    written = {}
+    for lo, hi in zip(starts[:-1], starts[1:]):
+        parts = [f"{c}={_partition_value(v[lo].as_py())}" for c, v in zip(by, values)]
+        part_dir = root.joinpath(*parts)
+        part_dir.mkdir(parents=True, exist_ok=True)
+        path = part_dir / f"{basename}.parquet"
+        tmp = path.with_name(path.name + ".tmp")
+        pq.write_table(data.slice(lo, hi - lo), tmp, row_group_size=row_group_rows,
+                       compression=compression, write_statistics=True)
+        tmp.replace(path)
+        written[str(part_dir.relative_to(root))] = hi - lo
+    return written
+
+
+def write_schema(root: Path, schema: pa.Schema) -> None:
+    """Full schema (column order and types, partition columns included) as root/_common_metadata."""
+    root.mkdir(parents=True, exist_ok=True)
+    tmp = root / f"_common_metadata.{os.getpid()}.tmp"
+    pq.write_metadata(schema.remove_metadata(), tmp)
+    tmp.replace(root / COMMON_METADATA)
+
+
+def read_schema(root) -> pa.Schema:
+    """Schema written by write_partitioned, or None (single file / older layout)."""
+    path = Path(root) / COMMON_METADATA
+    return pq.read_schema(path) if path.is_file() else None
+
+
+def _partition_value(value) -> str:
+    return str(value).replace("/", "-").replace("\\", "-")
+
+
+# === Reading ===
+def dataset(root=DEFAULT_ROOT) -> ds.Dataset:
+    """pyarrow Dataset over a partitioned root (or a single Parquet file)."""
+    if isinstance(root, ds.Dataset):
+        return root
+    root = Path(root)
+    if not root.exists():
+        raise FileNotFoundError(f"❌ Rooftop dataset not found: {root}")
+    if root.is_file():
+        return ds.dataset(root, format="parquet")
+    return ds.dataset(root, format="parquet", partitioning="hive",
+                      exclude_invalid_files=True, ignore_prefixes=[".", "_"])
+
+
+def partition_keys(data: ds.Dataset) -> list:
+    """Names of the partition columns (empty for a plain file)."""
+    partitioning = getattr(data, "partitioning", None)
+    return list(partitioning.schema.names) if partitioning is not None else []
+
+
+def partitions(root=DEFAULT_ROOT) -> dict:
+    """Distinct values per partition column, from the directory names alone (no data read)."""
+    data = dataset(root)
+    keys = partition_keys(data)
+    found = {k: set() for k in keys}
+    for frag in data.get_fragments():
+        for part in Path(frag.path).parent.parts:
+            key, sep, value = part.partition("=")
+            if sep and key in found:
+                found[key].add(unquote(value))
+    schema = data.schema
+    out = {}
+    for k, values in found.items():
+        if pa.types.is_integer(schema.field(k).type):
+            out[k] = sorted(int(v) for v in values)
+        else:
+            out[k] = sorted(values)
+    return out
+
+
+def _type_values(values, field_type) -> list:
+    """Building types as names or codes, converted to what the partition column holds."""
+    if not pa.types.is_integer(field_type):
+        return [str(v) for v in values]
+    codes = []
+    for v in values:
+        if isinstance(v, (int, np.integer)) or str(v).strip().isdigit():
+            codes.append(int(v))
+        elif str(v).strip().lower() in TYPE_NAME_CODES:
+            codes.append(TYPE_NAME_CODES[str(v).strip().lower()])
+        else:
+            raise ValueError(f"❌ BuildingType '{v}' not recognized")
+    return codes
+
+
+def where(root=DEFAULT_ROOT, cities=None, types=None):
+    """Filter expression for the City / building-type partition columns (None = everything)."""
+    data = dataset(root)
+    names = data.schema.names
+    city_col = "City"
+    type_col = next((c for c in ("Assumed_building_type", "BuildingType") if c in names), None)
+    expr = None
+    if cities is not None:
+        expr = ds.field(city_col).isin([str(c) for c in cities])
+    if types is not None:
+        if type_col is None:
+            raise ValueError("❌ Dataset has no building-type column")
+        cond = ds.field(type_col).isin(_type_values(types, data.schema.field(type_col).type))
+        expr = cond if expr is None else expr & cond
+    return expr
+
+
+def load(root=DEFAULT_ROOT, columns=None, cities=None, types=None, filter=None, as_arrow: bool = False):
+    """
+    Read the rooftop dataset with projection and filters pushed down to pyarrow.
+
+    columns  list of columns to return (default: all, in the written order)
+    cities   City values to keep
+    types    building types to keep, as names ("schools") or codes (7)
+    filter   extra pyarrow expression, e.g. ds.field("Estimated_tilt") < 30,
+             or ~where(cities=[...]) to exclude cities
+    Returns a pandas DataFrame, or the pyarrow Table with as_arrow=True.
+    """
+    data = dataset(root)
+    expr = where(data, cities, types)
+    if filter is not None:
+        expr = filter if expr is None else expr & filter
+    schema = read_schema(root) if not isinstance(root, ds.Dataset) else None
+    if columns is None:
+        keys = partition_keys(data)
+        columns = schema.names if schema is not None else keys + [c for c in data.schema.names if c not in keys]
+    table = data.to_table(columns=list(columns), filter=expr)
+    if schema is not None:
+        # Partition values come back as inferred types (int32 / string); restore the written ones
+        table = table.cast(pa.schema([schema.field(c) if c in schema.names else table.schema.field(c)
+                                      for c in table.column_names]))
+    # String partition keys repeat one value per fragment: dictionary-encode them (pandas category)
+    for key in partition_keys(data):
+        key_type = table.schema.field(key).type if key in table.column_names else None
+        if key_type is not None and (pa.types.is_string(key_type) or pa.types.is_large_string(key_type)):
+            i = table.column_names.index(key)
+            table = table.set_column(i, key, pc.dictionary_encode(table.column(i)))
+    if as_arrow:
+        return table
+    df = table.to_pandas()
+    for key in partition_keys(data):
+        if key in df.columns and isinstance(df[key].dtype, pd.CategoricalDtype):
+            # Sorted categories, as astype("category") on the monolith would give (stable .cat.codes)
+            df[key] = df[key].cat.reorder_categories(sorted(df[key].cat.categories))
+    return df
+
+
+def read(path, columns=None, cities=None, types=None):
+    """load() for a partitioned directory or a monolithic Parquet file, pandas for CSV."""
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        df = pd.read_csv(path, usecols=columns)
+        if cities is not None:
+            df = df[df["City"].astype(str).isin([str(c) for c in cities])]
+        if types is not None:
+            raise ValueError("❌ types= is only supported for Parquet inputs")
+        return df.reset_index(drop=True)
+    return load(path, columns=columns, cities=cities, types=types)
+
+
+# === Benchmark ===
+def _bench_case(source: str, partitioned: bool, columns, cities, types) -> dict:
+    import resource
+
+    rss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    if partitioned:
+        df = load(source, columns=columns, cities=cities, types=types)
+    else:
+        # What the scripts did before: read everything, then mask in pandas
+        df = pd.read_parquet(source)
+        if cities is not None:
+            df = df[df["City"].astype(str).isin(cities)]
+        if types is not None:
+            type_col = "Assumed_building_type" if "Assumed_building_type" in df.columns else "BuildingType"
+            numeric = df[type_col].dtype.kind in "iu"
+            df = df[df[type_col].isin(_type_values(types, pa.int8() if numeric else pa.string()))]
+        if columns is not None:
+            df = df[columns]
+    seconds = time.perf_counter() - t0
+    rss1 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {"rows": len(df), "seconds": round(seconds, 3), "peak_rss_mb": round((rss1 - rss0) / 1024, 1)}
+
+
+def benchmark(monolith: Path, root: Path, cases=None, repeat: int = 3) -> list:
+    """Read time and peak-RSS growth of typical reads, monolith vs partitioned (fresh process per run)."""
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+
+    parts = partitions(root)
+    city = parts["City"][0] if parts.get("City") else None
+    type_key = next((k for k in parts if k != "City"), None)
+    some_type = parts[type_key][0] if type_key else None
+    cases = cases or [
+        ("all rows, all columns", None, None, None),
+        ("one city", None, [city], None),
+        ("one city, one type", None, [city], [some_type]),
+        ("one type", None, None, [some_type]),
+    ]
+    results = []
+    ctx = mp.get_context("spawn")
+    for label, columns, cities, types in cases:
+        for name, source, partitioned in (("monolith", monolith, False), ("partitioned", root, True)):
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+                    runs.append(pool.submit(_bench_case, str(source), partitioned, columns, cities, types).result())
+            best = min(runs, key=lambda r: r["seconds"])
+            results.append({"case": label, "source": name, **best})
+            print(f"- {label:<24} {name:<12} {best['rows']:>10,} rows  {best['seconds']:>7.3f}s  "
+                  f"peak +{best['peak_rss_mb']:.0f} MB")
+    return results
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Write, inspect and benchmark the partitioned rooftop dataset.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("partition", help="Partition a monolithic Parquet / CSV file")
+    p.add_argument("src", type=Path)
+    p.add_argument("--out", type=Path, default=DEFAULT_ROOT)
+    p.add_argument("--by", nargs="+", default=PARTITION_COLUMNS, help="Partition columns (outermost first)")
+    p.add_argument("--sort", default=SORT_COLUMN, help="Sort column inside each partition")
+    p.add_argument("--row-group-rows", type=int, default=ROW_GROUP_ROWS)
+    p = sub.add_parser("info", help="List partition values")
+    p.add_argument("--root", type=Path, default=DEFAULT_ROOT)
+    p = sub.add_parser("bench", help="Read time / memory vs the monolithic file")
+    p.add_argument("monolith", type=Path)
+    p.add_argument("--root", type=Path, default=DEFAULT_ROOT)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--out", type=Path, default=None, help="Write results as JSON")
+    args = ap.parse_args()
+
+    if args.cmd == "partition":
+        t0 = time.time()
+        if args.src.suffix.lower() == ".csv":
+            import pyarrow.csv as pacsv
+            table = pacsv.read_csv(args.src)
+        else:
+            table = pq.read_table(args.src)
+        written = write_partitioned(table, args.out, args.by, args.sort, row_group_rows=args.row_group_rows)
+        print(f"✅ {table.num_rows:,} rows → {len(written)} partitions under {args.out} ({time.time() - t0:.1f}s)")
+    elif args.cmd == "info":
+        for key, values in partitions(args.root).items():
+            print(f"🔹 {key} ({len(values)}): {', '.join(map(str, values))}")
+    else:
+        import json
+        results = benchmark(args.monolith, args.root, repeat=args.repeat)
+        if args.out:
+            args.out.parent.mkdir(parents=True, exist_ok=True)
+            with open(args.out, "w", encoding="utf-8") as f:
+                json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "monolith": str(args.monolith),
+                           "root": str(args.root), "results": results}, f, indent=2)
+            print(f"✅ Results saved to {args.out}")
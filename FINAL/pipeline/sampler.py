@@ -0,0 +1,459 @@
+"""
+sampler.py — One-pass streaming quota sampler for the balanced training sets
+----------------------------------------------------------------------------
+Replaces the combine.ipynb / balanced_by_type_experiment.ipynb steps that
+loaded the whole combined dataset to draw top20_balanced_sample.parquet and
+top20_balanced_by_type.parquet.
+
+The data is read once, in --chunk-rows batches, with only the needed rows
+kept: every (City, building type) stratum has a reservoir sized by its quota
+(top20_sampling_quotas*.csv, or a flat --per-group cap). A row's random key
+is a hash of (seed, row number in the dataset), and a reservoir keeps the
+`quota` rows with the smallest keys. That makes reservoirs mergeable (union,
+then keep the smallest keys again) and the sample independent of chunk size,
+worker count and merge order: the same seed always selects the same rows.
+
+Work is split by city for a City-partitioned dataset (rooftops.py layout,
+each worker reads its city's files) and by row-group ranges for a single
+Parquet file; each worker returns its reservoirs and the parent merges them.
+Memory is bounded by the quota total plus one chunk per worker. Row numbers
+(and --ids' row_idx) count rows in that scan order, so for a partitioned
+root they are positions in rooftops file order, not in the parquet the
+partitions were written from.
+
+The quota files themselves can be rebuilt from one streaming count pass with
+the same allocation rule as the notebook (proportional to availability,
+floor / ceiling per type, adaptive ceiling with --adaptive).
+
+Usage (from FINAL/):
+--------------------
+$ python pipeline/sampler.py quotas ../New_approach_road_to_success/dataset/cleaned_datasets/all_cities_weather_ready_train.parquet \\
+      --kept-types ../New_approach_road_to_success/scripts/artifacts/kept_fine_types_97pct.csv --adaptive \\
+      --out ../New_approach_road_to_success/scripts/artifacts/top20_sampling_quotas_adaptive.csv
+$ python pipeline/sampler.py sample <same parquet> --kept-types <same csv> \\
+      --quotas ../New_approach_road_to_success/scripts/artifacts/top20_sampling_quotas_adaptive.csv \\
+      --out top20_balanced_sample.parquet --ids top20_sampled_rowidx.csv --jobs 4
+$ python pipeline/sampler.py sample top20_balanced_sample.parquet --by BuildingType --per-group 40000 \\
+      --out top20_balanced_by_type.parquet
+"""
+
+import argparse
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import unquote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import rooftops
+
+SEED = 42
+STRATA = ["City", "BuildingType_5"]
+TYPE_COLUMN = "BuildingType"
+OTHER = "Other"
+CHUNK_ROWS = 250_000
+FLOOR = 100
+TOP_CITIES = 20
+ROW_COLUMN = "row_idx"
+
+_MAX_KEY = np.iinfo(np.uint64).max
+
+
+# === Row keys ===
+def row_keys(seed: int, rows: np.ndarray) -> np.ndarray:
+    """splitmix64(seed, row number): uniform uint64 keys that depend only on the row, not on who reads it."""
+    with np.errstate(over="ignore"):
+        z = rows.astype(np.uint64) + np.uint64(seed) * np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+# === Strata ===
+def kept_types(path) -> list:
+    """The fine building types kept as-is (kept_fine_types_97pct.csv); everything else becomes 'Other'."""
+    return pd.read_csv(path)[TYPE_COLUMN].astype(str).tolist()
+
+
+def derive_type5(table, kept, column: str = STRATA[1]):
+    """Add BuildingType_5 (BuildingType if kept, else 'Other') to a Table / RecordBatch, as combine.ipynb does."""
+    types = pc.cast(table.column(TYPE_COLUMN), pa.string())
+    type5 = pc.if_else(pc.is_in(types, value_set=pa.array(kept, pa.string())), types, OTHER)
+    if isinstance(table, pa.RecordBatch):
+        table = pa.Table.from_batches([table])
+    return table.append_column(column, type5)
+
+
+class Strata:
+    """Dense stratum ids over the `by` columns, with a quota per stratum."""
+
+    def __init__(self, by, values, quotas: np.ndarray):
+        self.by = list(by)
+        self.values = [list(v) for v in values]
+        self.quota = np.asarray(quotas, dtype=np.int64)
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame, by) -> "Strata":
+        """Strata from a quota table: one row per stratum with the `by` columns and 'quota'."""
+        keys = frame[list(by)].astype(str)
+        values = [sorted(keys[c].unique()) for c in by]
+        quota = np.zeros([len(v) for v in values], dtype=np.int64)
+        idx = tuple(pd.Categorical(keys[c], categories=v).codes for c, v in zip(by, values))
+        np.add.at(quota, idx, frame["quota"].to_numpy(dtype=np.int64))
+        return cls(by, values, quota.ravel())
+
+    @classmethod
+    def uniform(cls, by, values, per_group: int) -> "Strata":
+        values = [sorted(str(x) for x in v) for v in values]
+        return cls(by, values, np.full(int(np.prod([len(v) for v in values])), per_group, dtype=np.int64))
+
+    def ids(self, table) -> np.ndarray:
+        """Stratum id per row (-1 for rows outside every stratum)."""
+        sid = np.zeros(table.num_rows, dtype=np.int64)
+        for col, values in zip(self.by, self.values):
+            idx = pc.index_in(pc.cast(table.column(col), pa.string()), value_set=pa.array(values, pa.string()))
+            idx = pc.fill_null(idx, -1).to_numpy(zero_copy_only=False).astype(np.int64)
+            sid = np.where((sid < 0) | (idx < 0), -1, sid * len(values) + idx)
+        return sid
+
+    def label(self, sid: int) -> tuple:
+        out = []
+        for values in reversed(self.values):
+            sid, i = divmod(int(sid), len(values))
+            out.append(values[i])
+        return tuple(reversed(out))
+
+
+# === Reservoirs ===
+class Reservoir:
+    """
+    Per-stratum bottom-k sample: for each stratum, the `quota` rows with the
+    smallest keys seen so far. Candidates are buffered and compacted once the
+    buffer outgrows the reservoir, so memory stays within ~2x the quota total
+    plus one chunk.
+    """
+
+    def __init__(self, strata: Strata):
+        self.strata = strata
+        self.seen = np.zeros(len(strata.quota), dtype=np.int64)
+        self.threshold = np.full(len(strata.quota), _MAX_KEY, dtype=np.uint64)
+        self._tables, self._sid, self._key, self._row = [], [], [], []
+        self._kept = 0
+        self._buffered = 0
+
+    def offer(self, table: pa.Table, rows: np.ndarray, seed: int) -> None:
+        """Consider a chunk whose rows have the given dataset row numbers."""
+        sid = self.strata.ids(table)
+        valid = sid >= 0
+        self.seen += np.bincount(sid[valid], minlength=len(self.seen))
+        keys = row_keys(seed, rows)
+        # A row can only enter a full stratum by beating its current largest kept key
+        cand = valid & (self.strata.quota[np.where(valid, sid, 0)] > 0)
+        cand[cand] = keys[cand] <= self.threshold[sid[cand]]
+        if not cand.any():
+            return
+        self._add(table.filter(pa.array(cand)), sid[cand], keys[cand], rows[cand])
+        if self._buffered > max(self._kept, CHUNK_ROWS):
+            self.compact()
+
+    def _add(self, table, sid, key, row) -> None:
+        self._tables.append(table)
+        self._sid.append(sid)
+        self._key.append(key)
+        self._row.append(row)
+        self._buffered += len(sid)
+
+    def compact(self) -> None:
+        if not self._tables:
+            return
+        sid, key, row = np.concatenate(self._sid), np.concatenate(self._key), np.concatenate(self._row)
+        # Order by (stratum, key); two stable radix-friendly sorts beat a 3-key lexsort
+        order = np.argsort(key, kind="stable")
+        order = order[np.argsort(sid[order], kind="stable")]
+        sorted_sid = sid[order]
+        counts = np.bincount(sorted_sid, minlength=len(self.threshold))
+        first = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        rank = np.arange(len(order)) - first[sorted_sid]
+        taken = rank < self.strata.quota[sorted_sid]
+
+        # Largest kept key of each full stratum: later rows need a smaller key to get in
+        kept_counts = np.minimum(counts, self.strata.quota)
+        full = (kept_counts == self.strata.quota) & (kept_counts > 0)
+        last = first + kept_counts - 1
+        self.threshold = np.full(len(self.threshold), _MAX_KEY, dtype=np.uint64)
+        self.threshold[full] = key[order[last[full]]]
+
+        keep = np.sort(order[taken])
+        table = pa.concat_tables(self._tables).take(pa.array(keep))
+        sid, key, row = sid[keep], key[keep], row[keep]
+        self._tables, self._sid, self._key, self._row = [table], [sid], [key], [row]
+        self._kept = self._buffered = len(sid)
+
+    def merge(self, other: "Reservoir") -> "Reservoir":
+        """Union with another worker's reservoir over the same strata (order does not matter)."""
+        if other.strata.values != self.strata.values or not np.array_equal(other.strata.quota, self.strata.quota):
+            raise ValueError("❌ Cannot merge reservoirs built for different strata / quotas")
+        other.compact()
+        self.seen += other.seen
+        if other._tables:
+            self._add(other._tables[0], other._sid[0], other._key[0], other._row[0])
+        self.compact()
+        return self
+
+    def result(self):
+        """(rows sorted by dataset row number, their row numbers, their stratum ids)."""
+        self.compact()
+        if not self._tables:
+            return None, np.empty(0, np.int64), np.empty(0, np.int64)
+        row = self._row[0]
+        order = np.argsort(row, kind="stable")
+        return self._tables[0].take(pa.array(order)), row[order], self._sid[0][order]
+
+    def __getstate__(self):
+        self.compact()
+        return self.__dict__
+
+
+# === Work units ===
+def plan(source, jobs: int) -> list:
+    """
+    Tasks of (path, row_groups, first dataset row), grouped per worker call.
+    Partitioned roots: one task per city (all its files, in rooftops.load() order).
+    Single file: `jobs` contiguous row-group ranges.
+    """
+    source = Path(source)
+    if source.is_dir():
+        data = rooftops.dataset(source)
+        tasks, offset = {}, 0
+        for path in data.files:
+            city = next((unquote(p.split("=", 1)[1]) for p in Path(path).relative_to(source).parts
+                         if p.startswith("City=")), "")
+            n = pq.ParquetFile(path).metadata.num_rows
+            tasks.setdefault(city, []).append((path, None, offset))
+            offset += n
+        return list(tasks.values())
+    meta = pq.ParquetFile(source).metadata
+    sizes = [meta.row_group(i).num_rows for i in range(meta.num_row_groups)]
+    starts = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    blocks = np.array_split(np.arange(len(sizes)), max(1, min(jobs, len(sizes))))
+    return [[(str(source), b.tolist(), int(starts[b[0]]))] for b in blocks if len(b)]
+
+
+def _batches(source: Path, tasks, columns, chunk_rows: int):
+    """(batch, first dataset row) over the files / row groups of one work unit."""
+    fragments = {}
+    if source.is_dir():
+        data = rooftops.dataset(source)
+        paths = {path for path, _, _ in tasks}
+        fragments = {f.path: f for f in data.get_fragments() if f.path in paths}
+    for path, row_groups, row in tasks:
+        if row_groups is None:
+            batches = fragments[path].to_batches(schema=data.schema, columns=columns, batch_size=chunk_rows)
+        else:
+            batches = pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, row_groups=row_groups, columns=columns)
+        for batch in batches:
+            yield batch, row
+            row += batch.num_rows
+
+
+def _columns(source: Path, kept) -> list:
+    """Columns to read (in output order); BuildingType_5 is derived, not read, when kept types are given."""
+    schema = rooftops.read_schema(source) if source.is_dir() else None
+    if schema is None:
+        schema = rooftops.dataset(source).schema
+    names = list(schema.names)
+    return [c for c in names if not (kept is not None and c == STRATA[1])]
+
+
+def sample_part(source, tasks, strata: Strata, seed: int, kept=None, chunk_rows: int = CHUNK_ROWS) -> Reservoir:
+    """Reservoir for one work unit (a city's files, or a row-group range)."""
+    source = Path(source)
+    columns = _columns(source, kept)
+    schema = rooftops.read_schema(source) if source.is_dir() else None
+    reservoir = Reservoir(strata)
+    for batch, row in _batches(source, tasks, columns, chunk_rows):
+        table = pa.Table.from_batches([batch])
+        if schema is not None:
+            table = table.cast(pa.schema([schema.field(c) for c in table.column_names]))
+        if kept is not None:
+            table = derive_type5(table, kept)
+        reservoir.offer(table, np.arange(row, row + table.num_rows, dtype=np.int64), seed)
+    reservoir.compact()
+    return reservoir
+
+
+def sample(source, strata: Strata, seed: int = SEED, kept=None, jobs: int = 1, chunk_rows: int = CHUNK_ROWS):
+    """Draw the balanced sample; returns (Table in dataset row order, row numbers, merged Reservoir)."""
+    tasks = plan(source, jobs)
+    merged = Reservoir(strata)
+    if jobs <= 1 or len(tasks) == 1:
+        for t in tasks:
+            merged.merge(sample_part(source, t, strata, seed, kept, chunk_rows))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = [pool.submit(sample_part, str(source), t, strata, seed, kept, chunk_rows) for t in tasks]
+            for fut in futures:
+                merged.merge(fut.result())
+    table, rows, _ = merged.result()
+    return table, rows, merged
+
+
+# === Quotas ===
+def count_strata(source, by, kept=None, jobs: int = 1, chunk_rows: int = CHUNK_ROWS) -> pd.DataFrame:
+    """Rows per stratum from one streaming pass over just the `by` columns."""
+    source = Path(source)
+    read_cols = [TYPE_COLUMN if (kept is not None and c == STRATA[1]) else c for c in by]
+    read_cols = list(dict.fromkeys(read_cols))
+    parts = []
+    for tasks in plan(source, jobs):
+        for batch, _ in _batches(source, tasks, read_cols, chunk_rows):
+            table = pa.Table.from_batches([batch])
+            if kept is not None:
+                table = derive_type5(table, kept)
+            parts.append(table.select(list(by)).group_by(list(by)).aggregate([([], "count_all")]).to_pandas())
+    counts = pd.concat(parts, ignore_index=True)
+    for c in by:
+        counts[c] = counts[c].astype(str)
+    return counts.groupby(list(by), as_index=False)["count_all"].sum().rename(columns={"count_all": "row_count"})
+
+
+def allocate(available: np.ndarray, q: int, floor: int = FLOOR, ceiling: int = None, adaptive: bool = False):
+    """
+    Quota per type for one city, as combine.ipynb: proportional to availability,
+    clipped to [min(avail, floor), min(avail, ceiling)], then +/-1 per pass until
+    the city total is q. With adaptive=True the ceiling is relaxed towards q
+    until the city can reach q. Returns (quotas, ceiling used); the ceiling is
+    None for a city that takes all of its rows, where none applies.
+    """
+    avail = np.asarray(available, dtype=np.int64)
+    if avail.sum() <= q:
+        return avail.copy(), None
+    ceiling = -(-q // 2) if ceiling is None else ceiling
+    if adaptive:
+        while np.minimum(avail, ceiling).sum() < q and ceiling < q:
+            gap = q - int(np.minimum(avail, ceiling).sum())
+            ceiling = min(q, ceiling + max(1000, gap // 2))
+
+    floors = np.minimum(avail, floor)
+    quota = np.maximum(np.minimum(np.floor(q * avail / avail.sum()).astype(np.int64), np.minimum(avail, ceiling)),
+                       floors)
+    diff = q - int(quota.sum())
+    while diff > 0:
+        room = np.minimum(avail, ceiling) - quota
+        order = np.argsort(-room)
+        grow = order[room[order] > 0][:diff]
+        if not len(grow):
+            break
+        quota[grow] += 1
+        diff -= len(grow)
+    while diff < 0:
+        removable = quota - floors
+        order = np.argsort(-quota)
+        shrink = order[removable[order] > 0][:-diff]
+        if not len(shrink):
+            break
+        quota[shrink] -= 1
+        diff += len(shrink)
+    return quota, ceiling
+
+
+def quotas(counts: pd.DataFrame, top: int = TOP_CITIES, q: int = None, floor: int = FLOOR, ceiling: int = None,
+           adaptive: bool = False) -> pd.DataFrame:
+    """Quota table (City, type, available, quota, ceiling_used) for the `top` cities by row count."""
+    city, type_col = counts.columns[0], counts.columns[1]
+    city_rows = counts.groupby(city)["row_count"].sum().sort_values(ascending=False, kind="stable")
+    top_cities = city_rows.head(top)
+    q = int(top_cities.min()) if q is None else q
+    rows = []
+    for name in top_cities.index:
+        cdf = counts[counts[city] == name].sort_values("row_count", ascending=False, kind="stable")
+        quota, used = allocate(cdf["row_count"].to_numpy(), q, floor, ceiling, adaptive)
+        rows.append(pd.DataFrame({city: name, type_col: cdf[type_col].to_numpy(),
+                                  "available": cdf["row_count"].to_numpy(), "quota": quota, "ceiling_used": used}))
+    table = pd.concat(rows, ignore_index=True)
+    table["ceiling_used"] = table["ceiling_used"].astype("Int64")
+    return table
+
+
+def peak_rss_mb() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+# === CLI ===
+def _strata(args, source: Path) -> Strata:
+    if args.quotas is not None:
+        q = pd.read_csv(args.quotas, dtype={c: str for c in args.by})
+        missing = [c for c in args.by + ["quota"] if c not in q.columns]
+        if missing:
+            raise SystemExit(f"❌ {args.quotas} has no column(s) {', '.join(missing)}")
+        return Strata.from_frame(q, args.by)
+    if args.per_group is None:
+        raise SystemExit("❌ Pass --quotas <csv> or --per-group N")
+    counts = count_strata(source, args.by, args.kept, args.jobs, args.chunk_rows)
+    return Strata.uniform(args.by, [counts[c].unique() for c in args.by], args.per_group)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Streaming per-stratum quota sampler for the balanced training sets.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    for name, help_ in [("sample", "Draw the balanced sample"), ("quotas", "Recompute the quota file")]:
+        p = sub.add_parser(name, help=help_)
+        p.add_argument("source", type=Path, help="Parquet file or City-partitioned directory")
+        p.add_argument("--by", nargs="+", default=STRATA, help="Stratum columns")
+        p.add_argument("--kept-types", type=Path, default=None,
+                       help="kept_fine_types_97pct.csv: derive BuildingType_5 from BuildingType")
+        p.add_argument("--jobs", type=int, default=1)
+        p.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+        p.add_argument("--out", type=Path, required=True)
+    p = sub.choices["sample"]
+    p.add_argument("--quotas", type=Path, default=None, help="Quota CSV with the --by columns and 'quota'")
+    p.add_argument("--per-group", type=int, default=None, help="Flat cap per stratum instead of a quota file")
+    p.add_argument("--seed", type=int, default=SEED)
+    p.add_argument("--ids", type=Path, default=None,
+                   help="Also write the sampled row numbers as CSV. row_idx is the row's position in the input: for a "
+                        "City-partitioned root that is rooftops file order, not a row index of the original parquet")
+    p = sub.choices["quotas"]
+    p.add_argument("--top", type=int, default=TOP_CITIES, help="Keep the N cities with the most rows")
+    p.add_argument("--q", type=int, default=None, help="Rows per city (default: smallest of the top cities)")
+    p.add_argument("--floor", type=int, default=FLOOR)
+    p.add_argument("--ceiling", type=int, default=None, help="Max rows per type (default: ceil(q / 2))")
+    p.add_argument("--adaptive", action="store_true", help="Relax the ceiling for cities that cannot reach q")
+    args = ap.parse_args()
+
+    args.kept = kept_types(args.kept_types) if args.kept_types else None
+    args.out.parent.mkdir(parents=True, exist_ok=True)
+    t0 = time.time()
+
+    if args.cmd == "quotas":
+        counts = count_strata(args.source, args.by, args.kept, args.jobs, args.chunk_rows)
+        table = quotas(counts, args.top, args.q, args.floor, args.ceiling, args.adaptive)
+        table.to_csv(args.out, index=False)
+        sums = table.groupby(args.by[0])["quota"].sum()
+        print(f"✅ Quotas for {len(sums)} cities ({int(sums.min()):,}–{int(sums.max()):,} rows each) → {args.out}")
+    else:
+        strata = _strata(args, args.source)
+        table, rows, reservoir = sample(args.source, strata, args.seed, args.kept, args.jobs, args.chunk_rows)
+        if table is None:
+            raise SystemExit("❌ No rows matched any stratum")
+        tmp = args.out.with_name(args.out.name + ".tmp")
+        pq.write_table(table, tmp, compression="zstd")
+        tmp.replace(args.out)
+        if args.ids:
+            pd.DataFrame({**{c: table.column(c).to_pandas().astype(str) for c in args.by}, ROW_COLUMN: rows}
+                         ).to_csv(args.ids, index=False)
+
+        taken = np.bincount(strata.ids(table), minlength=len(strata.quota))
+        short = np.flatnonzero(taken < strata.quota)
+        print(f"✅ {table.num_rows:,} rows → {args.out} ({time.time() - t0:.1f}s, peak RSS {peak_rss_mb():.0f} MB)")
+        print(f"🔹 {int((strata.quota > 0).sum())} strata, max |sampled - quota| = "
+              f"{int(np.abs(taken - strata.quota).max()) if len(taken) else 0}")
+        for sid in short[:10]:
+            print(f"⚠️ {' / '.join(strata.label(sid))}: {taken[sid]:,} of {strata.quota[sid]:,} "
+                  f"(only {reservoir.seen[sid]:,} available)")
@@ -0,0 +1,143 @@
+"""
+scheduler.py — Request micro-batching for the API
+-------------------------------------------------
+Single predictions submitted from concurrent HTTP requests are queued and
+coalesced by one dedicated worker thread: it waits up to `window_ms` after
+the first request (or until `max_batch` requests are queued), scores the
+whole batch with one predict_energy_batch call per latency tier, and
+resolves each request's Future with its own result or error.
+
+The queue is bounded (`queue_depth`); submit() raises QueueFullError
+instead of letting latency grow without limit.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class QueueFullError(RuntimeError):
+    """Raised by submit() when the scheduler queue is at capacity."""
+
+
+class InferenceScheduler:
+    def __init__(self, predict_batch, window_ms: float = 2.0, max_batch: int = 64, queue_depth: int = 1024):
+        """
+        predict_batch: callable(city=, building_type=, tilt=, tier=, return_errors=True)
+                       -> (preds, errors), e.g. predict.predict_energy_batch
+        """
+        self.predict_batch = predict_batch
+        self.window_ms = float(window_ms)
+        self.max_batch = int(max_batch)
+        self.queue_depth = int(queue_depth)
+
+        self._queue = queue.Queue(maxsize=self.queue_depth)
+        self._stop = threading.Event()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "rejected": 0,
+            "batches": 0,
+            "batch_size_max": 0,
+            "batch_seconds_total": 0.0,
+            "batch_seconds_max": 0.0,
+        }
+
+    # --- Lifecycle ---
+    def start(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+            self._worker.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    # --- Client side ---
+    def submit(self, city: str, building_type: str, tilt: float, tier: str = "full") -> Future:
+        fut = Future()
+        try:
+            self._queue.put_nowait((city, building_type, tilt, tier, fut))
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise QueueFullError(f"Inference queue is full ({self.queue_depth} pending requests)")
+        return fut
+
+    def stats(self) -> dict:
+        with self._lock:
+            s = dict(self._stats)
+        s["batch_size_avg"] = round(s["requests"] / s["batches"], 2) if s["batches"] else 0.0
+        s["batch_ms_avg"] = round(1e3 * s.pop("batch_seconds_total") / s["batches"], 3) if s["batches"] else 0.0
+        s["batch_ms_max"] = round(1e3 * s.pop("batch_seconds_max"), 3)
+        s.update({
+            "window_ms": self.window_ms,
+            "max_batch": self.max_batch,
+            "queue_depth": self.queue_depth,
+            "queued": self._queue.qsize(),
+        })
+        return s
+
+    # --- Worker side ---
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.perf_counter() + self.window_ms / 1e3
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self._execute(batch)
+
+    def _execute(self, batch) -> None:
+        # Drop requests whose caller has already gone away
+        batch = [item for item in batch if item[4].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        t0 = time.perf_counter()
+        for tier in dict.fromkeys(item[3] for item in batch):
+            self._execute_tier(tier, [item for item in batch if item[3] == tier])
+        seconds = time.perf_counter() - t0
+
+        with self._lock:
+            s = self._stats
+            s["requests"] += len(batch)
+            s["batches"] += 1
+            s["batch_size_max"] = max(s["batch_size_max"], len(batch))
+            s["batch_seconds_total"] += seconds
+            s["batch_seconds_max"] = max(s["batch_seconds_max"], seconds)
+
+    def _execute_tier(self, tier: str, items) -> None:
+        try:
+            preds, errors = self.predict_batch(
+                city=[b[0] for b in items],
+                building_type=[b[1] for b in items],
+                tilt=[b[2] for b in items],
+                tier=tier,
+                return_errors=True,
+            )
+        except Exception as e:
+            for item in items:
+                item[4].set_exception(e)
+            return
+
+        for item, pred, err in zip(items, preds, errors):
+            if err is not None:
+                item[4].set_exception(ValueError(err))
+            else:
+                item[4].set_result(float(pred))
@@ -0,0 +1,385 @@
+"""
+schema.py — Compact columnar schema for the training and rooftop datasets
+-------------------------------------------------------------------------
+dataset.parquet / all_cities_clean.parquet come back from pd.read_parquet
+as float64 everywhere and Python-object strings for City / building type,
+and model.ipynb then copied that frame several times (df.copy(), X.copy(),
+X_encoded). The canonical in-memory (and on-disk) schema is:
+
+- floating columns               float32
+- kWh_per_m2 (the target)        float64
+- interaction inputs             float64  (tilt, tilt_cos, GHI, temp, clearness, precip)
+- City, other string columns     dictionary<int16 / int32, string>  (pandas category)
+- BuildingType / BuildingType_5  dictionary<int8, string>           (pandas category)
+- Assumed_building_type          int8 code (codes.BUILDING_TYPE_CODES)
+
+Dictionaries are sorted, so pandas category codes equal what
+astype("category") gives on the old frame (feature_config's
+BuildingType_categories stay valid); the index type widens if a column has
+more distinct values than it can hold.
+
+Every feature is computed in float64 exactly as features.py does at serving
+time (interactions from the float64 inputs) and rounded to float32 once,
+when it is written into the training block. That is what XGBoost and the
+sklearn forests see anyway (they convert X to float32 internally), so their
+inputs are identical to the old path's. LightGBM is the exception: it was
+fitted on float64 features and now sees them rounded to float32, which only
+moves a value across a histogram bin edge when it lies within float32
+precision of one. The target is never narrowed: it is read, clipped and
+log-transformed in float64, so y_log is bit-identical to the old path.
+
+load() enforces the schema on any Parquet file, partitioned root (rooftops.py
+layout) or CSV. training_features() is model.ipynb's Cells 2-3 without the
+full-frame copies: the numeric features are written once into a float32
+column-major block that X (categorical BuildingType, LightGBM) and
+X_encoded (int8 codes, XGB / RF / ET) share.
+
+Memory report (from FINAL/):
+----------------------------
+$ python pipeline/schema.py report dataset/dataset.parquet --compare
+$ python pipeline/schema.py convert dataset/dataset.parquet --out dataset/dataset_compact.parquet
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import rooftops
+from codes import TYPE_NAME_CODES
+from loader import rss_bytes
+
+TARGET = "kWh_per_m2"
+CAT = ["BuildingType"]
+BASE_NUM = [
+    "tilt", "tilt2", "tilt_sin", "tilt_cos",
+    "GHI_kWh_per_m2_day", "AvgTemp_C",
+    "ClearnessIndex", "Precip_mm_per_day",
+]
+INTERACTIONS = ["tilt_x_GHI", "temp_sq", "clear_x_tiltcos", "precip_x_clear"]
+# Base features the interactions are computed from; kept float64 until then
+INTERACTION_INPUTS = ["tilt", "tilt_cos", "GHI_kWh_per_m2_day", "AvgTemp_C", "ClearnessIndex", "Precip_mm_per_day"]
+NUM = BASE_NUM + INTERACTIONS
+TARGET_CLIP = (0.01, 0.99)
+# Original row number, carried through a partitioned copy so load() can restore the source order
+ROW_ID = "row_id"
+
+# Columns with a fixed compact type; everything else follows compact_type()
+COLUMN_TYPES = {
+    TARGET: pa.float64(),
+    **{name: pa.float64() for name in INTERACTION_INPUTS},
+    "City": pa.dictionary(pa.int16(), pa.string()),
+    "BuildingType": pa.dictionary(pa.int8(), pa.string()),
+    "BuildingType_5": pa.dictionary(pa.int8(), pa.string()),
+    "Assumed_building_type": pa.int8(),
+}
+
+
+# === Schema ===
+def compact_type(field: pa.Field) -> pa.DataType:
+    if field.name in COLUMN_TYPES:
+        return COLUMN_TYPES[field.name]
+    t = field.type
+    if pa.types.is_floating(t):
+        return pa.float32()
+    if pa.types.is_string(t) or pa.types.is_large_string(t):
+        return pa.dictionary(pa.int32(), pa.string())
+    if pa.types.is_dictionary(t) and (pa.types.is_string(t.value_type) or pa.types.is_large_string(t.value_type)):
+        return pa.dictionary(pa.int32(), pa.string())
+    return t
+
+
+def compact_schema(schema: pa.Schema) -> pa.Schema:
+    """The compact version of a dataset schema (same columns, same order)."""
+    return pa.schema([pa.field(f.name, compact_type(f)) for f in schema]).remove_metadata()
+
+
+def _index_type(n_values: int, declared: pa.DataType) -> pa.DataType:
+    for t in (pa.int8(), pa.int16(), pa.int32()):
+        if t.bit_width >= declared.bit_width and n_values <= np.iinfo(t.to_pandas_dtype()).max + 1:
+            return t
+    return pa.int64()
+
+
+def _sorted_dictionary(column: pa.ChunkedArray, declared: pa.DataType) -> pa.ChunkedArray:
+    """Dictionary-encode with one sorted dictionary shared by every chunk (decoded one chunk at a time)."""
+    strings = lambda chunk: pc.cast(chunk, pa.string())
+    seen = [pc.unique(strings(chunk)) for chunk in column.chunks]
+    dictionary = pc.unique(pa.chunked_array(seen, type=pa.string())).drop_null() if seen else pa.array([], pa.string())
+    dictionary = dictionary.take(pc.sort_indices(dictionary))
+    index_type = _index_type(len(dictionary), declared.index_type)
+    chunks = [pa.DictionaryArray.from_arrays(pc.index_in(strings(chunk), value_set=dictionary).cast(index_type),
+                                             dictionary) for chunk in column.chunks]
+    return pa.chunked_array(chunks, type=pa.dictionary(index_type, pa.string()))
+
+
+def _codes(column: pa.ChunkedArray) -> pa.ChunkedArray:
+    """Building types as int8 codes, whether stored as codes, names or a dictionary of either."""
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(column.type.value_type)
+    if pa.types.is_integer(column.type) or pa.types.is_floating(column.type):
+        return column.cast(pa.int8())
+    names = pc.utf8_lower(pc.utf8_trim_whitespace(column.cast(pa.string())))
+    known = list(TYPE_NAME_CODES)
+    idx = pc.index_in(names, value_set=pa.array(known))
+    if idx.null_count > column.null_count:
+        bad = pc.unique(pc.filter(names, pc.is_null(idx))).to_pylist()
+        raise ValueError(f"❌ Unknown building type(s): {', '.join(map(str, bad[:5]))}")
+    return pc.take(pa.array([TYPE_NAME_CODES[k] for k in known], pa.int8()), idx)
+
+
+def _cast_numeric(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """Floats (except the target) to float32 while scanning, so a float64 copy of the whole table never exists."""
+    arrays = [a.cast(pa.float32()) if pa.types.is_floating(a.type) and f.name not in COLUMN_TYPES else a
+              for f, a in zip(batch.schema, batch.columns)]
+    return pa.RecordBatch.from_arrays(arrays, names=batch.schema.names)
+
+
+def enforce(table: pa.Table, required=None) -> pa.Table:
+    """Cast every column to its compact type; `required` columns must be present."""
+    missing = [c for c in (required or []) if c not in table.column_names]
+    if missing:
+        raise ValueError(f"❌ Missing column(s): {', '.join(missing)}")
+    columns = []
+    for field, column in zip(table.schema, table.columns):
+        target = compact_type(field)
+        if pa.types.is_dictionary(target):
+            column = _sorted_dictionary(column, target)
+        elif field.name == "Assumed_building_type":
+            column = _codes(column)
+        elif column.type != target:
+            column = column.cast(target)
+        columns.append(column)
+    return pa.table(columns, names=table.column_names)
+
+
+def with_row_ids(table: pa.Table) -> pa.Table:
+    """Append ROW_ID (0..n-1) before partitioning, so load(order_by=ROW_ID) gives the rows back in this order."""
+    return table.append_column(ROW_ID, pa.array(np.arange(table.num_rows, dtype=np.int64)))
+
+
+def load(path, columns=None, cities=None, types=None, required=None, as_arrow: bool = False, order_by: str = None):
+    """
+    Read a Parquet file, partitioned root or CSV in the compact schema.
+    Filters / projection are pushed down as in rooftops.load(). Feature
+    columns are narrowed to float32 as they are scanned and the Arrow buffers released
+    while converting to pandas, so the peak stays close to one compact copy.
+    With order_by (e.g. ROW_ID) rows are sorted on that column, which is then dropped.
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        import pyarrow.csv as pacsv
+        opts = pacsv.ConvertOptions(include_columns=list(columns)) if columns else None
+        table = pacsv.read_csv(path, convert_options=opts)
+        if cities is not None or types is not None:
+            raise ValueError("❌ cities= / types= are only supported for Parquet inputs")
+    else:
+        data = rooftops.dataset(path)
+        if columns is None:
+            written = rooftops.read_schema(path) if path.is_dir() else None
+            keys = rooftops.partition_keys(data)
+            columns = written.names if written is not None else keys + [c for c in data.schema.names if c not in keys]
+        scan = data.scanner(columns=list(columns), filter=rooftops.where(data, cities, types))
+        batches = [_cast_numeric(b) for b in scan.to_batches()]
+        schema = batches[0].schema if batches else compact_schema(scan.projected_schema)
+        table = pa.Table.from_batches(batches, schema=schema)
+        del batches
+    if order_by is not None:
+        if order_by not in table.column_names:
+            raise ValueError(f"❌ Missing column: {order_by}")
+        # One column at a time, so only one column is ever held twice
+        order = pc.sort_indices(table.column(order_by))
+        table = table.drop_columns([order_by])
+        names, columns = table.column_names, []
+        for name in names:
+            columns.append(table.column(name).take(order))
+            table = table.drop_columns([name])
+        table = pa.table(columns, names=names)
+        del order, columns
+    table = enforce(table, required)
+    if as_arrow:
+        return table
+    df = table.to_pandas(split_blocks=True, self_destruct=True)
+    del table
+    pa.default_memory_pool().release_unused()
+    return df
+
+
+def convert(src, out: Path) -> pa.Table:
+    """Rewrite a dataset in the compact schema as one Parquet file."""
+    table = load(src, as_arrow=True)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(out.name + ".tmp")
+    pq.write_table(table, tmp, compression="zstd")
+    tmp.replace(out)
+    return table
+
+
+# === Training features ===
+def training_features(df: pd.DataFrame, clip=TARGET_CLIP, consume: bool = False):
+    """
+    (X, X_encoded, y_log) as model.ipynb builds them, from a compact frame.
+
+    X and X_encoded share one float32 block with the NUM columns; only the
+    BuildingType column differs (category vs int8 codes). Interactions are
+    computed from the float64 inputs and rounded once into the block. The target is
+    clipped to its [1%, 99%] quantiles and log1p'd in float64. With
+    consume=True the target and base numeric columns are dropped from df
+    once copied, leaving City / BuildingType for grouping and reporting.
+    """
+    y = df[TARGET].astype(np.float64)
+    low_q, high_q = y.quantile(list(clip))
+    y_log = np.log1p(y.clip(low_q, high_q))
+    del y
+
+    block = np.empty((len(df), len(NUM)), dtype=np.float32, order="F")
+    col = {name: block[:, j] for j, name in enumerate(NUM)}
+    for name in BASE_NUM:
+        col[name][:] = df[name].to_numpy()
+    # Products in float64 (as features.py serves them), rounded once on assignment
+    src = {name: df[name].to_numpy(dtype=np.float64) for name in INTERACTION_INPUTS}
+    col["tilt_x_GHI"][:] = src["tilt"] * src["GHI_kWh_per_m2_day"]
+    col["temp_sq"][:] = src["AvgTemp_C"] ** 2
+    col["clear_x_tiltcos"][:] = src["ClearnessIndex"] * src["tilt_cos"]
+    col["precip_x_clear"][:] = src["Precip_mm_per_day"] * (1.0 - src["ClearnessIndex"])
+    del src
+    if consume:
+        for name in BASE_NUM + [TARGET]:
+            del df[name]
+
+    categories = df[CAT[0]]
+    if not isinstance(categories.dtype, pd.CategoricalDtype):
+        categories = categories.astype("category")
+    X = pd.DataFrame(block, columns=NUM, index=df.index, copy=False)
+    X[CAT[0]] = categories
+    X_encoded = pd.DataFrame(block, columns=NUM, index=df.index, copy=False)
+    X_encoded[CAT[0]] = categories.cat.codes
+    return X, X_encoded, y_log
+
+
+def legacy_features(df: pd.DataFrame, clip=TARGET_CLIP):
+    """model.ipynb's original Cells 2-3 (copies included), for comparison."""
+    df_feat = df.copy()
+    y_raw = df_feat[TARGET].astype(float)
+    low_q, high_q = y_raw.quantile(list(clip))
+    df_feat[TARGET] = y_raw.clip(low_q, high_q)
+    df_feat["tilt_x_GHI"] = df_feat["tilt"] * df_feat["GHI_kWh_per_m2_day"]
+    df_feat["temp_sq"] = df_feat["AvgTemp_C"] ** 2
+    df_feat["clear_x_tiltcos"] = df_feat["ClearnessIndex"] * df_feat["tilt_cos"]
+    df_feat["precip_x_clear"] = df_feat["Precip_mm_per_day"] * (1.0 - df_feat["ClearnessIndex"])
+    X = df_feat[NUM + CAT].copy()
+    y = df_feat[TARGET].copy()
+    for c in CAT:
+        X[c] = X[c].astype("category")
+    X_encoded = X.copy()
+    X_encoded["BuildingType"] = X_encoded["BuildingType"].cat.codes
+    return X, X_encoded, np.log1p(y), df_feat
+
+
+# === Memory report ===
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def column_bytes(df: pd.DataFrame) -> dict:
+    return {c: int(b) for c, b in df.memory_usage(deep=True, index=False).items()}
+
+
+class MemoryTrace:
+    """Current / peak RSS and frame sizes after each step of a pipeline."""
+
+    def __init__(self):
+        self.steps = []
+        self.t0 = time.time()
+
+    def mark(self, step: str, **frames) -> None:
+        self.steps.append({
+            "step": step,
+            "seconds": round(time.time() - self.t0, 2),
+            "rss_mb": round((rss_bytes() or 0) / 2**20, 1),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "frames_mb": {k: round(sum(column_bytes(v).values()) / 2**20, 1) for k, v in frames.items()},
+        })
+
+
+def profile(path, mode: str = "compact") -> dict:
+    """Load + feature-build `path` the compact or the legacy (notebook) way, tracing memory."""
+    trace = MemoryTrace()
+    trace.mark("start")
+    if mode == "compact":
+        df = load(path, required=[TARGET] + BASE_NUM + CAT)
+        columns = column_bytes(df)
+        trace.mark("load", df=df)
+        X, X_encoded, y_log = training_features(df, consume=True)
+        # X and X_encoded share their float32 block: count it once
+        trace.mark("features", df=df, X=X, X_encoded=X_encoded[CAT])
+    else:
+        df = pd.read_parquet(path) if Path(path).suffix.lower() != ".csv" else pd.read_csv(path)
+        columns = column_bytes(df)
+        trace.mark("load", df=df)
+        X, X_encoded, y_log, df_feat = legacy_features(df)
+        trace.mark("features", df=df, df_feat=df_feat, X=X, X_encoded=X_encoded)
+    return {"mode": mode, "source": str(path), "rows": len(X), "columns": columns,
+            "dtypes": {c: str(t) for c, t in X.dtypes.items()}, "steps": trace.steps}
+
+
+def _print_report(reports: list) -> None:
+    print(f"\n📊 Bytes per column ({reports[0]['rows']:,} rows)")
+    names = list(dict.fromkeys(c for r in reports for c in r["columns"]))
+    print(f"   {'column':<22}" + "".join(f"{r['mode']:>14}" for r in reports))
+    for c in names:
+        cells = "".join(f"{r['columns'][c] / 2**20:>11.1f} MB" if c in r["columns"] else f"{'-':>14}" for r in reports)
+        print(f"   {c:<22}{cells}")
+    totals = "".join(f"{sum(r['columns'].values()) / 2**20:>11.1f} MB" for r in reports)
+    print(f"   {'total':<22}{totals}")
+    for r in reports:
+        print(f"\n📊 {r['mode']}: step / RSS / peak RSS / live frames")
+        for s in r["steps"]:
+            frames = ", ".join(f"{k} {v:.0f} MB" for k, v in s["frames_mb"].items())
+            print(f"   {s['step']:<10} {s['seconds']:>6.2f}s {s['rss_mb']:>8.0f} MB {s['peak_rss_mb']:>8.0f} MB   {frames}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Compact dataset schema: conversion and memory report.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("report", help="Bytes per column and peak memory through feature engineering")
+    p.add_argument("source", type=Path)
+    p.add_argument("--mode", choices=["compact", "legacy"], default="compact")
+    p.add_argument("--compare", action="store_true", help="Run both modes, each in a fresh process")
+    p.add_argument("--json", type=Path, default=None, help="Also write the report(s) as JSON")
+    p = sub.add_parser("convert", help="Rewrite a dataset in the compact schema")
+    p.add_argument("source", type=Path)
+    p.add_argument("--out", type=Path, required=True)
+    args = ap.parse_args()
+
+    if args.cmd == "convert":
+        t0 = time.time()
+        table = convert(args.source, args.out)
+        print(f"✅ {table.num_rows:,} rows → {args.out} ({args.out.stat().st_size / 2**20:.1f} MB, "
+              f"{time.time() - t0:.1f}s)")
+        for field in table.schema:
+            print(f"🔹 {field.name}: {field.type}")
+    else:
+        if args.compare:
+            # Peak RSS only ever grows: each mode gets its own process
+            reports = []
+            for mode in ("legacy", "compact"):
+                out = subprocess.run([sys.executable, __file__, "report", str(args.source), "--mode", mode,
+                                      "--json", "/dev/stdout"], capture_output=True, text=True, check=True)
+                reports.append(json.loads(out.stdout[out.stdout.index("{"):]))
+        else:
+            reports = [profile(args.source, args.mode)]
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(reports[0] if len(reports) == 1 else reports, f, indent=2)
+        if str(args.json) != "/dev/stdout":
+            _print_report(reports)
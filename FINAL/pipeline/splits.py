@@ -0,0 +1,155 @@
+"""
+splits.py — Index-based (virtual) train/test splits over one canonical dataset
+------------------------------------------------------------------------------
+Instead of writing a train and a test copy of the data per fold, a split is
+stored as the test rows of each fold, encoded as runs of consecutive row
+numbers of the canonical dataset (the order rooftops.load() returns them):
+
+    <outdir>/folds.npz            <fold>/starts, <fold>/stops   (int64 runs)
+    <outdir>/manifest_<x>.json    source (relative to outdir), dataset digest,
+                                  rows per fold
+
+On a City-partitioned dataset a LOCO test set is a single run, so a fold
+costs a few bytes; a random split costs at most one run per test row.
+train is the complement of test.
+
+Folds reads the dataset once (lazily, on first use) and hands out views:
+with few runs, train / test are zero-copy slices of the loaded Arrow table
+(Table.slice + concat_tables); with many, Table.take on the row indices.
+The dataset digest (file paths, sizes, row counts) is checked when the
+folds are opened, so indices are never applied to a different dataset.
+
+Usage:
+------
+>>> from splits import Folds
+>>> folds = Folds("../OG_approach_failed/splits/cross_city_LOCO")
+>>> for name, train, test in folds:           # pyarrow Tables
+...     fit(train.to_pandas(), test.to_pandas())
+>>> train_df, test_df = folds.fold("Accra", as_pandas=True)
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import rooftops
+
+INDEX_FILENAME = "folds.npz"
+MAX_SLICE_RUNS = 4096  # above this many runs a fold is gathered with take() instead of slices
+
+
+# === Run encoding ===
+def to_runs(mask: np.ndarray):
+    """(starts, stops) of the runs of True in a boolean row mask."""
+    padded = np.concatenate([[False], np.asarray(mask, dtype=bool), [False]])
+    edges = np.flatnonzero(padded[1:] != padded[:-1])
+    return edges[0::2].astype(np.int64), edges[1::2].astype(np.int64)
+
+
+def runs_to_indices(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    lengths = stops - starts
+    if not len(lengths):
+        return np.empty(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return np.arange(int(lengths.sum()), dtype=np.int64) + offsets
+
+
+def complement(starts: np.ndarray, stops: np.ndarray, n_rows: int):
+    """Runs of the rows not covered by (starts, stops)."""
+    new_starts = np.concatenate([[0], stops])
+    new_stops = np.concatenate([starts, [n_rows]])
+    keep = new_stops > new_starts
+    return new_starts[keep], new_stops[keep]
+
+
+# === Dataset identity ===
+def dataset_digest(source) -> str:
+    """sha1 over (relative path, size, rows) of every Parquet file that makes up `source`."""
+    source = Path(source)
+    if source.is_dir():
+        # Same files rooftops.dataset() reads: skip _common_metadata, temp files and hidden entries
+        files = [(f.relative_to(source).as_posix(), f) for f in sorted(source.rglob("*.parquet"))
+                 if not any(p.startswith(("_", ".")) for p in f.relative_to(source).parts)]
+    else:
+        files = [(source.name, source)]
+    h = hashlib.sha1()
+    for rel, f in files:
+        rows = pq.ParquetFile(f).metadata.num_rows
+        h.update(f"{rel}\t{f.stat().st_size}\t{rows}\n".encode())
+    return h.hexdigest()
+
+
+# === Writing ===
+def write_folds(test_masks: dict, outdir: Path) -> Path:
+    """Save {fold name: boolean test mask over the canonical rows} as runs in outdir/folds.npz."""
+    outdir.mkdir(parents=True, exist_ok=True)
+    arrays = {}
+    for name, mask in test_masks.items():
+        arrays[f"{name}/starts"], arrays[f"{name}/stops"] = to_runs(mask)
+    path = outdir / INDEX_FILENAME
+    tmp = outdir / (INDEX_FILENAME + ".tmp.npz")
+    np.savez_compressed(tmp, **arrays)
+    tmp.replace(path)
+    return path
+
+
+# === Reading ===
+class Folds:
+    """Lazy train / test views for the folds stored in a split directory."""
+
+    def __init__(self, split_dir, source=None, manifest_name: str = None):
+        self.split_dir = Path(split_dir)
+        manifests = [self.split_dir / manifest_name] if manifest_name else sorted(self.split_dir.glob("manifest_*.json"))
+        if not manifests or not manifests[0].is_file():
+            raise FileNotFoundError(f"❌ No split manifest in {self.split_dir}")
+        with open(manifests[0], "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("mode") != "index":
+            raise ValueError(f"❌ {manifests[0].name} is not an index-based split (mode={self.manifest.get('mode')})")
+        # source_file is stored relative to the split directory
+        self.source = Path(source) if source else self.split_dir / self.manifest["source_file"]
+        digest = dataset_digest(self.source)
+        if digest != self.manifest["dataset_digest"]:
+            raise ValueError(f"❌ {self.source} changed since the split was made "
+                             f"(digest {digest[:12]} != {self.manifest['dataset_digest'][:12]})")
+        self.n_rows = int(self.manifest["rows_total"])
+        self._runs = np.load(self.split_dir / self.manifest.get("index_file", INDEX_FILENAME))
+        self.names = list(dict.fromkeys(k.rsplit("/", 1)[0] for k in self._runs.files))
+        self._table = None
+
+    @property
+    def table(self) -> pa.Table:
+        if self._table is None:
+            self._table = rooftops.load(self.source, as_arrow=True)
+            if self._table.num_rows != self.n_rows:
+                raise ValueError(f"❌ {self.source} has {self._table.num_rows:,} rows, split expects {self.n_rows:,}")
+        return self._table
+
+    def _view(self, starts: np.ndarray, stops: np.ndarray) -> pa.Table:
+        table = self.table
+        if len(starts) <= MAX_SLICE_RUNS:
+            slices = [table.slice(int(a), int(b - a)) for a, b in zip(starts, stops)]
+            return pa.concat_tables(slices) if slices else table.slice(0, 0)
+        return table.take(pa.array(runs_to_indices(starts, stops)))
+
+    def fold(self, name: str, as_pandas: bool = False):
+        """(train, test) for one fold, as Arrow tables (or DataFrames with as_pandas=True)."""
+        if name not in self.names:
+            raise KeyError(f"❌ Unknown fold '{name}' (have {', '.join(self.names)})")
+        starts, stops = self._runs[f"{name}/starts"], self._runs[f"{name}/stops"]
+        test = self._view(starts, stops)
+        train = self._view(*complement(starts, stops, self.n_rows))
+        if as_pandas:
+            return train.to_pandas(), test.to_pandas()
+        return train, test
+
+    def __iter__(self):
+        for name in self.names:
+            yield (name, *self.fold(name))
+
+    def __len__(self):
+        return len(self.names)
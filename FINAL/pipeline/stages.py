@@ -0,0 +1,173 @@
+"""
+stages.py — Content-addressed cache for data-pipeline stages
+------------------------------------------------------------
+A stage (a split script, say) is identified by a cache key:
+
+    sha1(stage name, stage version, content digest of every input, parameters)
+
+and records it, together with the size / mtime / sha1 of each output, in
+its manifest. Re-running with the same inputs and parameters finds the key
+in the manifest, sees the outputs untouched (size + mtime, no re-hash) and
+skips the work entirely. Downstream steps can compare the recorded
+cache_key to tell whether their inputs have really changed, independent of
+file timestamps.
+
+Content digests are memoized per file by (path, size, mtime_ns) in a small
+JSON memo (ENERGY404_DIGEST_MEMO, default ~/.cache/energy404/digests.json),
+so an unchanged input is hashed once, not on every run. A directory
+(partitioned dataset) digests as the list of its files' digests. Fresh
+outputs are hashed on a thread pool (hashlib releases the GIL on large
+buffers).
+
+Usage:
+------
+>>> stage = Stage("split_loco", version=2, inputs=[src], params={"mode": "index"}, outdir=out,
+...               manifest_name="manifest_loco.json")
+>>> if stage.hit():
+...     return                                   # nothing to do
+>>> ... write outputs ...
+>>> manifest = stage.record(manifest, outputs)   # adds cache_key, input digests, output fingerprints
+"""
+
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+DIGEST_MEMO = Path(os.environ.get("ENERGY404_DIGEST_MEMO",
+                                  Path.home() / ".cache" / "energy404" / "digests.json"))
+HASH_JOBS = int(os.environ.get("ENERGY404_HASH_JOBS", os.cpu_count() or 1))
+
+_memo = None
+_memo_lock = threading.Lock()
+
+
+# === File digests ===
+def file_sha1(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _load_memo() -> dict:
+    global _memo
+    if _memo is None:
+        try:
+            with open(DIGEST_MEMO, "r", encoding="utf-8") as f:
+                _memo = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _memo = {}
+    return _memo
+
+
+def _save_memo() -> None:
+    if _memo is None:
+        return
+    DIGEST_MEMO.parent.mkdir(parents=True, exist_ok=True)
+    tmp = DIGEST_MEMO.with_name(f"{DIGEST_MEMO.name}.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_memo, f)
+    tmp.replace(DIGEST_MEMO)
+
+
+def _stat_tag(st) -> str:
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def sha1_memoized(path: Path) -> str:
+    """sha1 of a file, reused while its (path, size, mtime_ns) is unchanged."""
+    path = Path(path).resolve()
+    tag = _stat_tag(path.stat())
+    with _memo_lock:
+        hit = _load_memo().get(str(path))
+    if hit and hit[0] == tag:
+        return hit[1]
+    digest = file_sha1(path)
+    with _memo_lock:
+        _load_memo()[str(path)] = [tag, digest]
+    return digest
+
+
+def hash_files(paths, jobs: int = HASH_JOBS) -> dict:
+    """{path: sha1} for many files, in parallel; results are added to the memo."""
+    paths = [Path(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        digests = dict(zip(paths, pool.map(sha1_memoized, paths)))
+    with _memo_lock:
+        _save_memo()
+    return digests
+
+
+def _files(path: Path) -> list:
+    if path.is_dir():
+        return sorted(f for f in path.rglob("*") if f.is_file()
+                      and not any(p.startswith((".", "_")) or p.endswith(".tmp") for p in f.relative_to(path).parts))
+    return [path]
+
+
+def digest(path) -> str:
+    """Content digest of a file, or of a directory as the sorted (relative path, sha1) of its files."""
+    path = Path(path)
+    files = _files(path)
+    digests = hash_files(files)
+    if not path.is_dir():
+        return digests[path]
+    h = hashlib.sha1()
+    for f in files:
+        h.update(f"{f.relative_to(path).as_posix()}\t{digests[f]}\n".encode())
+    return h.hexdigest()
+
+
+def fingerprint(path: Path) -> dict:
+    st = Path(path).stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+# === Stages ===
+class Stage:
+    def __init__(self, name: str, version: int, inputs, params: dict, outdir: Path, manifest_name: str):
+        self.name = name
+        self.outdir = Path(outdir)
+        self.manifest_path = self.outdir / manifest_name
+        self.input_digests = {Path(p).as_posix(): digest(p) for p in inputs}
+        payload = {
+            "stage": name,
+            "version": version,
+            "inputs": sorted(self.input_digests.values()),
+            "params": params,
+        }
+        self.key = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+    def hit(self):
+        """The previous manifest if it has this key and all its outputs are untouched, else None."""
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        cache = manifest.get("cache", {})
+        if cache.get("key") != self.key:
+            return None
+        for rel, recorded in cache.get("outputs", {}).items():
+            path = self.outdir / rel
+            if not path.is_file() or fingerprint(path) != {k: recorded[k] for k in ("size", "mtime_ns")}:
+                return None
+        return manifest
+
+    def record(self, manifest: dict, outputs) -> dict:
+        """Hash outputs (in parallel) and add the cache block to the manifest; returns {output: sha1}."""
+        outputs = [Path(p) for p in outputs]
+        digests = hash_files(outputs)
+        manifest["cache_key"] = self.key
+        manifest["cache"] = {
+            "key": self.key,
+            "stage": self.name,
+            "inputs": self.input_digests,
+            "outputs": {p.relative_to(self.outdir).as_posix(): {**fingerprint(p), "sha1": digests[p]}
+                        for p in outputs},
+        }
+        return {p: digests[p] for p in outputs}
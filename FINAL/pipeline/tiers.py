@@ -0,0 +1,158 @@
+"""
+tiers.py — Latency tiers (ensemble member subsets)
+--------------------------------------------------
+Not every prediction needs all four base families. A tier names a subset of
+members plus a Ridge meta-model fitted on just those members:
+
+    fast      LGBM only
+    balanced  LGBM + XGB
+    full      LGBM + XGB + RF + ET   (the deployed meta_model)
+
+The offline analysis below takes per-member OOF predictions (written by
+model.ipynb Cell 5 to dataset/oof_members.parquet), measures each member's
+marginal contribution (MAE when it is dropped from the stack) and its
+serving cost, fits the reduced meta-learners, and writes:
+
+- meta_tiers.pkl     {tier: {"members": [...], "meta": Ridge}}
+- tiers_report.json  accuracy-vs-latency curve per tier
+
+Run:
+----
+$ python pipeline/tiers.py --oof dataset/oof_members.parquet
+"""
+
+import argparse
+import json
+import time
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+
+TIERS = {
+    "fast": ["lgb"],
+    "balanced": ["lgb", "xgb"],
+    "full": ["lgb", "xgb", "rf", "et"],
+}
+DEFAULT_TIER = "full"
+TIERS_FILENAME = "meta_tiers.pkl"
+REPORT_FILENAME = "tiers_report.json"
+MEMBER_COLUMNS = {"lgb": "pred_lgb", "xgb": "pred_xgb", "rf": "pred_rf", "et": "pred_et"}
+
+
+def check_tier(tier: str, available=None) -> str:
+    """Reject unknown tiers and, given `available`, tiers the served version has no artifact for."""
+    if tier not in TIERS:
+        raise ValueError(f"❌ Unknown tier '{tier}' (choose from {', '.join(TIERS)})")
+    if available is not None and tier not in available:
+        raise ValueError(f"❌ Tier '{tier}' is not available: {TIERS_FILENAME} is missing for this model version "
+                         f"(available: {', '.join(available)})")
+    return tier
+
+
+def cv_meta_mae(P: np.ndarray, y: np.ndarray, groups=None, alpha: float = 0.5) -> float:
+    """Cross-validated MAE of a Ridge meta-learner on member predictions P."""
+    from sklearn.linear_model import Ridge
+    from sklearn.model_selection import GroupKFold, KFold
+
+    cv = GroupKFold(n_splits=5) if groups is not None else KFold(n_splits=5, shuffle=True, random_state=404)
+    errors = np.empty(len(y))
+    for tr, va in cv.split(P, y, groups):
+        meta = Ridge(alpha=alpha).fit(P[tr], y[tr])
+        errors[va] = np.abs(meta.predict(P[va]) - y[va])
+    return float(errors.mean())
+
+
+def member_latency_ms(version, member: str, X: np.ndarray, repeats: int) -> float:
+    """Average wall time of one member's prediction on X (models of the given LoadedVersion)."""
+    s = version.store
+    if member == "lgb":
+        frame = version.features.lgb_frame(X)
+        fn = lambda: [m.predict(frame) for m in s.get("lgb_models")]
+    elif member == "xgb":
+        fn = lambda: [m.predict(X) for m in s.get("xgb_models")]
+    else:
+        fn = lambda: s.get(f"{member}_models")[0].predict(X)
+
+    fn()  # warm-up
+    t0 = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return 1e3 * (time.perf_counter() - t0) / repeats
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Fit per-tier meta-learners and report accuracy vs latency.")
+    ap.add_argument("--oof", type=Path, required=True, help="Parquet with y_true, pred_lgb/xgb/rf/et (and City)")
+    ap.add_argument("--alpha", type=float, default=0.5, help="Ridge alpha (model.ipynb uses 0.5)")
+    ap.add_argument("--batch", type=int, default=10_000, help="Batch size for the batch latency column")
+    ap.add_argument("--out", type=Path, default=None, help="Output directory (default: MODELS_DIR)")
+    args = ap.parse_args()
+
+    import joblib
+    import pandas as pd
+    from sklearn.linear_model import Ridge
+
+    import predict
+
+    oof = pd.read_parquet(args.oof)
+    y = oof["y_true"].to_numpy(dtype=np.float64)
+    groups = oof["City"].to_numpy() if "City" in oof.columns else None
+    members = list(MEMBER_COLUMNS)
+
+    def P(subset):
+        return oof[[MEMBER_COLUMNS[m] for m in subset]].to_numpy(dtype=np.float64)
+
+    # --- Serving cost per member (1 row and one batch) ---
+    rng = np.random.default_rng(404)
+    n = args.batch
+    version = predict.slot.current
+    Xb = version.features.build(rng.integers(0, len(version.features.cities), n),
+                                rng.integers(0, len(version.config["BuildingType_categories"]), n),
+                                rng.uniform(0, 60, n))
+    X1 = np.asfortranarray(Xb[:1])
+    cost = {m: {"ms_1_row": round(member_latency_ms(version, m, X1, 20), 3),
+                f"ms_{n}_rows": round(member_latency_ms(version, m, Xb, 1), 1)} for m in members}
+
+    # --- Marginal contribution: MAE increase when a member is dropped ---
+    mae_all = cv_meta_mae(P(members), y, groups, args.alpha)
+    marginal = {m: round(cv_meta_mae(P([k for k in members if k != m]), y, groups, args.alpha) - mae_all, 4)
+                for m in members}
+
+    # --- Every subset, so the report shows the whole frontier ---
+    curve = []
+    for r in range(1, len(members) + 1):
+        for subset in combinations(members, r):
+            curve.append({
+                "members": list(subset),
+                "mae": round(cv_meta_mae(P(subset), y, groups, args.alpha), 4),
+                "ms_1_row": round(sum(cost[m]["ms_1_row"] for m in subset), 3),
+                f"ms_{n}_rows": round(sum(cost[m][f"ms_{n}_rows"] for m in subset), 1),
+            })
+
+    # --- Reduced meta-learners for the named tiers (fit on all OOF rows) ---
+    tier_models = {}
+    for tier, subset in TIERS.items():
+        tier_models[tier] = {"members": subset, "meta": Ridge(alpha=args.alpha).fit(P(subset), y)}
+
+    out = args.out or predict.MODELS_DIR
+    joblib.dump(tier_models, out / TIERS_FILENAME)
+
+    report = {
+        "source": args.oof.as_posix(),
+        "rows": int(len(oof)),
+        "cv": "GroupKFold(City)" if groups is not None else "KFold(5)",
+        "member_cost": cost,
+        "marginal_mae_when_dropped": marginal,
+        "tiers": {t: next(c for c in curve if c["members"] == s) for t, s in TIERS.items()},
+        "all_subsets": sorted(curve, key=lambda c: c["ms_1_row"]),
+    }
+    with open(out / REPORT_FILENAME, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"\n{'tier':<10} {'members':<20} {'MAE':>8} {'ms/1 row':>9} {f'ms/{n:,}':>10}")
+    for tier, row in report["tiers"].items():
+        print(f"{tier:<10} {'+'.join(row['members']):<20} {row['mae']:>8.3f} {row['ms_1_row']:>9.2f} "
+              f"{row[f'ms_{n}_rows']:>10.1f}")
+    print("\nMAE increase when dropped:", marginal)
+    print(f"✅ Saved {out / TIERS_FILENAME} and {out / REPORT_FILENAME}")
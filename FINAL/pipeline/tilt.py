@@ -0,0 +1,174 @@
+"""
+tilt.py — Tilt curves and optimal tilt search
+---------------------------------------------
+Instead of moving the tilt slider one prediction at a time, score a whole
+0–60° curve for a (city, building type) in one vectorized call and take its
+argmax. The optimum is then refined by zooming in around the best coarse
+tilt: each round scores a small, evenly spaced bracket in one call and
+narrows the bracket around the new best point.
+
+Tree ensembles are piecewise constant in tilt, so the zoom samples densely
+rather than assuming a smooth curve (golden-section search can stall on a
+flat step).
+
+All (city, building type) pairs can be solved together: every round is still
+a single predict_energy_batch call over all pairs. That result is cached per
+(model version, step, rounds, tier). Each search pins one model version for
+all of its rounds, so a hot-swap never mixes two versions in one answer.
+
+Usage example:
+--------------
+>>> from tilt import optimal_tilt
+>>> optimal_tilt("Accra", "commercial")
+{'city': 'Accra', 'building_type': 'commercial', 'optimal_tilt': ..., 'predicted_kWh_per_m2': ..., ...}
+"""
+
+import argparse
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from tiers import DEFAULT_TIER, check_tier
+
+TILT_MIN = 0.0
+TILT_MAX = 60.0
+# Bounds on the coarse step: at most 6,001 points per curve
+STEP_MIN = 0.01
+STEP_MAX = TILT_MAX - TILT_MIN
+
+
+def _tilt_axis(step: float) -> np.ndarray:
+    if not (math.isfinite(step) and STEP_MIN <= step <= STEP_MAX):
+        raise ValueError(f"❌ step must be a number in [{STEP_MIN}, {STEP_MAX}] degrees")
+    n_steps = int(round((TILT_MAX - TILT_MIN) / step))
+    return np.linspace(TILT_MIN, TILT_MAX, n_steps + 1)
+
+
+def _sweep(version, cities, types, tilts: np.ndarray, tier: str) -> np.ndarray:
+    """Score an (M pairs × K tilts) matrix with one predict_energy_batch call."""
+    import predict
+
+    m, k = tilts.shape
+    preds, errors = predict.predict_energy_batch(
+        city=np.repeat(np.asarray(cities, dtype=object), k),
+        building_type=np.repeat(np.asarray(types, dtype=object), k),
+        tilt=tilts.ravel(),
+        tier=tier,
+        return_errors=True,
+        version=version,
+    )
+    bad = next((e for e in errors if e is not None), None)
+    if bad is not None:
+        raise ValueError(bad)
+    return preds.reshape(m, k)
+
+
+def _search(version, cities, types, step: float, rounds: int, points: int, tier: str):
+    """Coarse argmax on the tilt axis, then `rounds` zoom-in rounds (all pairs at once)."""
+    axis = _tilt_axis(step)
+    m = len(cities)
+    curves = _sweep(version, cities, types, np.broadcast_to(axis, (m, len(axis))), tier)
+
+    k = np.argmax(curves, axis=1)
+    best_tilt = axis[k]
+    best_val = curves[np.arange(m), k]
+
+    half = step
+    for _ in range(rounds):
+        lo = np.clip(best_tilt - half, TILT_MIN, TILT_MAX)
+        hi = np.clip(best_tilt + half, TILT_MIN, TILT_MAX)
+        tilts = lo[:, None] + (hi - lo)[:, None] * np.linspace(0.0, 1.0, points)
+        vals = _sweep(version, cities, types, tilts, tier)
+
+        k = np.argmax(vals, axis=1)
+        better = vals[np.arange(m), k] > best_val
+        best_tilt = np.where(better, tilts[np.arange(m), k], best_tilt)
+        best_val = np.where(better, vals[np.arange(m), k], best_val)
+        half = (hi - lo).max() / (points - 1)
+
+    return axis, curves, best_tilt, best_val
+
+
+def tilt_curve(city: str, building_type: str, step: float = 1.0, tier: str = DEFAULT_TIER) -> dict:
+    """Predicted kWh/m² over 0–60° for one (city, building type)."""
+    import predict
+
+    check_tier(tier)
+    axis = _tilt_axis(step)
+    with predict.slot.acquire() as version:
+        curve = _sweep(version, [city], [building_type], axis[None, :], tier)[0]
+    return {
+        "city": city,
+        "building_type": building_type,
+        "tier": tier,
+        "tilts": axis.round(6).tolist(),
+        "predicted_kWh_per_m2": curve.tolist(),
+    }
+
+
+def optimal_tilt(city: str, building_type: str, step: float = 1.0, rounds: int = 3, points: int = 21,
+                 tier: str = DEFAULT_TIER) -> dict:
+    """Best tilt for one (city, building type): coarse argmax refined by zooming in."""
+    import predict
+
+    check_tier(tier)
+    with predict.slot.acquire() as version:
+        axis, curves, best_tilt, best_val = _search(version, [city], [building_type], step, rounds, points, tier)
+    return {
+        "city": city,
+        "building_type": building_type,
+        "tier": tier,
+        "optimal_tilt": round(float(best_tilt[0]), 3),
+        "predicted_kWh_per_m2": round(float(best_val[0]), 3),
+        "flat_kWh_per_m2": round(float(curves[0, 0]), 3),
+        "coarse_step": step,
+    }
+
+
+@lru_cache(maxsize=16)
+def _all_optima(version, step: float, rounds: int, points: int, tier: str) -> tuple:
+    pairs = [(c, t) for c in version.features.cities for t in version.config["BuildingType_categories"]]
+    cities = [c for c, _ in pairs]
+    types = [t for _, t in pairs]
+    _, curves, best_tilt, best_val = _search(version, cities, types, step, rounds, points, tier)
+    return tuple(
+        {
+            "city": c,
+            "building_type": t,
+            "optimal_tilt": round(float(best_tilt[i]), 3),
+            "predicted_kWh_per_m2": round(float(best_val[i]), 3),
+            "flat_kWh_per_m2": round(float(curves[i, 0]), 3),
+        }
+        for i, (c, t) in enumerate(pairs)
+    )
+
+
+def optimal_tilts_all(step: float = 1.0, rounds: int = 3, points: int = 21, tier: str = DEFAULT_TIER) -> list:
+    """optimal_tilt for every city × building type (one call per search round, cached)."""
+    import predict
+
+    check_tier(tier)
+    with predict.slot.acquire() as version:
+        return [dict(r) for r in _all_optima(version, float(step), int(rounds), int(points), tier)]
+
+
+def clear_cache() -> None:
+    _all_optima.cache_clear()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Optimal tilt for every city × building type.")
+    ap.add_argument("--step", type=float, default=1.0, help="Coarse tilt step in degrees")
+    ap.add_argument("--rounds", type=int, default=3, help="Zoom-in refinement rounds")
+    ap.add_argument("--tier", default=DEFAULT_TIER)
+    args = ap.parse_args()
+
+    import time
+
+    t0 = time.perf_counter()
+    results = optimal_tilts_all(step=args.step, rounds=args.rounds, tier=args.tier)
+    print(f"✅ {len(results)} combinations in {time.perf_counter() - t0:.2f}s")
+    for r in results[:10]:
+        print(f"- {r['city']:<18} {r['building_type']:<26} {r['optimal_tilt']:>6.2f}°  "
+              f"{r['predicted_kWh_per_m2']:.1f} kWh/m² (flat {r['flat_kWh_per_m2']:.1f})")
@@ -0,0 +1,42 @@
+"""
+test_batch_io.py — streaming CSV / NDJSON parsing
+-------------------------------------------------
+An over-long data line is that row's error; an over-long CSV header fails
+the whole upload instead of turning the next line into the header.
+
+$ python -m pytest -q FINAL/tests
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "pipeline"))
+import batch_io  # noqa: E402
+
+
+async def _stream(body: bytes, size: int = 7):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+def _records(body: bytes, fmt: str, cap: int = 64):
+    async def run():
+        lines = batch_io.iter_lines(_stream(body), cap)
+        return [item async for item in batch_io.iter_records(lines, fmt)]
+    return asyncio.run(run())
+
+
+def test_long_csv_row_is_a_row_error():
+    body = b"city,building_type,tilt\nAccra,schools,20\nAccra,schools," + b"9" * 100 + b"\nAccra,schools,30\n"
+    rows = _records(body, "csv")
+    assert [(row, err) for row, _, err in rows] == [(0, None), (1, "line longer than 64 bytes"), (2, None)]
+    assert rows[2][1] == {"city": "Accra", "building_type": "schools", "tilt": 30.0}
+
+
+def test_long_csv_header_fails_the_upload():
+    body = b"city,building_type,tilt," + b"x" * 100 + b"\nAccra,schools,20\n"
+    with pytest.raises(ValueError, match="CSV header"):
+        _records(body, "csv")
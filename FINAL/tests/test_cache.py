@@ -0,0 +1,72 @@
+"""
+test_cache.py — prediction cache across model hot-swaps
+-------------------------------------------------------
+A request pinned to the old version that finishes after a swap must not put
+its answer back into the cleared cache, and the ETag must follow the active
+version's files.
+
+$ python -m pytest -q FINAL/tests
+"""
+
+import sys
+import threading
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "pipeline"))
+from cache import PredictionCache  # noqa: E402
+from registry import LoadedVersion, VersionSlot  # noqa: E402
+
+
+class _Store:
+    def release(self):
+        pass
+
+
+def _version(name: str, path: Path) -> LoadedVersion:
+    return LoadedVersion(name, path, None, _Store(), None, None, {})
+
+
+def test_swap_during_inflight_request(tmp_path):
+    slot = VersionSlot(_version("v1", tmp_path / "v1"))
+    cache = PredictionCache([], maxsize=16)
+
+    def on_swap(version):
+        cache.clear(version.generation)
+
+    key = cache.normalize("Accra", "schools", 20.04)
+    pinned, swapped = threading.Event(), threading.Event()
+
+    def old_request():
+        with slot.acquire() as version:
+            pinned.set()
+            swapped.wait(5)
+            cache.put((version.name, *key), "old-model answer", version.generation)
+
+    t = threading.Thread(target=old_request)
+    t.start()
+    assert pinned.wait(5)
+
+    old = slot.swap(_version("v2", tmp_path / "v2"))
+    on_swap(slot.current)
+    assert not old.released.is_set()     # still serving the in-flight call
+    swapped.set()
+    t.join(5)
+
+    assert old.released.is_set()
+    assert cache.get(("v1", *key)) is None
+    assert cache.stats()["stale_puts"] == 1
+
+    # Calls under the new version still fill the cache
+    cache.put(("v2", *key), "new-model answer", slot.current.generation)
+    assert cache.get(("v2", *key)) == "new-model answer"
+
+
+def test_etag_follows_watched_version(tmp_path):
+    for name in ("v1", "v2"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "meta_model.pkl").write_bytes(name.encode() * 10)
+
+    cache = PredictionCache([tmp_path / "v1" / "meta_model.pkl"])
+    before = cache.etag("/predict", "Accra")
+    cache.watch([tmp_path / "v2" / "meta_model.pkl"])
+    assert cache.etag("/predict", "Accra") != before
@@ -0,0 +1,118 @@
+"""
+test_compiled.py — compiled.py matches the native models
+--------------------------------------------------------
+Small RF / ET / XGBoost / LightGBM models are fitted on synthetic data shaped
+like the training set (numeric features + BuildingType code) and the flat
+evaluator is compared with each library's own predict(), including NaN
+inputs and LightGBM's categorical BuildingType splits.
+
+$ python -m pytest -q FINAL/tests
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "pipeline"))
+import compiled  # noqa: E402
+
+NUM = ["tilt", "GHI_kWh_per_m2_day", "AvgTemp_C", "Precip_mm_per_day"]
+FEATURES = NUM + ["BuildingType"]
+N_TYPES = 10
+
+
+def _data(n: int, seed: int, nan_rate: float = 0.0):
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([
+        rng.uniform(0, 60, n),
+        rng.uniform(3, 7, n),
+        rng.normal(25, 5, n),
+        # Exact zeros for LightGBM's zero_as_missing routing
+        np.where(rng.random(n) < 0.2, 0.0, rng.exponential(3, n)),
+        rng.integers(0, N_TYPES, n).astype(float),
+    ])
+    type_effect = np.array([0.0, 0.8, -0.5, 1.2, 0.1, -1.0, 0.6, -0.2, 0.9, -0.7])
+    y = (np.cos(np.radians(X[:, 0] - 20)) * X[:, 1] + 0.02 * X[:, 2] - 0.05 * X[:, 3]
+         + type_effect[X[:, 4].astype(int)] + rng.normal(0, 0.05, n))
+    if nan_rate:
+        for j in (1, 3):
+            X[rng.random(n) < nan_rate, j] = np.nan
+    return X, y
+
+
+def _frame(X: np.ndarray, categorical: bool) -> pd.DataFrame:
+    df = pd.DataFrame(X[:, :len(NUM)], columns=NUM)
+    codes = X[:, -1]
+    if categorical:
+        df["BuildingType"] = pd.Categorical.from_codes(np.where(np.isnan(codes), -1, codes).astype(int),
+                                                       categories=[f"type{i}" for i in range(N_TYPES)])
+    else:
+        df["BuildingType"] = codes
+    return df
+
+
+@pytest.fixture(scope="module")
+def train():
+    return _data(3000, seed=0)
+
+
+@pytest.fixture(scope="module")
+def train_nan():
+    return _data(3000, seed=1, nan_rate=0.1)
+
+
+@pytest.fixture(scope="module")
+def probe():
+    X, _ = _data(2000, seed=2, nan_rate=0.1)
+    X[::7, 0] = np.nan        # NaN in a feature that had none at fit time
+    X[::11, 1] = 0.0
+    X[5::13, 3] = np.nan
+    return X
+
+
+@pytest.mark.parametrize("name", ["rf", "et"])
+def test_sklearn_forest(name, train):
+    from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor
+
+    cls = RandomForestRegressor if name == "rf" else ExtraTreesRegressor
+    X, y = train
+    model = cls(n_estimators=20, min_samples_leaf=3, random_state=0, n_jobs=1).fit(_frame(X, False), y)
+    forest = compiled.export_sklearn_forest(model, FEATURES)
+
+    X_test, _ = _data(2000, seed=3)
+    expected = model.predict(_frame(X_test, False))
+    np.testing.assert_allclose(forest.predict(X_test), expected, rtol=0, atol=1e-9)
+
+
+def test_xgboost(train_nan, probe):
+    from xgboost import XGBRegressor
+
+    X, y = train_nan
+    model = XGBRegressor(n_estimators=60, max_depth=5, learning_rate=0.1, subsample=0.8,
+                         random_state=0, n_jobs=1).fit(_frame(X, False), y)
+    forest = compiled.export_xgboost(model, FEATURES)
+
+    expected = model.predict(_frame(probe, False))
+    assert np.isnan(probe).any()
+    np.testing.assert_allclose(forest.predict(probe), expected, rtol=0, atol=1e-5)
+
+
+@pytest.mark.parametrize("zero_as_missing", [False, True])
+def test_lightgbm(zero_as_missing, train_nan, probe):
+    from lightgbm import LGBMRegressor
+
+    X, y = train_nan
+    model = LGBMRegressor(n_estimators=80, num_leaves=15, learning_rate=0.1, min_child_samples=10,
+                          min_data_per_group=5, cat_smooth=1.0, zero_as_missing=zero_as_missing,
+                          random_state=0, n_jobs=1, verbose=-1)
+    model.fit(_frame(X, True), y)
+    forest = compiled.export_lightgbm(model, FEATURES)
+
+    assert forest.has_cat, "expected categorical BuildingType splits"
+    missing = compiled.MISSING_ZERO if zero_as_missing else compiled.MISSING_NAN
+    assert (forest.missing_type == missing).any()
+    expected = model.predict(_frame(probe, True))
+    np.testing.assert_allclose(forest.predict(probe), expected, rtol=0, atol=1e-9)
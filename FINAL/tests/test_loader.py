@@ -0,0 +1,45 @@
+"""
+test_loader.py — ModelStore lifecycle
+-------------------------------------
+A released store (retired model version) must refuse to load artifacts
+again instead of silently pulling every model back into memory.
+
+$ python -m pytest -q FINAL/tests
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "pipeline"))
+from loader import ModelStore  # noqa: E402
+
+
+def _store(tmp_path, loads):
+    (tmp_path / "blob.txt").write_text("weights")
+
+    def load(path, mmap_mode=None):
+        loads.append(path.name)
+        return path.read_text()
+
+    store = ModelStore(tmp_path)
+    store.register("blob", "blob.txt", load)
+    store.require(["blob"])
+    return store
+
+
+def test_get_after_release_raises(tmp_path):
+    loads = []
+    store = _store(tmp_path, loads)
+    assert store.get("blob") == "weights"
+    assert store.ready.is_set()
+
+    store.release()
+    assert not store.ready.is_set()
+    with pytest.raises(RuntimeError, match="released"):
+        store.get("blob")
+    with pytest.raises(RuntimeError, match="released"):
+        store.load_all(parallel=False)
+    assert loads == ["blob.txt"]
+    assert store.report()["released"]
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+# ingest_rooftops.py
+# Streaming, parallel replacement for data_standardization/clean_og_solar_v2.ipynb.
+# Per city file (on a process pool):
+#   - read the raw CSV in chunks with explicit compact dtypes (float32 numerics, category City),
+#   - standardize column names, map building types via building_types_mapping.txt to the int codes,
+#   - drop rows with a null in any of the 7 kept columns,
+#   - write parquet/<name>.parquet (zstd, row groups + statistics) and csv/<name>.csv chunk by chunk,
+#     plus one spool file per City × building type, all to temp files,
+#   - write the City × building-type partitioned dataset (<out>/rooftops, see FINAL/pipeline/rooftops.py)
+#     one partition at a time from the spool files,
+#   - only then replace the outputs; a file with unmapped building types leaves its old outputs untouched
+#     (unless --allow-unmapped).
+# Then the combined all_cities_clean.{parquet,csv}, building_type_encoding.json and _manifest.json
+# (same format as the notebook) are assembled from the per-city files, and wall time / peak memory
+# are reported in _ingest_report.json.
+# Usage:
+#   python ingest_rooftops.py --src ../../original_datasets --out ../cleaned_datasets --jobs 4
+
+import argparse, json, os, re, resource, shutil, sys, time
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+REPO = Path(__file__).resolve().parents[2]
+sys.path.append(str(REPO / "FINAL" / "pipeline"))
+import rooftops  # noqa: E402
+
+FILE_GLOB = "*rooftop*solar*"
+COLUMNS = [
+    "City",
+    "Surface_area",
+    "Potential_installable_area",
+    "Peak_installable_capacity",
+    "Energy_potential_per_year",
+    "Assumed_building_type",
+    "Estimated_tilt",
+]
+NUM_COLUMNS = [c for c in COLUMNS if c not in {"City", "Assumed_building_type"}]
+SCHEMA = pa.schema([("City", pa.string())]
+                   + [(c, pa.float32()) for c in NUM_COLUMNS[:4]]
+                   + [("Assumed_building_type", pa.int8()), ("Estimated_tilt", pa.float32())])
+ROW_GROUP_ROWS = 128_000
+
+
+def norm_column(name) -> str:
+    return re.sub(r"\s+", "_", str(name).strip())
+
+
+def norm_label(s: pd.Series) -> pd.Series:
+    return s.astype("string").str.strip().str.lower().str.replace(r"\s+", " ", regex=True)
+
+
+def label_key(label) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(label).lower())
+
+
+def read_type_mapping(path: Path) -> dict:
+    """
+    normalized raw label -> int code.
+    building_types_mapping.txt lines look like "5 → public / public sector";
+    a notebook-style CSV (raw_label, canonical_label) is accepted too.
+    """
+    mapping = {}
+    if path.suffix.lower() == ".csv":
+        m = pd.read_csv(path)
+        m = m[m["canonical_label"].notna() & (m["canonical_label"].astype(str).str.strip() != "")]
+        for raw, canon in zip(m["raw_label"], m["canonical_label"]):
+            mapping[label_key(raw)] = int(float(canon))
+    else:
+        for line in path.read_text(encoding="utf-8").splitlines():
+            match = re.match(r"\s*(\d+)\s*(?:→|->|:)\s*(.+)", line)
+            if not match:
+                continue
+            code = int(match.group(1))
+            for label in match.group(2).split("/"):
+                mapping[label_key(label)] = code
+    if not mapping:
+        raise ValueError(f"No building-type mapping found in {path}")
+    # The codes themselves (already-encoded datasets) map to themselves
+    for code in set(mapping.values()):
+        mapping.setdefault(str(code), code)
+    return mapping
+
+
+def read_chunks(path: Path, chunk_rows: int, coerce: bool = False):
+    """
+    Raw chunks with standardized column names and compact dtypes (only the kept columns are parsed).
+    coerce=True parses numerics as text first and turns junk into NaN (pd.to_numeric(errors="coerce"),
+    as the notebook did) - slower, only used when the fast typed read fails.
+    """
+    header = pd.read_csv(path, nrows=0).columns
+    raw_names = {c: norm_column(c) for c in header if norm_column(c) in COLUMNS}
+    dtypes = {raw: ("category" if name == "City" else "string" if name == "Assumed_building_type"
+                    else "string" if coerce else "float32")
+              for raw, name in raw_names.items()}
+    for chunk in pd.read_csv(path, usecols=list(raw_names), dtype=dtypes, chunksize=chunk_rows):
+        chunk = chunk.rename(columns=raw_names)
+        if coerce:
+            for c in NUM_COLUMNS:
+                if c in chunk.columns:
+                    chunk[c] = pd.to_numeric(chunk[c], errors="coerce").astype("float32")
+        yield chunk
+
+
+def map_types(labels: pd.Series, mapping: dict):
+    """int codes (NaN where unmapped) + {unmapped label: rows}; each distinct label is looked up once."""
+    labels = norm_label(labels)
+    lookup = {}
+    for u in labels.dropna().unique():
+        key = label_key(u)
+        if key not in mapping and re.fullmatch(r"\d+\.0+", u):   # "2.0" from a float-typed column
+            key = u.split(".")[0]
+        lookup[u] = mapping.get(key)
+    unmapped = {u: int((labels == u).sum()) for u, code in lookup.items() if code is None}
+    return pd.to_numeric(labels.map(lookup), errors="coerce"), unmapped
+
+
+def clean_chunk(chunk: pd.DataFrame, city: str, mapping: dict):
+    """Standardized chunk with the 7 kept columns, plus (null-dropped rows, unmapped labels)."""
+    if "City" not in chunk.columns:
+        chunk["City"] = city
+    for c in COLUMNS:
+        if c not in chunk.columns:
+            chunk[c] = pd.Series(np.nan, index=chunk.index, dtype="float32")
+    chunk["City"] = chunk["City"].astype("string").str.strip()
+    chunk["Assumed_building_type"], unmapped = map_types(chunk["Assumed_building_type"], mapping)
+
+    keep = chunk[COLUMNS].notna().all(axis=1).to_numpy()
+    chunk = chunk.loc[keep, COLUMNS].astype({"City": str, "Assumed_building_type": "int8"})
+    return chunk, int((~keep).sum()), unmapped
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _ingest_pass(path: Path, out: Path, city: str, mapping: dict, chunk_rows: int, write_csv: bool, coerce: bool,
+                 spool: Path):
+    """
+    Stream one city file into the temp parquet/csv and into spool/<i>.parquet, one spool file per
+    (City, building type), so no more than a chunk is held in memory. Returns (stats, spool files).
+    """
+    name = path.stem
+    tmp_parquet = out / "parquet" / f"{name}.parquet.tmp"
+    tmp_csv = out / "csv" / f"{name}.csv.tmp"
+    stats = {"rows_in": 0, "dropped_null_rows": 0, "unmapped_labels": {}}
+    shutil.rmtree(spool, ignore_errors=True)
+    spool.mkdir(parents=True)
+    spooled = {}
+    with ExitStack() as stack:
+        writer = stack.enter_context(pq.ParquetWriter(tmp_parquet, SCHEMA, compression="zstd",
+                                                      write_statistics=True))
+        if write_csv:
+            pd.DataFrame(columns=COLUMNS).to_csv(tmp_csv, index=False)
+        for chunk in read_chunks(path, chunk_rows, coerce):
+            stats["rows_in"] += len(chunk)
+            chunk, dropped, unmapped = clean_chunk(chunk, city, mapping)
+            stats["dropped_null_rows"] += dropped
+            for label, n in unmapped.items():
+                stats["unmapped_labels"][label] = stats["unmapped_labels"].get(label, 0) + n
+            writer.write_table(pa.Table.from_pandas(chunk, schema=SCHEMA, preserve_index=False),
+                               row_group_size=ROW_GROUP_ROWS)
+            if write_csv:
+                chunk.to_csv(tmp_csv, mode="a", header=False, index=False)
+            for key, part in chunk.groupby(rooftops.PARTITION_COLUMNS, sort=False):
+                if key not in spooled:
+                    spooled[key] = stack.enter_context(pq.ParquetWriter(spool / f"{len(spooled)}.parquet", SCHEMA))
+                spooled[key].write_table(pa.Table.from_pandas(part, schema=SCHEMA, preserve_index=False))
+    return stats, sorted(spool.glob("*.parquet"))
+
+
+def _discard(paths) -> None:
+    for p in paths:
+        if p.is_dir():
+            shutil.rmtree(p, ignore_errors=True)
+        else:
+            p.unlink(missing_ok=True)
+
+
+def ingest_file(path: Path, out: Path, mapping: dict, chunk_rows: int, write_csv: bool, partitioned: Path,
+                allow_unmapped: bool = False) -> dict:
+    t0 = time.time()
+    name = path.stem
+    city = re.sub(r"_rooftop_?solar_?potential$", "", name)
+    p_parquet = out / "parquet" / f"{name}.parquet"
+    p_csv = out / "csv" / f"{name}.csv"
+    spool = out / "parquet" / f"{name}.spool"
+    tmp_files = [p_parquet.with_name(p_parquet.name + ".tmp"), p_csv.with_name(p_csv.name + ".tmp"), spool]
+    try:
+        try:
+            stats, spooled = _ingest_pass(path, out, city, mapping, chunk_rows, write_csv, False, spool)
+        except ValueError:
+            print(f"⚠️ {path.name}: non-numeric values in a numeric column, re-reading with coercion")
+            stats, spooled = _ingest_pass(path, out, city, mapping, chunk_rows, write_csv, True, spool)
+        result = {
+            "dataset": name,
+            **stats,
+            "rows": 0,
+            "partitions": 0,
+            "parquet": None,
+            "csv": None,
+        }
+
+        # Unmapped building types fail the run (see main): keep this file's previous outputs
+        if stats["unmapped_labels"] and not allow_unmapped:
+            return {**result, "seconds": round(time.time() - t0, 2), "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+        # One (City, building type) partition in memory at a time for the sorted partition write
+        for stale in partitioned.glob(f"*/*/part-{name}.parquet"):
+            stale.unlink()
+        for f in spooled:
+            part = pq.read_table(f)
+            result["rows"] += part.num_rows
+            result["partitions"] += len(rooftops.write_partitioned(part, partitioned, basename=f"part-{name}"))
+            del part
+        if not spooled:
+            rooftops.write_schema(partitioned, SCHEMA)
+
+        tmp_files[0].replace(p_parquet)
+        result["parquet"] = str(p_parquet)
+        if write_csv:
+            tmp_files[1].replace(p_csv)
+            result["csv"] = str(p_csv)
+    finally:
+        _discard(tmp_files)
+    return {**result, "seconds": round(time.time() - t0, 2), "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def combine(results: list, out: Path, write_csv: bool) -> tuple:
+    """all_cities_clean.{parquet,csv} streamed from the per-city files (never more than one row group in memory)."""
+    p_parquet = out / "all_cities_clean.parquet"
+    p_csv = out / "all_cities_clean.csv"
+    with pq.ParquetWriter(p_parquet.with_name(p_parquet.name + ".tmp"), SCHEMA, compression="zstd",
+                          write_statistics=True) as writer:
+        for r in results:
+            f = pq.ParquetFile(r["parquet"])
+            for i in range(f.num_row_groups):
+                writer.write_table(f.read_row_group(i), row_group_size=ROW_GROUP_ROWS)
+    p_parquet.with_name(p_parquet.name + ".tmp").replace(p_parquet)
+    if write_csv:
+        with open(p_csv.with_name(p_csv.name + ".tmp"), "wb") as dst:
+            dst.write((",".join(COLUMNS) + "\n").encode())
+            for r in results:
+                with open(r["csv"], "rb") as src:
+                    src.readline()
+                    while block := src.read(1 << 24):
+                        dst.write(block)
+        p_csv.with_name(p_csv.name + ".tmp").replace(p_csv)
+    return p_parquet, p_csv
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--src", type=Path, default=REPO / "original_datasets", help="Folder with the raw city CSVs")
+    ap.add_argument("--out", type=Path, default=REPO / "OG_approach_failed" / "cleaned_datasets")
+    ap.add_argument("--mapping", type=Path,
+                    default=REPO / "OG_approach_failed" / "data_standardization" / "building_types_mapping.txt",
+                    help="building_types_mapping.txt, or a raw_label,canonical_label CSV")
+    ap.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    ap.add_argument("--chunk-rows", type=int, default=250_000)
+    ap.add_argument("--no-csv", action="store_true", help="Skip the CSV copies")
+    ap.add_argument("--allow-unmapped", action="store_true",
+                    help="Drop rows with unmapped building types instead of failing")
+    args = ap.parse_args()
+    args.out = args.out.resolve()
+
+    t0 = time.time()
+    files = sorted(p for p in args.src.glob(FILE_GLOB) if p.suffix.lower() == ".csv")
+    if not files:
+        raise SystemExit(f"No {FILE_GLOB}.csv files in {args.src}")
+    mapping = read_type_mapping(args.mapping)
+    write_csv = not args.no_csv
+    partitioned = args.out / "rooftops"
+    for d in (args.out / "parquet", args.out / "csv", partitioned):
+        d.mkdir(parents=True, exist_ok=True)
+
+    print(f"Found {len(files)} files, {args.jobs} worker(s)")
+    results = []
+    # Largest files first so the pool is not left waiting on one big city at the end
+    order = sorted(files, key=lambda p: p.stat().st_size, reverse=True)
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(ingest_file, f, args.out, mapping, args.chunk_rows, write_csv, partitioned,
+                               args.allow_unmapped): f
+                   for f in order}
+        for fut in as_completed(futures):
+            r = fut.result()
+            results.append(r)
+            if r["parquet"] is None:
+                print(f"⚠️ {r['dataset']}: unmapped building types, outputs left unchanged")
+                continue
+            print(f"- {r['dataset']}: {r['rows_in']:,} → {r['rows']:,} rows "
+                  f"({r['dropped_null_rows']:,} null-dropped), {r['partitions']} partitions, {r['seconds']}s")
+    results.sort(key=lambda r: r["dataset"])
+
+    unmapped = {}
+    for r in results:
+        for label, n in r["unmapped_labels"].items():
+            unmapped[label] = unmapped.get(label, 0) + n
+    if unmapped:
+        msg = f"{sum(unmapped.values()):,} rows with unmapped building types: {unmapped}"
+        if not args.allow_unmapped:
+            raise RuntimeError(msg + f". Add them to {args.mapping} and re-run (or pass --allow-unmapped).")
+        print(f"⚠️ {msg} (dropped)")
+
+    p_parquet, p_csv = combine(results, args.out, write_csv)
+    codes = sorted(set(mapping.values()))
+    encoding_json = args.out / "building_type_encoding.json"
+    encoding_json.write_text(json.dumps({"int2canon": {str(c): str(c) for c in codes},
+                                         "canon2int": {str(c): c for c in codes}}, indent=2))
+
+    manifest_path = args.out / "_manifest.json"
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "columns": COLUMNS,
+            "total_rows": int(sum(r["rows"] for r in results)),
+            "per_dataset": [{"dataset": r["dataset"], "rows": r["rows"], "parquet": r["parquet"], "csv": r["csv"]}
+                            for r in results],
+            "combined": {"parquet": str(p_parquet), "csv": str(p_csv) if write_csv else None},
+            "encoding": str(encoding_json),
+        }, f, indent=2)
+
+    wall = time.time() - t0
+    peak = max(peak_rss_mb(), peak_rss_mb(resource.RUSAGE_CHILDREN))
+    report = {
+        "files": len(results),
+        "jobs": args.jobs,
+        "chunk_rows": args.chunk_rows,
+        "rows_in": int(sum(r["rows_in"] for r in results)),
+        "rows_out": int(sum(r["rows"] for r in results)),
+        "wall_seconds": round(wall, 2),
+        "peak_rss_mb": round(peak, 1),
+        "per_dataset": [{k: r[k] for k in ("dataset", "rows_in", "rows", "dropped_null_rows", "seconds",
+                                           "peak_rss_mb")} for r in results],
+    }
+    with open(args.out / "_ingest_report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print("Ingestion done.")
+    print(f"- Rows: {report['rows_in']:,} read → {report['rows_out']:,} kept")
+    print(f"- Wall time: {wall:.1f}s, peak memory: {peak:.0f} MB (largest single process)")
+    print(f"- Partitioned dataset: {partitioned}")
+    print(f"- Manifest: {manifest_path}")
+
+
+if __name__ == "__main__":
+    main()
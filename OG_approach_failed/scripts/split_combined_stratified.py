@@ -1,129 +1,296 @@
 #!/usr/bin/env python
 # split_combined_stratified.py
 # One global train/test split, stratified by (City × Assumed_building_type), robust to rare strata.
+# Reads the partitioned dataset written by ingest_rooftops.py (or a combined parquet / csv) through
+# FINAL/pipeline/rooftops.py; --cities / --types restrict the split to a subset without reading the rest.
+# Stratification works on integer codes: key = city_code * (n_types + 1) + type_code, rare strata collapse
+# to their city's RARE slot (type_code = n_types) with one bincount, and each stratum is split by a seeded
+# permutation (test rows per stratum = floor(n * test_size), the remainder up to ceil(N * test_size) going to
+# the strata with the largest fractional share, never taking a stratum's last train row; if no stratum can spare
+# one, the test set stays short and a warning is printed). Several --seeds and --folds K (stratified k-fold) variants are
+# computed from the same keys and written in one pass over the data, as streamed row groups
+# (or, with --mode index, as row-run manifests read by FINAL/pipeline/splits.py).
 # Usage:
-#   python split_combined_stratified.py --input cleaned_datasets/all_cities_clean.parquet --outdir splits/combined_stratified_city_type --test-size 0.2 --seed 404 --write-csv
+#   python split_combined_stratified.py --input cleaned_datasets/rooftops --outdir splits/combined_stratified_city_type --test-size 0.2 --seed 404 --write-csv
+#   python split_combined_stratified.py --input cleaned_datasets/rooftops --outdir splits/combined_kfold --seeds 404 405 406 --folds 5 --mode index
 
-import argparse, json, math, hashlib
+import argparse, json, math, os, sys, time
 from pathlib import Path
-import pandas as pd
-from sklearn.model_selection import train_test_split
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
-def sha1(path: Path) -> str:
-    h = hashlib.sha1()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1 << 20), b""):
-            h.update(chunk)
-    return h.hexdigest()
+REPO = Path(__file__).resolve().parents[2]
+sys.path.append(str(REPO / "FINAL" / "pipeline"))
+import rooftops  # noqa: E402
+import splits  # noqa: E402
+import stages  # noqa: E402
+
+ROW_GROUP_ROWS = 128_000
+
+STAGE_VERSION = 3  # bump when the split logic changes, so cached results are recomputed
+
+def load_table(path: Path, cities=None, types=None) -> pa.Table:
+    if path.suffix.lower() == ".csv":
+        return pa.Table.from_pandas(rooftops.read(path, cities=cities, types=types), preserve_index=False)
+    return rooftops.load(path, cities=cities, types=types, as_arrow=True)
+
+def codes(column) -> tuple:
+    """(int64 codes, labels) with codes assigned in sorted label order, so they do not depend on row order."""
+    encoded = pc.dictionary_encode(column).combine_chunks() if not pa.types.is_dictionary(column.type) \
+        else column.combine_chunks()
+    labels = [str(v) for v in encoded.dictionary.to_pylist()]
+    rank = np.empty(len(labels), dtype=np.int64)
+    rank[np.argsort(labels, kind="stable")] = np.arange(len(labels))
+    idx = encoded.indices.to_numpy(zero_copy_only=False).astype(np.int64)
+    return rank[idx], sorted(labels)
+
+# === Strata ===
+def strata(city_codes, type_codes, n_types, min_count):
+    """(key, n_keys, used_key): City × type key with rare strata collapsed into '<city> | RARE'."""
+    width = n_types + 1                        # type_code == n_types is the city's RARE slot
+    key = city_codes * width + type_codes
+    n_keys = int(city_codes.max() + 1) * width if len(key) else 0
+    counts = np.bincount(key, minlength=n_keys)
+    rare = (counts > 0) & (counts < min_count)
+    if not rare.any():
+        return key, n_keys, "_city_type"
+    collapsed = np.where(rare[key], city_codes * width + n_types, key)
+    # Verify collapsed buckets now large enough
+    counts = np.bincount(collapsed, minlength=n_keys)
+    if (counts[counts > 0] >= min_count).all():
+        return collapsed, n_keys, "_strat"
+    return np.zeros(len(key), dtype=np.int64), 1, None
+
+def _stratum_ranks(key, n_keys, rng):
+    """Rows grouped by stratum in seeded random order: (order, rank of order[i] within its stratum, counts)."""
+    perm = rng.permutation(len(key))
+    order = perm[np.argsort(key[perm], kind="stable")]
+    counts = np.bincount(key, minlength=n_keys)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.arange(len(key)) - np.repeat(starts, counts)
+    return order, rank, counts
+
+def holdout_mask(key, n_keys, test_size, seed):
+    """Boolean test mask with a per-stratum seeded permutation."""
+    rng = np.random.default_rng(seed)
+    order, rank, counts = _stratum_ranks(key, n_keys, rng)
+    exact = counts * test_size
+    n_test = np.floor(exact).astype(np.int64)
+    short = math.ceil(len(key) * test_size) - int(n_test.sum())
+    tiebreak = rng.random(n_keys)
+    while short > 0:
+        # Only strata that keep a train row after one more test row; largest fractional share first,
+        # ties broken by the seed. More rows than eligible strata: another round over the ones left.
+        eligible = np.flatnonzero(counts > n_test + 1)
+        if not len(eligible):
+            print(f"⚠️ Test set {short:,} row(s) short of test_size: every stratum is down to one train row")
+            break
+        pick = eligible[np.lexsort((tiebreak[eligible], -(exact - n_test)[eligible]))[:short]]
+        n_test[pick] += 1
+        short -= len(pick)
+    mask = np.zeros(len(key), dtype=bool)
+    mask[order[rank < np.repeat(n_test, counts)]] = True
+    return mask
+
+def kfold_ids(key, n_keys, k, seed):
+    """Fold id per row: consecutive ranks of each permuted stratum cycle through the folds."""
+    rng = np.random.default_rng(seed)
+    order, rank, counts = _stratum_ranks(key, n_keys, rng)
+    offset = rng.integers(0, k, n_keys)        # which fold gets a stratum's remainder rows
+    ids = np.empty(len(key), dtype=np.int16)
+    ids[order] = (rank + np.repeat(offset, counts)) % k
+    return ids
+
+def variants(key, n_keys, seeds, test_size, folds):
+    """{name: test mask} for every seed (and fold)."""
+    out = {}
+    for seed in seeds:
+        if folds:
+            ids = kfold_ids(key, n_keys, folds, seed)
+            for f in range(folds):
+                out[f"seed{seed}_fold{f}"] = ids == f
+        else:
+            out[f"seed{seed}"] = holdout_mask(key, n_keys, test_size, seed)
+    return out
+
+def share_diff(key, n_keys, mask) -> float:
+    """Median abs diff of stratum shares between train and test (strata present in both)."""
+    tr = np.bincount(key[~mask], minlength=n_keys)
+    te = np.bincount(key[mask], minlength=n_keys)
+    common = (tr > 0) & (te > 0)
+    if not common.any():
+        return float("nan")
+    return float(np.median(np.abs(tr[common] / tr.sum() - te[common] / te.sum())))
+
+# === Output ===
+def write_variants(table: pa.Table, masks: dict, dirs: dict, write_csv: bool) -> dict:
+    """
+    One pass over the rows: every row group is filtered into every variant's train / test writers.
+    Returns {variant: {manifest checksum field: output path}}.
+    """
+    writers = {}
+    for name, d in dirs.items():
+        d.mkdir(parents=True, exist_ok=True)
+        for part in ("train", "test"):
+            writers[name, part] = pq.ParquetWriter(d / f"{part}_combined.parquet", table.schema)
+            if write_csv:
+                table.slice(0, 0).to_pandas().to_csv(d / f"{part}_combined.csv", index=False)
+    try:
+        offset = 0
+        for batch in table.to_batches(max_chunksize=ROW_GROUP_ROWS):
+            n = batch.num_rows
+            for name, mask in masks.items():
+                m = pa.array(mask[offset:offset + n])
+                for part, sel in (("test", m), ("train", pc.invert(m))):
+                    rows = batch.filter(sel)
+                    writers[name, part].write_batch(rows)
+                    if write_csv and rows.num_rows:
+                        rows.to_pandas().to_csv(dirs[name] / f"{part}_combined.csv", mode="a", header=False, index=False)
+            offset += n
+    finally:
+        for w in writers.values():
+            w.close()
+
+    outputs = {}
+    for name, d in dirs.items():
+        c = {"train_parquet_sha1": d / "train_combined.parquet",
+             "test_parquet_sha1": d / "test_combined.parquet"}
+        if write_csv:
+            c.update({"train_csv_sha1": d / "train_combined.csv",
+                      "test_csv_sha1": d / "test_combined.csv"})
+        outputs[name] = c
+    return outputs
 
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--input", required=True, type=Path, help="Combined canonical dataset (parquet or csv)")
+    ap.add_argument("--input", required=True, type=Path, help="Partitioned dataset dir (ingest_rooftops.py) or combined parquet / csv")
     ap.add_argument("--outdir", required=True, type=Path, help="Output folder")
     ap.add_argument("--test-size", type=float, default=0.2)
     ap.add_argument("--seed", type=int, default=404)
+    ap.add_argument("--seeds", type=int, nargs="+", default=None, help="Several seeds in one pass (overrides --seed)")
+    ap.add_argument("--folds", type=int, default=0, help="Stratified k-fold instead of one holdout (test = each fold)")
+    ap.add_argument("--mode", choices=["files", "index"], default="files",
+                    help="files: train/test parquet per variant; index: row-run manifest only (splits.Folds)")
     ap.add_argument("--write-csv", action="store_true")
+    ap.add_argument("--cities", nargs="+", default=None, help="Only split these cities")
+    ap.add_argument("--types", nargs="+", default=None, help="Only split these building types (codes or names)")
+    ap.add_argument("--force", action="store_true", help="Recompute even if the stage cache has this result")
     args = ap.parse_args()
 
-    # Load
-    if args.input.suffix.lower() == ".parquet":
-        df = pd.read_parquet(args.input)
-    else:
-        df = pd.read_csv(args.input)
+    # Stage cache: same input content + parameters + STAGE_VERSION -> reuse the outputs as they are
+    t0 = time.time()
+    seeds = args.seeds or [args.seed]
+    stage = stages.Stage("split_combined_stratified", STAGE_VERSION, [args.input], {
+        "test_size": args.test_size, "seeds": seeds, "folds": args.folds, "mode": args.mode,
+        "cities": args.cities, "types": args.types, "write_csv": args.write_csv,
+    }, args.outdir, "manifest_combined.json")
+    if not args.force and stage.hit():
+        print(f"✅ Cache hit ({stage.key[:12]}): {args.outdir} is up to date, nothing to do.")
+        return
+
+    # Load (City / type filters are pushed down to the partitioned dataset)
+    table = load_table(args.input, cities=args.cities, types=args.types)
 
     for col in ["City", "Assumed_building_type"]:
-        if col not in df.columns:
+        if col not in table.column_names:
             raise ValueError(f"Missing required column: {col}")
+    if args.folds == 1 or args.folds < 0:
+        raise ValueError("--folds must be 0 (holdout) or >= 2")
+    if args.mode == "index" and (args.input.suffix.lower() == ".csv" or args.cities or args.types):
+        raise ValueError("--mode index needs the full Parquet file or partitioned dataset as --input")
 
-    df = df.copy()
-    df["_city_type"] = df["City"].astype(str) + " | " + df["Assumed_building_type"].astype(str)
+    city_codes, _ = codes(table.column("City"))
+    type_codes, type_labels = codes(table.column("Assumed_building_type"))
 
     # Rare strata guard
     p = args.test_size
-    min_count = max(math.ceil(1/p), math.ceil(1/(1-p)))  # need ≥1 sample for both sets
-    counts = df["_city_type"].value_counts()
-    rare_keys = set(counts[counts < min_count].index)
-
-    if rare_keys:
-        def collapse_rare(s):
-            city, typ = s.split(" | ", 1)
-            return f"{city} | RARE" if s in rare_keys else s
-        df["_strat"] = df["_city_type"].apply(collapse_rare)
-        # Verify collapsed buckets now large enough
-        ok = (df["_strat"].value_counts() >= min_count).all()
-        stratify = df["_strat"] if ok else None
-        used_key = "_strat" if ok else None
+    if args.folds:
+        min_count = args.folds                 # ≥1 sample in every fold
     else:
-        stratify = df["_city_type"]
-        used_key = "_city_type"
-
-    # Split (deterministic)
-    train_df, test_df = train_test_split(
-        df,
-        test_size=args.test_size,
-        random_state=args.seed,
-        stratify=stratify
-    )
-
-    # Write
-    outdir = args.outdir
-    outdir.mkdir(parents=True, exist_ok=True)
-
-    drop_cols = [c for c in ["_city_type", "_strat"] if c in df.columns]
-    train_out = train_df.drop(columns=drop_cols, errors="ignore")
-    test_out  = test_df.drop(columns=drop_cols, errors="ignore")
-
-    p_train = outdir / "train_combined.parquet"
-    p_test  = outdir / "test_combined.parquet"
-    train_out.to_parquet(p_train, index=False)
-    test_out.to_parquet(p_test, index=False)
+        min_count = max(math.ceil(1/p), math.ceil(1/(1-p)))  # need ≥1 sample for both sets
+    key, n_keys, used_key = strata(city_codes, type_codes, len(type_labels), min_count)
 
-    checksums = {
-        "train_parquet_sha1": sha1(p_train),
-        "test_parquet_sha1": sha1(p_test),
-    }
+    masks = variants(key, n_keys, seeds, p, args.folds)
+    single = len(masks) == 1 and args.mode == "files"
 
-    if args.write_csv:
-        c_train = outdir / "train_combined.csv"
-        c_test  = outdir / "test_combined.csv"
-        train_out.to_csv(c_train, index=False)
-        test_out.to_csv(c_test, index=False)
-        checksums.update({
-            "train_csv_sha1": sha1(c_train),
-            "test_csv_sha1": sha1(c_test),
-        })
-
-    # Manifest + tiny distribution check
-    manifest = {
+    outdir = args.outdir
+    outdir.mkdir(parents=True, exist_ok=True)
+    base = {
         "source_file": args.input.as_posix(),
-        "strategy": "combined_stratified_city_type",
-        "test_size": args.test_size,
-        "seed": args.seed,
-        "rows_total": int(len(df)),
-        "train_rows": int(len(train_df)),
-        "test_rows": int(len(test_df)),
-        "stratify_key": used_key or "FALLBACK_RANDOM",
-        **checksums
+        "strategy": "combined_stratified_city_type" if not args.folds else f"stratified_{args.folds}fold_city_type",
+        "test_size": p if not args.folds else round(1 / args.folds, 6),
     }
+    per_variant = {name: {
+        "train_rows": int(len(mask) - mask.sum()),
+        "test_rows": int(mask.sum()),
+        "median_abs_diff_share": share_diff(key, n_keys, mask) if used_key else None,
+    } for name, mask in masks.items()}
 
-    # Optional: distribution similarity metric (median abs diff of key shares)
-    try:
-        import numpy as np
-        if used_key:
-            tr_share = train_df[used_key].value_counts(normalize=True).sort_index()
-            te_share = test_df[used_key].value_counts(normalize=True).sort_index()
-            common = tr_share.index.intersection(te_share.index)
-            manifest["median_abs_diff_share"] = float(np.median((tr_share.loc[common] - te_share.loc[common]).abs()))
-    except Exception:
-        pass
+    if args.mode == "index":
+        index_path = splits.write_folds(masks, outdir)
+        manifest = {
+            **base,
+            "source_file": Path(os.path.relpath(args.input.resolve(), outdir.resolve())).as_posix(),
+            "mode": "index",
+            "seeds": seeds,
+            **({"folds": args.folds} if args.folds else {}),
+            "rows_total": int(len(key)),
+            "stratify_key": used_key or "FALLBACK_RANDOM",
+            "dataset_digest": splits.dataset_digest(args.input),
+            "index_file": index_path.name,
+            "variants": [{"name": name, **v} for name, v in per_variant.items()],
+        }
+        manifest["index_sha1"] = stage.record(manifest, [index_path])[index_path]
+    else:
+        dirs = {name: outdir if single else outdir / name for name in masks}
+        outputs = write_variants(table, masks, dirs, args.write_csv)
+        del table
+        if single:
+            (name, v), = per_variant.items()
+            manifest = {
+                **base,
+                "seed": seeds[0],
+                **({"cities": args.cities} if args.cities else {}),
+                **({"types": args.types} if args.types else {}),
+                "rows_total": int(len(key)),
+                "train_rows": v["train_rows"],
+                "test_rows": v["test_rows"],
+                "stratify_key": used_key or "FALLBACK_RANDOM",
+            }
+            if v["median_abs_diff_share"] is not None:
+                manifest["median_abs_diff_share"] = v["median_abs_diff_share"]
+        else:
+            manifest = {
+                **base,
+                "seeds": seeds,
+                **({"folds": args.folds} if args.folds else {}),
+                **({"cities": args.cities} if args.cities else {}),
+                **({"types": args.types} if args.types else {}),
+                "rows_total": int(len(key)),
+                "stratify_key": used_key or "FALLBACK_RANDOM",
+                "variants": [{"name": name, "dir": name, **v} for name, v in per_variant.items()],
+            }
+
+        # All outputs hashed at once, in parallel, and recorded with the cache key
+        digests = stage.record(manifest, [p for c in outputs.values() for p in c.values()])
+        checksums = {name: {k: digests[p] for k, p in c.items()} for name, c in outputs.items()}
+        if single:
+            manifest.update(checksums[name])
+        else:
+            for v in manifest["variants"]:
+                v.update(checksums[v["name"]])
 
     with open(outdir / "manifest_combined.json", "w", encoding="utf-8") as f:
         json.dump(manifest, f, indent=2)
 
-    print("Combined stratified split done.")
+    print(f"Combined stratified split done in {time.time() - t0:.1f}s (cache key {stage.key[:12]}).")
     print(f"- Out: {outdir}")
     print(f"- Manifest: {outdir / 'manifest_combined.json'}")
     print(f"- Stratify key used: {manifest['stratify_key']}")
+    if not single:
+        print(f"- Variants: {len(masks)} ({', '.join(list(masks)[:4])}{', ...' if len(masks) > 4 else ''})")
 
 if __name__ == "__main__":
     main()
@@ -1,21 +1,29 @@
 #!/usr/bin/env python
 # split_loco.py
 # Deterministic Leave-One-City-Out splits.
+# Reads the City-partitioned dataset written by ingest_rooftops.py through FINAL/pipeline/rooftops.py:
+# the city list comes from the directory names and each fold reads only its own test / train cities.
+# --mode index writes no data at all: one folds.npz with each city's test rows as runs of row numbers of
+# the input dataset (FINAL/pipeline/splits.py); splits.Folds(outdir) yields the train / test views lazily.
 # Usage:
-#   python split_loco.py --input cleaned_datasets/all_cities_clean.parquet --outdir splits/cross_city_LOCO --write-csv
+#   python split_loco.py --input cleaned_datasets/rooftops --outdir splits/cross_city_LOCO --write-csv
+#   python split_loco.py --input cleaned_datasets/all_cities_clean.parquet --outdir splits/cross_city_LOCO
+#   python split_loco.py --input cleaned_datasets/rooftops --outdir splits/cross_city_LOCO --mode index
 
-import argparse, json, hashlib
+import argparse, json, os, sys, time
 from pathlib import Path
-import pandas as pd
+import pyarrow.compute as pc
 
-def sha1(path: Path) -> str:
-    h = hashlib.sha1()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1 << 20), b""):
-            h.update(chunk)
-    return h.hexdigest()
+REPO = Path(__file__).resolve().parents[2]
+sys.path.append(str(REPO / "FINAL" / "pipeline"))
+import rooftops  # noqa: E402
+import splits  # noqa: E402
+import stages  # noqa: E402
+
+STAGE_VERSION = 2  # bump when the split logic changes, so cached results are recomputed
 
 def write_pair(df_train, df_test, base_dir: Path, tag: str, write_csv: bool):
+    """Write one fold; returns {manifest checksum field: output path} (hashed later, in parallel)."""
     base_dir.mkdir(parents=True, exist_ok=True)
 
     p_train = base_dir / f"train_{tag}.parquet"
@@ -24,8 +32,8 @@ def write_pair(df_train, df_test, base_dir: Path, tag: str, write_csv: bool):
     df_test.to_parquet(p_test, index=False)
 
     out = {
-        "train_parquet_sha1": sha1(p_train),
-        "test_parquet_sha1": sha1(p_test),
+        "train_parquet_sha1": p_train,
+        "test_parquet_sha1": p_test,
     }
 
     if write_csv:
@@ -34,29 +42,82 @@ def write_pair(df_train, df_test, base_dir: Path, tag: str, write_csv: bool):
         df_train.to_csv(c_train, index=False)
         df_test.to_csv(c_test, index=False)
         out.update({
-            "train_csv_sha1": sha1(c_train),
-            "test_csv_sha1": sha1(c_test),
+            "train_csv_sha1": c_train,
+            "test_csv_sha1": c_test,
         })
     return out
 
+def write_index(source: Path, root: Path, stage) -> dict:
+    """Index-mode LOCO: one run-encoded test mask per city, over the rows of `source` in load order."""
+    city = rooftops.load(source, columns=["City"], as_arrow=True).column("City")
+    encoded = pc.dictionary_encode(city).combine_chunks()
+    codes = encoded.indices.to_numpy(zero_copy_only=False)
+    names = [str(c) for c in encoded.dictionary.to_pylist()]
+    order = sorted(range(len(names)), key=lambda k: names[k])
+    masks = {names[k]: codes == k for k in order}
+    index_path = splits.write_folds(masks, root)
+    manifest = {
+        "source_file": Path(os.path.relpath(source.resolve(), root.resolve())).as_posix(),
+        "strategy": "LOCO",
+        "mode": "index",
+        "rows_total": int(len(codes)),
+        "dataset_digest": splits.dataset_digest(source),
+        "index_file": index_path.name,
+        "cities": [{
+            "city": name,
+            "train_rows": int(len(codes) - mask.sum()),
+            "test_rows": int(mask.sum()),
+            "test_runs": int(len(splits.to_runs(mask)[0])),
+        } for name, mask in masks.items()],
+    }
+    manifest["index_sha1"] = stage.record(manifest, [index_path])[index_path]
+    return manifest
+
 def main():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--input", required=True, type=Path, help="Combined canonical dataset (parquet or csv)")
+    ap.add_argument("--input", required=True, type=Path, help="Partitioned dataset dir (ingest_rooftops.py) or combined parquet / csv")
     ap.add_argument("--outdir", required=True, type=Path, help="Output root folder")
     ap.add_argument("--write-csv", action="store_true", help="Also write CSV alongside Parquet")
+    ap.add_argument("--mode", choices=["files", "index"], default="files",
+                    help="files: train/test parquet per city; index: row-run manifests only (splits.Folds)")
+    ap.add_argument("--force", action="store_true", help="Recompute even if the stage cache has this result")
     args = ap.parse_args()
 
-    # Load
-    if args.input.suffix.lower() == ".parquet":
-        df = pd.read_parquet(args.input)
+    # Stage cache: same input content + parameters + STAGE_VERSION -> reuse the outputs as they are
+    t0 = time.time()
+    stage = stages.Stage("split_loco", STAGE_VERSION, [args.input],
+                         {"strategy": "LOCO", "mode": args.mode, "write_csv": args.write_csv},
+                         args.outdir, "manifest_loco.json")
+    if not args.force and stage.hit():
+        print(f"✅ Cache hit ({stage.key[:12]}): {args.outdir} is up to date, nothing to do.")
+        return
+
+    if args.mode == "index":
+        if args.input.suffix.lower() == ".csv":
+            raise ValueError("--mode index needs a Parquet file or partitioned dataset as --input")
+        manifest = write_index(args.input, args.outdir, stage)
+        with open(args.outdir / "manifest_loco.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        print(f"LOCO (index) done in {time.time() - t0:.1f}s: {len(manifest['cities'])} folds over "
+              f"{manifest['rows_total']:,} rows.")
+        print(f"- Index: {args.outdir / manifest['index_file']}")
+        print(f"- Manifest: {args.outdir / 'manifest_loco.json'}")
+        return
+
+    # Partitioned dataset (or a monolithic parquet / csv file)
+    if args.input.is_dir():
+        data = rooftops.dataset(args.input)
+        if "City" not in data.schema.names:
+            raise ValueError("Missing required column: City")
+        cities = [str(c) for c in rooftops.partitions(args.input).get("City", [])]
+        if not cities:
+            cities = sorted(rooftops.load(args.input, columns=["City"])["City"].astype(str).unique())
     else:
-        df = pd.read_csv(args.input)
-
-    for col in ["City"]:
-        if col not in df.columns:
-            raise ValueError(f"Missing required column: {col}")
+        df = rooftops.read(args.input)
+        if "City" not in df.columns:
+            raise ValueError("Missing required column: City")
+        cities = sorted(df["City"].astype(str).unique())
 
-    cities = sorted(df["City"].astype(str).unique())
     root = args.outdir
     root.mkdir(parents=True, exist_ok=True)
 
@@ -67,25 +128,38 @@ def main():
     }
 
     for city in cities:
-        test_mask = df["City"].astype(str) == city
-        df_test  = df.loc[test_mask].copy()
-        df_train = df.loc[~test_mask].copy()
+        if args.input.is_dir():
+            # Pushdown: only the held-out city's partitions for test, the rest for train
+            df_test = rooftops.load(args.input, cities=[city])
+            df_train = rooftops.load(args.input, filter=~rooftops.where(args.input, cities=[city]))
+        else:
+            test_mask = df["City"].astype(str) == city
+            df_test  = df.loc[test_mask].copy()
+            df_train = df.loc[~test_mask].copy()
 
         city_safe = city.replace("/", "-").replace("\\", "-").replace(" ", "_")
         cdir = root / city_safe
-        checksums = write_pair(df_train, df_test, cdir, tag=f"LOCO_{city_safe}", write_csv=args.write_csv)
+        outputs = write_pair(df_train, df_test, cdir, tag=f"LOCO_{city_safe}", write_csv=args.write_csv)
 
         manifest["cities"].append({
             "city": city,
             "train_rows": int(len(df_train)),
             "test_rows": int(len(df_test)),
-            **checksums
+            **outputs
         })
+        del df_train, df_test
+
+    # All outputs hashed at once, in parallel, and recorded with the cache key
+    paths = [p for c in manifest["cities"] for k, p in c.items() if k.endswith("_sha1")]
+    digests = stage.record(manifest, paths)
+    for c in manifest["cities"]:
+        for k in [k for k in c if k.endswith("_sha1")]:
+            c[k] = digests[c[k]]
 
     with open(root / "manifest_loco.json", "w", encoding="utf-8") as f:
         json.dump(manifest, f, indent=2)
 
-    print("LOCO done.")
+    print(f"LOCO done in {time.time() - t0:.1f}s (cache key {stage.key[:12]}).")
     print(f"- Out: {root}")
     print(f"- Manifest: {root / 'manifest_loco.json'}")
 